@@ -3,9 +3,17 @@
 
     :author - Nick Tripp, 2018
 """
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
-from med_heap import MedianHeap
+from latency import LatencyHistogram
+from med_heap import MedianHeap, IndexedMedianHeap, SortedWindow
 
 class RangeFilter:
     """
@@ -35,16 +43,19 @@ class RangeFilter:
         self.min = minimum
         self.max = maximum
 
-    def update(self, scan):
+    def update(self, scan, out=None):
         """
         A range filter. Numpy does all the heavy lifting.
 
+        The filter is elementwise, so 'scan' may also be a 2D block of scans.
+
         Params:
         :scan - an input array
+        :out - an optional array of the same shape to write the result into; it may be 'scan' itself, to filter in place.
 
-        :return - a range-filtered array
+        :return - a range-filtered array (which is 'out', if given)
         """
-        return np.clip(scan, self.min, self.max)
+        return np.clip(scan, self.min, self.max, out=out)
 
 
 class TemporalMedianFilter:
@@ -59,24 +70,57 @@ class TemporalMedianFilter:
 
     The update function returns an array with each entry a median of the elements at the same index of previous scans within the window.
 
-    This median filter is implemented in two different versions (via a Median Heap or via numpy) and the type is specified in the constructor.
+    This median filter is implemented in several different versions (via a Median Heap, via an indexed Median Heap, via a per-column sorted list, via numpy, via a sorted window, via quantized histograms, via array-backed median heaps, or via exponentially decayed histograms) and the type is specified in the constructor.
     """
 
     TYPE_HEAP  = "TYPE_HEAP"
     TYPE_NUMPY = "TYPE_NUMPY"
-    TYPES = {TYPE_HEAP, TYPE_NUMPY}
+    TYPE_SORTED = "TYPE_SORTED"
+    TYPE_INDEXED_HEAP = "TYPE_INDEXED_HEAP"
+    TYPE_HISTOGRAM = "TYPE_HISTOGRAM"
+    TYPE_SORTED_WINDOW = "TYPE_SORTED_WINDOW"
+    TYPE_HEAP_ARRAY = "TYPE_HEAP_ARRAY"
+    TYPE_DECAYED = "TYPE_DECAYED"
+    TYPES = {TYPE_HEAP, TYPE_NUMPY, TYPE_SORTED, TYPE_INDEXED_HEAP, TYPE_HISTOGRAM, TYPE_SORTED_WINDOW, TYPE_HEAP_ARRAY, TYPE_DECAYED}
+    APPROXIMATE_TYPES = {TYPE_HISTOGRAM, TYPE_DECAYED} # Types whose medians are only accurate to within a documented error bound
+    SKETCH_TYPES = {TYPE_DECAYED} # Types that keep no scan history at all, only a fixed-size summary of every column
+    HEAP_TYPES = { TYPE_HEAP:MedianHeap, TYPE_INDEXED_HEAP:IndexedMedianHeap, TYPE_SORTED_WINDOW:SortedWindow } # Maps per-column filter types to the push/remove/median structure each column uses
+    BATCH_CHUNK_SIZE = 1 << 22 # The maximum number of elements update_batch() copies out of the sliding windows at once
+
+    MIN_RANGE = 0.03 # The smallest measurable distance
+    MAX_RANGE = 50.0 # The largest measurable distance
+    HISTOGRAM_BLOCK = 64 # The number of histogram bins summarized by each coarse count of TYPE_HISTOGRAM (and TYPE_DECAYED)
+    DECAYED_RENORMALIZE = 1e100 # The weight increment of TYPE_DECAYED above which every weight is rescaled
+    # Types that process whole columns at once in numpy kernels (which release the GIL), and so can be split into tiles of columns.
+    # TYPE_HEAP_ARRAY is not one: each update is a python loop of many small array operations, so every extra tile repeats that loop under the GIL.
+    VECTORIZED_TYPES = {TYPE_NUMPY, TYPE_SORTED, TYPE_HISTOGRAM, TYPE_DECAYED}
+    TILE_SIZE = 1 << 18 # The target number of bytes of window data per tile, so that a tile's working set fits in cache
+
+    TYPE_AUTO = "TYPE_AUTO" # Not a type itself: picks the fastest exact type for the filter's specs on this machine (see auto_type())
+    PROFILE_PATH = os.path.join(os.path.expanduser("~"), ".temporal_median_filter_profile.json") # The default calibration profile for TYPE_AUTO
+    CALIBRATION_SCANS = 20 # The number of timed updates per type when calibrating TYPE_AUTO
+    CALIBRATION_DROPOUTS = 0.05 # The fraction of samples that are dropouts (NaN) in the calibration scans, when calibrating for drop_invalid
 
-    def __init__(self, window, scan_size, f_type=TYPE_HEAP):
+    DTYPES = {np.dtype(np.float64), np.dtype(np.float32), np.dtype(np.uint16)} # The types the scan history (and every engine) can store values as
+    UINT16_SCALE = 0.001 # The default units per uint16 step, i.e. millimetres for scans in metres
+
+    def __init__(self, window, scan_size, f_type=TYPE_HEAP, resolution=0.01, n_threads=None, profile_path=None, dtype=np.float64, scale=None, drop_invalid=False, min_valid=1):
         """
         Creates a new Median Filter with the given specs.
 
         Params:
         :window - the filter's window size. After 'window' number of calls to the update function,
         :scan_size - the fixed width of each scan of the input stream
-        :f_type - either 'TYPE_HEAP' or 'TYPE_NUMPY', indicating this filter uses a median heap or numpy.median, respectively.
+        :f_type - one of 'TYPE_HEAP', 'TYPE_NUMPY', 'TYPE_SORTED', 'TYPE_INDEXED_HEAP', 'TYPE_HISTOGRAM', 'TYPE_SORTED_WINDOW', 'TYPE_HEAP_ARRAY' or 'TYPE_DECAYED', indicating this filter uses a median heap, numpy.median, a sorted window, an eagerly-deleting (bounded memory) median heap, quantized histograms, a per-column order-statistic sorted list, median heaps for every column held in shared numpy arrays or exponentially decayed histograms (with no scan history), respectively.
+        :resolution - the width of each histogram bin used by 'TYPE_HISTOGRAM' and 'TYPE_DECAYED', in the same units as the scans.  Medians of values within [MIN_RANGE, MAX_RANGE] are off by at most resolution / 2.  Ignored by the other types.
+            f_type may also be 'TYPE_AUTO', in which case the fastest exact type is picked by auto_type().
+        :n_threads - if > 1, the columns of each scan are split into cache-sized tiles, which are processed by a persistent pool of this many threads.  Only used by the vectorized types (see VECTORIZED_TYPES); call close() to stop the pool.
+        :profile_path - the calibration profile used by 'TYPE_AUTO'; defaults to PROFILE_PATH.
+        :dtype - the type every value is stored as, by the history buffer and by every engine: float64 (the default), float32, or uint16.  float32 halves, and uint16 quarters, the memory of the window, which helps cache behaviour for large windows.  Values are only converted back to float64 on output.
+        :scale - for uint16 only, the units per stored step; each value is stored as round(value / scale), clipped to [0, 65535].  Defaults to UINT16_SCALE, i.e. millimetres, which covers [0, 65.535] for scans in metres.  uint16 has no NaN, so without drop_invalid, a scan holding NaN is rejected (see encode()).
+        :drop_invalid - if True, invalid samples (dropouts: NaN, inf, or values <= 0; see valid_mask()) are left out of every column's window, and each median is taken over the column's valid samples only.  Every engine tracks the number of valid samples per column incrementally (see count_valid()), so this never falls back to a full nanmedian per scan.  For uint16, invalid samples are stored as 0 (as is any value that rounds to 0).
+        :min_valid - with drop_invalid, the fewest valid samples a column's window must hold for its median to be reported; columns with fewer are NaN.  For TYPE_DECAYED, the valid samples are counted with the same decayed weights as the histograms.
         """
-        self.scans = None
-
         if (window < 1):
             raise ValueError("TemporalMedianFilter: window size must be > 0")
         self.window = window
@@ -85,70 +129,1510 @@ class TemporalMedianFilter:
             raise ValueError("TemporalMedianFilter: scan_size must be > 0")
         self.scan_size = scan_size
 
+        if (n_threads is not None and n_threads < 1):
+            raise ValueError("TemporalMedianFilter: n_threads must be > 0")
+
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in TemporalMedianFilter.DTYPES:
+            raise ValueError("TemporalMedianFilter: dtype must be float64, float32 or uint16")
+        if (self.dtype == np.uint16):
+            self.scale = TemporalMedianFilter.UINT16_SCALE if scale is None else scale
+            if (self.scale <= 0):
+                raise ValueError("TemporalMedianFilter: scale must be > 0")
+        elif (scale is not None):
+            raise ValueError("TemporalMedianFilter: scale only applies to the uint16 dtype")
+        else:
+            self.scale = None
+
+        if f_type == TemporalMedianFilter.TYPE_AUTO:
+            f_type = TemporalMedianFilter.auto_type(window, scan_size, n_threads=n_threads, profile_path=profile_path, dtype=self.dtype, drop_invalid=drop_invalid)
         if f_type not in TemporalMedianFilter.TYPES:
             raise ValueError("TemporalMedianFilter: f_type must be valid type")
         self.type= f_type
 
-        self.med_heaps = [MedianHeap() for i in range(scan_size)]
+        if (not drop_invalid and min_valid != 1):
+            raise ValueError("TemporalMedianFilter: min_valid only applies with drop_invalid")
+        if (min_valid < 1 or min_valid > window + 1):
+            raise ValueError("TemporalMedianFilter: min_valid must be within [1, window + 1]")
+        self.drop_invalid = drop_invalid
+        self.min_valid = min_valid
+        # The number of valid samples in every column's window, kept up to date while drop_invalid is set.
+        self.valid = np.zeros((scan_size,), dtype=np.float64 if f_type in TemporalMedianFilter.SKETCH_TYPES else np.intp)
+        # The engines that order their windows store each invalid sample as a value below every valid one, so the invalid samples sort first.
+        self.sentinel = np.array(0 if self.dtype == np.uint16 else -np.inf, dtype=self.dtype)
+        # Without drop_invalid, the number of NaNs in every column's window, for the engines that can't order NaN (see count_nans()).
+        self.nans = np.zeros((scan_size,), dtype=np.intp)
+
+        # Each scan is converted to self.dtype here, before any engine sees it, so every engine works on exactly the stored values.
+        self.encoded = np.empty((scan_size,), dtype=self.dtype) if self.dtype != np.float64 else None
+
+        if f_type in TemporalMedianFilter.HEAP_TYPES:
+            heap_class = TemporalMedianFilter.HEAP_TYPES[f_type]
+            self.med_heaps = [heap_class() for i in range(scan_size)]
+        else:
+            self.med_heaps = []
+
+        # The scan history is a preallocated circular buffer holding the 'window + 1' most recent scans.
+        # 'head' is the row the next scan is written to; once the buffer is full, that row holds the oldest (expiring) scan.
+        self.capacity = window + 1
+        # TYPE_DECAYED never looks at an old scan again, so it keeps no history at all.
+        self.scans = np.empty((0 if f_type in TemporalMedianFilter.SKETCH_TYPES else self.capacity, scan_size), dtype=self.dtype)
+        self.head = 0
+        self.count = 0
+        # While a scan is staged (see stage_scan()), the expired scan is kept here, since its row is being overwritten.
+        self.expired = np.empty((scan_size,), dtype=self.dtype)
+        self.staged = False
 
+        # TYPE_SORTED keeps every column of the history sorted; rows [0, count) are valid.
+        self.sorted = np.empty((self.capacity, scan_size), dtype=self.dtype) if f_type == TemporalMedianFilter.TYPE_SORTED else None
+        self.rows = np.arange(self.capacity)[:, None]
+        # TYPE_NUMPY partitions a transposed copy of the history in place, so each column's window is contiguous in memory.
+        self.scratch = np.empty((scan_size, self.capacity), dtype=self.dtype) if f_type == TemporalMedianFilter.TYPE_NUMPY else None
+        # ... and reduces the upper half of each column's window into this, to find the windows holding a NaN (see window_median()).
+        self.top = np.empty((scan_size,), dtype=self.dtype) if f_type == TemporalMedianFilter.TYPE_NUMPY else None
+        self.cols = np.arange(scan_size)
 
-    def numpy_update(self, scan):
+        if (f_type == TemporalMedianFilter.TYPE_HEAP_ARRAY):
+            self.init_heap_arrays()
+        else:
+            self.heap_vals = None
+            self.heap_rows = None
+            self.heap_sizes = None
+            self.heap_side = None
+            self.heap_pos = None
+
+        if (f_type == TemporalMedianFilter.TYPE_HISTOGRAM):
+            self.init_histogram(resolution)
+        elif (f_type == TemporalMedianFilter.TYPE_DECAYED):
+            self.init_histogram(resolution, count_type=np.float64)
+            # Rather than decaying every weight by (1 - 1 / capacity) per scan, each new scan is added with a weight (1 - 1 / capacity)^-t that grows instead; only the ratios of the weights matter.
+            self.growth = self.capacity / (self.capacity - 1)
+            self.gain = 1.0
+            self.total = np.zeros((scan_size,)) # The total weight of each column's histogram
+            self.nan_age = np.full((scan_size,), self.capacity, dtype=np.intp) # Without drop_invalid, the number of scans since each column's newest NaN, up to capacity
+        else:
+            self.hist = None
+            self.coarse = None
+
+        self.latency = None # A LatencyHistogram of update() calls, while instrumentation is enabled
+
+        self.n_threads = n_threads or 1
+        self.pool = None
+        self.tiles = [(0, scan_size)]
+        if (self.n_threads > 1 and f_type in TemporalMedianFilter.VECTORIZED_TYPES):
+            self.init_tiles()
+
+    def init_tiles(self):
         """
-        A sliding-window-median filter using numpy.median to compute a running median.
+        Splits the columns into tiles of about TILE_SIZE bytes of window data each (and at least one tile per thread), and starts the thread pool.
+
+        Every tile works on its own columns of the preallocated engine buffers (e.g. its own rows of the numpy scratch buffer), so the tiles never share any scratch memory.
+        """
+        tiles = -(-self.scan_size * self.capacity * self.dtype.itemsize // self.TILE_SIZE)
+        tiles = min(self.scan_size, max(tiles, self.n_threads))
+        bounds = np.linspace(0, self.scan_size, tiles + 1).astype(int)
+        self.tiles = [(int(lo), int(hi)) for (lo, hi) in zip(bounds[:-1], bounds[1:])]
+        self.pool = ThreadPoolExecutor(max_workers=self.n_threads)
+
+    def close(self):
+        """ Stops the thread pool, if there is one; the filter keeps working afterwards, on a single thread. """
+        if (self.pool is not None):
+            self.pool.shutdown()
+            self.pool = None
+            self.tiles = [(0, self.scan_size)]
+
+    @staticmethod
+    def calibrate(window, scan_size, n_threads=None, dtype=np.float64, drop_invalid=False):
+        """
+        Times every exact type on random data with the given specs, on this machine.
+
+        Each filter is first filled up with a full window of scans in bulk, with restore(), so that the timed updates are in the steady state without replaying the window one update at a time.  The dtype and drop_invalid specs change which type is fastest (e.g. with drop_invalid, TYPE_NUMPY sorts every window in full), so the filters are timed with them; with drop_invalid, CALIBRATION_DROPOUTS of the samples are dropouts.
+
+        :return - a dict mapping each exact type to its mean time per update(), in seconds.
+        """
+        rng = np.random.RandomState(0)
+        scans = rng.uniform(TemporalMedianFilter.MIN_RANGE, TemporalMedianFilter.MAX_RANGE, size=(window + 1 + TemporalMedianFilter.CALIBRATION_SCANS, scan_size))
+        if (drop_invalid):
+            scans[rng.uniform(size=scans.shape) < TemporalMedianFilter.CALIBRATION_DROPOUTS] = np.nan
+        out = np.empty(scan_size)
+
+        times = {}
+        for f_type in sorted(TemporalMedianFilter.TYPES - TemporalMedianFilter.APPROXIMATE_TYPES):
+            med_filter = TemporalMedianFilter(window, scan_size, f_type=f_type, n_threads=n_threads, dtype=dtype, drop_invalid=drop_invalid)
+            med_filter.restore(med_filter.encode(scans[:window + 1]))
+
+            start = time.perf_counter()
+            for scan in scans[window + 1:]:
+                med_filter.update(scan, out=out)
+            times[f_type] = (time.perf_counter() - start) / TemporalMedianFilter.CALIBRATION_SCANS
+            med_filter.close()
+        return times
+
+    @staticmethod
+    def auto_type(window, scan_size, n_threads=None, profile_path=None, dtype=np.float64, drop_invalid=False):
+        """
+        Picks the fastest exact type for the given specs on this machine.
+
+        The choice is cached in a JSON calibration profile, keyed by the specs, so calibrate() only runs the first time a set of specs is seen.  An unreadable profile is treated as empty, and is rewritten.
+
+        :return - the fastest type.
+        """
+        if (profile_path is None):
+            profile_path = TemporalMedianFilter.PROFILE_PATH
+        key = "window={},scan_size={},n_threads={},dtype={},drop_invalid={}".format(window, scan_size, n_threads or 1, np.dtype(dtype).name, bool(drop_invalid))
+
+        try:
+            with open(profile_path) as profile_file:
+                profile = json.load(profile_file)
+        except (OSError, ValueError):
+            profile = {}
+        if (not isinstance(profile, dict)):
+            profile = {}
+
+        entry = profile.get(key)
+        if (isinstance(entry, dict) and entry.get("type") in TemporalMedianFilter.TYPES):
+            return entry["type"]
+
+        times = TemporalMedianFilter.calibrate(window, scan_size, n_threads=n_threads, dtype=dtype, drop_invalid=drop_invalid)
+        best = min(times, key=times.get)
+        profile[key] = { "type":best, "times":times }
+
+        # Write to a temporary file first, so a concurrent reader never sees a half-written profile.
+        tmp_path = "{}.{}.tmp".format(profile_path, os.getpid())
+        with open(tmp_path, "w") as profile_file:
+            json.dump(profile, profile_file, indent=2, sort_keys=True)
+        os.replace(tmp_path, profile_path)
+
+        return best
+
+    def init_histogram(self, resolution, count_type=None):
+        """
+        Allocates the per-column count histograms used by TYPE_HISTOGRAM (and the weight histograms used by TYPE_DECAYED).
+
+        The range [MIN_RANGE, MAX_RANGE] is split into bins of width 'resolution', padded up to a multiple of HISTOGRAM_BLOCK bins.  Each column keeps a count of the window's values in every bin (self.hist), and a count of the values in every block of HISTOGRAM_BLOCK bins (self.coarse), so that a rank can be found without scanning every bin.
 
         Params:
-        :scan - an input array of size self.scan_size.
+        :count_type - the type of the counts; defaults to the smallest integer type that holds the window size.
+        """
+        if (resolution <= 0):
+            raise ValueError("TemporalMedianFilter: resolution must be > 0")
+        self.resolution = resolution
+        self.bins = int(np.ceil((self.MAX_RANGE - self.MIN_RANGE) / resolution))
+        blocks = -(-self.bins // self.HISTOGRAM_BLOCK)
+
+        # Every count is bounded by the window, so the smallest integer type that holds 'capacity' is enough.
+        if (count_type is None):
+            count_type = np.uint16 if self.capacity < np.iinfo(np.uint16).max else np.uint32
+        self.hist = np.zeros((self.scan_size, blocks * self.HISTOGRAM_BLOCK), dtype=count_type)
+        self.coarse = np.zeros((self.scan_size, blocks), dtype=count_type)
+        self.block_offsets = np.arange(self.HISTOGRAM_BLOCK)
+
+    def init_heap_arrays(self):
+        """
+        Allocates the median heaps of every column used by TYPE_HEAP_ARRAY, as a structure of arrays.
+
+        Side 0 of each array is every column's maxHeap (the lower half of its window), and side 1 its minHeap (the upper half); row k of a side holds node k of every column's heap, in the usual implicit binary-heap layout.  Each node also records the history row its value came from, and each history row records the side and position of its node, so that an expired value's node is found in O(1).
+        """
+        # With drop_invalid, the maxHeap also holds every invalid sample, so either heap may hold the whole window.
+        half = self.capacity if self.drop_invalid else (self.capacity + 1) // 2
+        self.heap_vals = np.zeros((2, half, self.scan_size), dtype=self.dtype) # The value of every node
+        self.heap_rows = np.zeros((2, half, self.scan_size), dtype=np.intp) # The history row each node's value came from
+        self.heap_sizes = np.zeros((2, self.scan_size), dtype=np.intp) # The number of nodes in every column's heaps
+        self.heap_side = np.zeros((self.capacity, self.scan_size), dtype=np.intp) # The heap (0 or 1) holding each history value
+        self.heap_pos = np.zeros((self.capacity, self.scan_size), dtype=np.intp) # The node index of each history value
 
-        :return - the current running-window median, computed using numpy.median over a 2D array of scans*window_size.
+    def is_full(self):
+        """ Returns True if the history buffer is full, i.e. the next update pushes the oldest scan out of the window. """
+        return self.count == self.capacity
+
+    def expired_scan(self):
+        """
+        Peeks at the scan that the next update will push out of the window.
+
+        NOTE: the result is a view into the history buffer (or, while a scan is staged, into self.expired), so it is overwritten by the next call to store_scan().
+
+        :Runtime: O(1)
+
+        :return - the oldest scan in the history buffer, or None if the buffer is not yet full.
+        """
+        if (not self.is_full()):
+            return None
+        if (self.staged):
+            return self.expired
+        return self.scans[self.head]
+
+    def stage_scan(self):
         """
-        if (self.scans is None):
-            self.scans = np.reshape(scan, (1, scan.shape[0]))
-        elif (self.scans.shape[0] <= self.window):
-            self.scans = np.vstack((self.scans, scan))
+        Returns the row of the history buffer that the next scan will be stored in, so that a caller (e.g. a FilterChain) can write the next scan straight into it, without an intermediate array.
+
+        If the buffer is full, that row holds the expired scan, which is first copied aside to self.expired.  The caller must then write the scan into the returned row, and pass the row to update().
+
+        NOTE: the row is of self.dtype, so for the uint16 dtype, whose values must be scaled first, stage into a float buffer instead (see can_stage()).
+
+        :Runtime: O(scan_size)
+
+        :return - a writable view of the next history row.
+        """
+        if (self.is_full() and not self.staged):
+            np.copyto(self.expired, self.scans[self.head])
+        self.staged = True
+        return self.scans[self.head]
+
+    def can_stage(self):
+        """ Returns whether a scan can be written straight into the history with stage_scan(), i.e. whether there is a history, and its values are floats. """
+        return self.scale is None and self.type not in self.SKETCH_TYPES
+
+    def encode(self, scans):
+        """
+        Converts a scan (or a 2D block of scans) to the stored self.dtype; for uint16, that is round(value / scale), clipped to [0, 65535].
+
+        uint16 can't hold NaN, nor remember which stored samples were NaN once they expire, so a NaN can't be propagated as the float dtypes do.  Without drop_invalid, scans holding NaN are rejected rather than silently stored as 0; the filter is left unchanged.
+
+        :return - the converted scans; 'scans' itself for the float64 dtype.  A single scan is converted into a reused buffer.
+        """
+        if (self.encoded is None):
+            return scans
+        scans = np.asarray(scans)
+        out = self.encoded if scans.ndim == 1 else np.empty(scans.shape, dtype=self.dtype)
+        if (self.scale is None):
+            np.copyto(out, scans, casting='unsafe')
         else:
-            self.scans = np.vstack((self.scans[1:], scan))
-        return np.median(self.scans, axis=0)
+            if (self.drop_invalid):
+                # Invalid samples (including NaN and inf, which have no uint16 value) are stored as 0.
+                scans = np.where(self.valid_mask(scans), scans, 0)
+            elif (np.isnan(scans).any()):
+                raise ValueError("TemporalMedianFilter: the uint16 dtype cannot store NaN; use drop_invalid to filter out dropouts")
+            np.copyto(out, np.clip(np.rint(np.divide(scans, self.scale)), 0, np.iinfo(np.uint16).max), casting='unsafe')
+        return out
+
+    @staticmethod
+    def valid_mask(values):
+        """ Returns which values are valid samples: finite, and > 0.  A beam with no return reads as NaN, 0 or inf, depending on the sensor. """
+        # NaN fails both comparisons.
+        return (values > 0) & (values < np.inf)
+
+    def count_valid(self, scan):
+        """
+        Updates the number of valid samples in every column's window for a new scan, and for the scan it pushes out of the window.  Called by the engines, with drop_invalid set, before the new scan is stored.
+
+        :Runtime: O(scan_size)
+
+        :return - the valid masks of the new scan and of the expired scan (None while the window is filling).
+        """
+        new_valid = self.valid_mask(scan)
+        expired = self.expired_scan()
+        expired_valid = None if expired is None else self.valid_mask(expired)
+
+        self.valid += new_valid
+        if (expired_valid is not None):
+            self.valid -= expired_valid
+        return new_valid, expired_valid
 
-    def heap_update(self, scan):
+    def count_nans(self, scan):
+        """
+        Updates the number of NaNs in every column's window for a new scan, and for the scan it pushes out of the window.  Called (without drop_invalid) by the engines that order their windows, before the new scan is stored.
+
+        NaN has no order, so those engines store it as -inf instead, and a column reports NaN for as long as its window holds one (see engine_update()), just as numpy.median does.
+
+        :Runtime: O(scan_size)
+
+        :return - the new scan and the expired scan (None while the window is filling), with every NaN replaced by -inf; the arrays themselves if they hold no NaN.
+        """
+        expired = self.expired_scan()
+        new_nan = np.isnan(scan)
+        if (new_nan.any()):
+            self.nans += new_nan
+            scan = np.where(new_nan, -np.inf, scan)
+        if (expired is not None):
+            expired_nan = np.isnan(expired)
+            if (expired_nan.any()):
+                self.nans -= expired_nan
+                expired = np.where(expired_nan, -np.inf, expired)
+        return scan, expired
+
+    def mask_invalid(self, values, valid):
+        """ Returns a copy of the values in which every invalid sample is replaced by self.sentinel, which orders below every valid sample. """
+        return np.where(valid, values, self.sentinel)
+
+    def valid_median(self, ordered, valid, out):
+        """
+        Computes the median of the valid samples of each column of a window sorted along axis 0, in which the invalid samples (see mask_invalid()) sort first.
+
+        Params:
+        :ordered - a (size, columns) array, each column sorted.
+        :valid - the number of valid samples of each column.
+        :out - the array of size columns to write the medians into; columns without a valid sample get a meaningless value.
+        """
+        cols = self.cols[:len(valid)]
+        size = len(ordered)
+        first = size - valid
+        lower = first + (valid - 1) // 2
+        upper = np.minimum(first + valid // 2, size - 1)
+        np.add(ordered[lower, cols], ordered[upper, cols], out=out, dtype=out.dtype)
+        np.divide(out, 2.0, out=out)
+        return out
+
+    def store_scan(self, scan):
+        """
+        Writes a scan into the history buffer, overwriting the oldest scan once the buffer is full.
+
+        If the scan was staged with stage_scan(), it is already in place, and the write copies the row onto itself.
+
+        :Runtime: O(scan_size); a single row write, the buffer itself is never reallocated.
+        """
+        self.scans[self.head] = scan
+        self.head = (self.head + 1) % self.capacity
+        if (self.count < self.capacity):
+            self.count += 1
+        self.staged = False
+
+    def history(self):
+        """
+        Returns a copy of the scans in the history buffer, oldest first, as stored (i.e. of self.dtype).
+
+        :Runtime: O(count * scan_size)
+
+        :return - a (count, scan_size) array.
+        """
+        if (self.type in self.SKETCH_TYPES):
+            raise ValueError("TemporalMedianFilter: {} keeps no scan history".format(self.type))
+        if (not self.is_full()):
+            return self.scans[:self.count].copy()
+        return np.concatenate((self.scans[self.head:], self.scans[:self.head]))
+
+    def restore(self, scans):
+        """
+        Replaces the filter's state with the given history, rebuilding the engine in bulk rather than replaying update() once per scan.
+
+        Every column's window is sorted once with a single np.sort (or np.argsort); TYPE_SORTED takes the sorted window as-is, and the heap types build each heap straight from its sorted column (see MedianHeap.from_sorted()).  TYPE_HISTOGRAM counts every bin at once with np.bincount, and TYPE_NUMPY needs nothing beyond the history itself.
+
+        :Runtime: O(m * log(m)) per column, where m is the number of scans, dominated by the vectorized sort.
+
+        Params:
+        :scans - a (count, scan_size) array of at most self.capacity scans, oldest first, as returned by history(); i.e. values already stored as self.dtype (uint16 values are in units of self.scale).
+        """
+        if (self.type in self.SKETCH_TYPES):
+            raise ValueError("TemporalMedianFilter: {} keeps no scan history".format(self.type))
+        scans = np.asarray(scans).astype(self.dtype, copy=False)
+        if (scans.ndim != 2 or scans.shape[1] != self.scan_size or len(scans) > self.capacity):
+            raise ValueError("TemporalMedianFilter.restore(): scans must be of shape (count, self.scan_size), with count <= self.capacity")
+
+        count = len(scans)
+        self.scans[:count] = scans
+        self.count = count
+        self.head = count % self.capacity
+        self.staged = False
+
+        # With drop_invalid, the invalid samples sort first, and only the valid ones count.
+        valid = np.full((self.scan_size,), count)
+        values = scans
+        if (self.drop_invalid):
+            mask = self.valid_mask(scans)
+            valid = self.valid[:] = np.count_nonzero(mask, axis=0)
+            values = self.mask_invalid(scans, mask)
+        elif (self.type != self.TYPE_NUMPY):
+            # As in count_nans(), NaN is ordered as -inf.  (TYPE_NUMPY doesn't count NaNs: window_median() finds them in the history itself.)
+            nan = np.isnan(scans)
+            self.nans[:] = np.count_nonzero(nan, axis=0)
+            if (self.nans.any()):
+                values = np.where(nan, -np.inf, scans)
+
+        if (self.type == self.TYPE_SORTED):
+            self.sorted[:count] = np.sort(values, axis=0)
+        elif (self.type in self.HEAP_TYPES):
+            heap_class = self.HEAP_TYPES[self.type]
+            self.med_heaps = [heap_class.from_sorted(column[count - n:]) for column, n in zip(np.sort(values, axis=0).T.tolist(), valid.tolist())]
+        elif (self.type == self.TYPE_HEAP_ARRAY):
+            # As in MedianHeap.from_sorted(), the reversed lower part of each sorted column is a valid maxHeap, and the rest a valid minHeap.
+            order = np.argsort(values, axis=0)
+            split = self.heap_split(count, valid)
+            nodes = np.arange(count)[:, None]
+            cols = np.broadcast_to(self.cols, order.shape)
+            for side, src, size in ((0, split - 1 - nodes, split), (1, split + nodes, count - split)):
+                used = nodes < size
+                rows = np.take_along_axis(order, np.where(used, src, 0), axis=0)[used]
+                c, n = cols[used], np.broadcast_to(nodes, order.shape)[used]
+                self.heap_vals[side, n, c] = values[rows, c]
+                self.heap_rows[side, n, c] = rows
+                self.heap_side[rows, c] = side
+                self.heap_pos[rows, c] = n
+                self.heap_sizes[side] = size
+        elif (self.type == self.TYPE_HISTOGRAM):
+            bins = self.quantize(scans) + self.cols * self.hist.shape[1]
+            weights = mask.ravel() if self.drop_invalid else None
+            self.hist[:] = np.bincount(bins.ravel(), weights=weights, minlength=self.hist.size).reshape(self.hist.shape)
+            self.coarse[:] = self.hist.reshape(self.scan_size, -1, self.HISTOGRAM_BLOCK).sum(axis=2)
+
+    def save(self, path):
+        """
+        Saves a snapshot of the filter to a '.npz' file: its specs, and its scan history as one binary array.  Types without a scan history (see SKETCH_TYPES) cannot be saved.
+
+        Restore it with TemporalMedianFilter.load(), e.g. to warm-start a restarted process with a full window.
+
+        Params:
+        :path - the file to write.
+        """
+        specs = {
+            "window": self.window,
+            "scan_size": self.scan_size,
+            "type": self.type,
+            "dtype": self.dtype.name,
+            "scale": self.scale,
+            "resolution": self.resolution if self.hist is not None else None,
+            "drop_invalid": self.drop_invalid,
+            "min_valid": self.min_valid
+        }
+        with open(path, "wb") as snapshot:
+            np.savez(snapshot, specs=np.array(json.dumps(specs)), scans=self.history())
+
+    @classmethod
+    def load(cls, path, n_threads=None):
+        """
+        Creates a filter from a snapshot written by save(), with the same specs and history, ready for the next scan.
+
+        The engine is rebuilt in bulk (see restore()), so loading a full window takes milliseconds rather than a replay of every scan.
+
+        Params:
+        :path - the snapshot file.
+        :n_threads - as for the constructor; not part of the snapshot, since it depends on the machine.
+
+        :return - the restored TemporalMedianFilter.
+        """
+        with np.load(path, allow_pickle=False) as snapshot:
+            specs = json.loads(str(snapshot["specs"]))
+            scans = snapshot["scans"]
+
+        med_filter = cls(
+            specs["window"], specs["scan_size"], f_type=specs["type"], n_threads=n_threads,
+            resolution=specs["resolution"] if specs["resolution"] is not None else 0.01,
+            dtype=specs["dtype"], scale=specs["scale"],
+            drop_invalid=specs.get("drop_invalid", False), min_valid=specs.get("min_valid", 1)
+        )
+        med_filter.restore(scans)
+        return med_filter
+
+    def map_tiles(self, tile_func, *args):
+        """
+        Runs a vectorized engine's tile function over every tile of columns.
+
+        Without a thread pool, the whole scan is a single tile.  With one, the tiles run concurrently on the pool; numpy releases the GIL inside its sort, partition and gather kernels, so the tiles genuinely run in parallel.
+
+        Params:
+        :tile_func - a function called as tile_func(lo, hi, *args), which processes columns [lo, hi) only.
+        """
+        if (self.pool is None):
+            tile_func(0, self.scan_size, *args)
+            return
+
+        futures = [self.pool.submit(tile_func, lo, hi, *args) for (lo, hi) in self.tiles]
+        for future in futures:
+            future.result()
+
+    def numpy_update(self, scan, out=None):
+        """
+        A sliding-window-median filter using numpy to compute a running median.
+
+        Rather than numpy.median, which copies the window, sorts it and allocates a new result every call, the window is copied into a preallocated scratch buffer and partitioned in place (introselect), which only places the middle one or two order statistics of each column.  If 'out' is given, nothing is allocated at all.
+
+        :Runtime: O(m) per column, where m is the window size.
+
+        Params:
+        :scan - an input array of size self.scan_size.
+        :out - an optional array of size self.scan_size to write the result into.
+
+        :return - the current running-window median, computed exactly as numpy.median computes it.
+        """
+        if (self.drop_invalid):
+            self.count_valid(scan)
+        self.store_scan(scan)
+        if (out is None):
+            out = np.empty((self.scan_size,))
+        self.map_tiles(self.numpy_tile, out)
+        return out
+
+    def numpy_tile(self, lo, hi, out):
+        """ Computes the medians of columns [lo, hi) for numpy_update(), in that tile's rows of the scratch buffer. """
+        # The buffer fills from row 0, so rows [0, count) are always the valid ones; their order does not matter to a median.
+        scratch = self.scratch[lo:hi, :self.count]
+        np.copyto(scratch, self.scans[:self.count, lo:hi].T)
+        if (not self.drop_invalid):
+            self.window_median(scratch, out=out[lo:hi], top=self.top[lo:hi])
+            return
+
+        # Each column's median is at its own rank, which a single partition can't place, so sort instead; still no nanmedian.
+        np.copyto(scratch, self.sentinel, where=~self.valid_mask(scratch))
+        scratch.sort(axis=1)
+        self.valid_median(scratch.T, self.valid[lo:hi], out[lo:hi])
+
+    def heap_update(self, scan, out=None):
         """
         A sliding-window-median filter using MedianHeaps to compute a running median.
 
         Params:
         :scan - an input array of size self.scan_size.
+        :out - an optional array of size self.scan_size to write the result into.
 
-        :return - the current running-window median, computed using a list of MedianHeap objects.
+        :return - the current running-window median, computed using a list of MedianHeap (or IndexedMedianHeap, or SortedWindow) objects.
         """
-        result = np.empty((self.scan_size,))
+        result = np.empty((self.scan_size,)) if out is None else out
 
-        if (self.scans is not None and self.scans.shape[0] > self.window):
-            expired = self.scans[0]
+        # Every NaN is replaced (and counted) before any column is touched, since NaN can't be ordered, nor found again by value (see count_nans()).
+        values, expired = (scan, self.expired_scan()) if self.drop_invalid else self.count_nans(scan)
+        # Python scalars compare and hash faster than numpy ones, and (as plain ints) cannot overflow when uint16 values are averaged.
+        expired = None if expired is None else expired.tolist()
+
+        if (self.drop_invalid):
+            self.heap_valid_update(scan, expired, result)
         else:
-            expired = None
+            for idx,val in enumerate(np.asarray(values).tolist()):
+                med_heap = self.med_heaps[idx]
+                if expired is not None:
+                    med_heap.slide(expired[idx], val)
+                else:
+                    med_heap.push(val)
+                result[idx] = med_heap.median()
+
+        # Only overwrite the expired row once every heap has removed its value.
+        self.store_scan(scan)
+
+        return result
+
+    def heap_valid_update(self, scan, expired, result):
+        """ The body of heap_update() with drop_invalid set: invalid samples are never pushed into (or removed from) a column's structure, so a valid sample that replaces an invalid one is a push, and the reverse a remove. """
+        new_valid, expired_valid = self.count_valid(scan)
+        new_valid = new_valid.tolist()
+        expired_valid = [False] * self.scan_size if expired_valid is None else expired_valid.tolist()
 
-        for idx,val in enumerate(scan):
+        for idx,val in enumerate(np.asarray(scan).tolist()):
             med_heap = self.med_heaps[idx]
-            if expired is not None:
+            if (new_valid[idx]):
+                if (expired_valid[idx]):
+                    med_heap.slide(expired[idx], val)
+                else:
+                    med_heap.push(val)
+            elif (expired_valid[idx]):
                 med_heap.remove(expired[idx])
-            med_heap.push(val)
-            result[idx] = med_heap.median()
+            median = med_heap.median()
+            result[idx] = np.nan if median is None else median
+
+    def heap_array_update(self, scan, out=None):
+        """
+        A sliding-window-median filter that keeps a pair of median heaps per column, like TYPE_INDEXED_HEAP, but holds every column's heaps in shared numpy arrays (see init_heap_arrays()) and updates all columns in lockstep.
+
+        Each update replaces the expired value's node with the new value in place (or, while the window fills, appends a node to the smaller heap), then sifts every column at once: each step of a sift is a few vectorized index operations over the columns that still need to move, so a whole update is O(log(m)) array operations rather than O(scan_size) python method calls.
+
+        :Runtime: O(log(m)) vectorized steps, each O(scan_size), where m is the window size.
 
-        if (self.scans is None):
-            self.scans = np.reshape(scan, (1, scan.shape[0]))
-        elif (self.scans.shape[0] <= self.window):
-            self.scans = np.vstack((self.scans, scan))
+        Params:
+        :scan - an input array of size self.scan_size.
+        :out - an optional array of size self.scan_size to write the result into.
+
+        With drop_invalid, invalid samples are stored as self.sentinel, so they gather at the bottom of the maxHeap, and after each update one value per column may move across the heaps, so that the maxHeap holds the invalid samples plus the lower half of the valid ones (see heap_rebalance()).
+
+        :return - the current running-window median.
+        """
+        scan = np.asarray(scan)
+        if (out is None):
+            out = np.empty((self.scan_size,))
+        if (self.drop_invalid):
+            new_valid, expired_valid = self.count_valid(scan)
+            values = self.mask_invalid(scan, new_valid)
         else:
-            self.scans = np.vstack((self.scans[1:], scan))
+            # The expired value's node is found by its row, not its value, so only the new scan needs its NaNs replaced.
+            values, expired = self.count_nans(scan)
+        self.map_tiles(self.heap_array_tile, values, out)
+        self.store_scan(scan)
+        return out
 
-        return result
+    def heap_array_tile(self, lo, hi, scan, out):
+        """ Places the new values of columns [lo, hi) in their heaps for heap_array_update(), and writes their medians to 'out'. """
+        cols = self.cols[lo:hi]
+        row = self.head
+        if (self.is_full()):
+            # Reuse the node of the value expiring from this row.
+            side = self.heap_side[row, cols]
+            pos = self.heap_pos[row, cols]
+        else:
+            # Append to the maxHeap when both heaps are the same size, otherwise to the minHeap.
+            side = (self.heap_sizes[0, cols] > self.heap_sizes[1, cols]).astype(np.intp)
+            pos = self.heap_sizes[side, cols]
+            self.heap_sizes[side, cols] += 1
+        self.heap_place(cols, side, pos, scan[lo:hi], row)
+
+        if (self.drop_invalid):
+            self.heap_rebalance(cols, self.count if self.is_full() else self.count + 1)
+            odd = self.valid[cols] % 2 == 1
+        else:
+            odd = self.heap_sizes[0, cols] > self.heap_sizes[1, cols]
+
+        lower = self.heap_vals[0, 0, cols]
+        out = out[lo:hi]
+        np.add(lower, self.heap_vals[1, 0, cols], out=out, dtype=out.dtype)
+        np.divide(out, 2.0, out=out)
+        np.copyto(out, lower, where=odd)
+
+    def heap_split(self, size, valid):
+        """ Returns the number of values each column's maxHeap holds, for windows of 'size' values of which 'valid' (per column) are valid: every invalid value, and the lower half (rounded up) of the valid ones. """
+        return (size - valid) + (valid + 1) // 2
+
+    def heap_rebalance(self, cols, size):
+        """
+        With drop_invalid, restores the split of every column's window between its heaps (see heap_split()) after an update, by moving one heap's top across to the other where needed.
+
+        An update changes the number of valid samples of a column by at most one, so each column needs at most one move.
+        """
+        split = self.heap_split(size, self.valid[cols])
+        for s in (0, 1):
+            other = 1 - s
+            moving = (self.heap_sizes[0, cols] > split) if s == 0 else (self.heap_sizes[0, cols] < split)
+            c = cols[moving]
+            if (not len(c)):
+                continue
+
+            # Pop the top, by moving the last node into its place...
+            vals, rows = self.heap_vals[s, 0, c], self.heap_rows[s, 0, c]
+            last = self.heap_sizes[s, c] - 1
+            self.heap_set(s, 0, c, self.heap_vals[s, last, c], self.heap_rows[s, last, c])
+            self.heap_sizes[s, c] -= 1
+            self.heap_sift_down(s, np.zeros(len(c), dtype=np.intp), c)
+
+            # ...and push it onto the other heap, where it becomes the new top.
+            pos = self.heap_sizes[other, c]
+            self.heap_sizes[other, c] += 1
+            self.heap_set(other, pos, c, vals, rows)
+            self.heap_sift_up(other, pos, c)
+
+    def heap_place(self, cols, side, pos, values, row):
+        """
+        Writes new values into the given nodes of the given columns' heaps, then restores the heap order.
+
+        A value that belongs in the other half of its column's window (i.e. beyond the other heap's top) takes that top's place instead: the other heap's top moves into the node, and the value goes to the other heap's root.  So neither heap changes size.
+
+        Params:
+        :cols - the columns to update.
+        :side, pos - the heap (0 or 1) and node index each column's new value is written to.
+        :values - the new value of each column.
+        :row - the history row the new values are stored in.
+        """
+        sift_up = [None, None]
+        sift_down_roots = [None, None]
+        for s in (0, 1):
+            mask = side == s
+            c, p, v = cols[mask], pos[mask], values[mask]
+            other = 1 - s
+            top = self.heap_vals[other, 0, c]
+            cross = (self.heap_sizes[other, c] > 0) & self.heap_before(other, top, v)
+
+            stay = ~cross
+            self.heap_set(s, p[stay], c[stay], v[stay], row)
+            cc = c[cross]
+            self.heap_set(s, p[cross], cc, top[cross], self.heap_rows[other, 0, cc])
+            self.heap_set(other, 0, cc, v[cross], row)
+
+            sift_up[s] = (p, c)
+            sift_down_roots[other] = cc
+
+        for s in (0, 1):
+            p, c = sift_up[s]
+            moved_rows = self.heap_rows[s, p, c]
+            self.heap_sift_up(s, p, c)
+            roots = sift_down_roots[s]
+            self.heap_sift_down(s, np.concatenate((self.heap_pos[moved_rows, c], np.zeros(len(roots), dtype=np.intp))), np.concatenate((c, roots)))
+
+    def heap_before(self, side, a, b):
+        """ Returns whether each value of 'a' belongs above the matching value of 'b' in a heap of the given side. """
+        return (a > b) if side == 0 else (a < b)
+
+    def heap_set(self, side, pos, cols, values, rows):
+        """ Writes values (from the given history rows) into nodes of the given columns' heaps, and records where each row's value now lives. """
+        self.heap_vals[side, pos, cols] = values
+        self.heap_rows[side, pos, cols] = rows
+        self.heap_side[rows, cols] = side
+        self.heap_pos[rows, cols] = pos
+
+    def heap_swap(self, side, a, b, cols):
+        """ Swaps nodes 'a' and 'b' of the given columns' heaps. """
+        vals = self.heap_vals[side]
+        rows = self.heap_rows[side]
+        val_a, val_b = vals[a, cols], vals[b, cols]
+        row_a, row_b = rows[a, cols], rows[b, cols]
+        vals[a, cols] = val_b
+        vals[b, cols] = val_a
+        rows[a, cols] = row_b
+        rows[b, cols] = row_a
+        self.heap_pos[row_b, cols] = a
+        self.heap_pos[row_a, cols] = b
+
+    def heap_sift_up(self, side, pos, cols):
+        """ Sifts the given node of each column up its heap, one level of every column per step, until every node is in place. """
+        vals = self.heap_vals[side]
+        while (len(cols)):
+            parent = (pos - 1) >> 1
+            moving = (pos > 0) & self.heap_before(side, vals[pos, cols], vals[parent, cols])
+            if (not moving.any()):
+                return
+            pos, parent, cols = pos[moving], parent[moving], cols[moving]
+            self.heap_swap(side, pos, parent, cols)
+            pos = parent
+
+    def heap_sift_down(self, side, pos, cols):
+        """ Sifts the given node of each column down its heap, one level of every column per step, until every node is in place. """
+        vals = self.heap_vals[side]
+        last = vals.shape[0] - 1
+        while (len(cols)):
+            sizes = self.heap_sizes[side, cols]
+            left = 2 * pos + 1
+            has_child = left < sizes
+            pos, left, cols, sizes = pos[has_child], left[has_child], cols[has_child], sizes[has_child]
+            right = left + 1
+            use_right = (right < sizes) & self.heap_before(side, vals[np.minimum(right, last), cols], vals[left, cols])
+            child = np.where(use_right, right, left)
+
+            moving = self.heap_before(side, vals[child, cols], vals[pos, cols])
+            if (not moving.any()):
+                return
+            pos, child, cols = pos[moving], child[moving], cols[moving]
+            self.heap_swap(side, pos, child, cols)
+            pos = child
+
+    def sorted_update(self, scan, out=None):
+        """
+        A sliding-window-median filter that keeps each column of the window sorted, for all columns at once.
+
+        Each update finds the rank of the expired value and the insertion rank of the new value in every column with vectorized comparisons, then shifts every column in bulk with a single gather.  The median is then read directly from the middle row(s).
+
+        With drop_invalid, invalid samples are stored as self.sentinel, so they sort first, and each column's median is read at its own rank among the valid samples after them.  Without it, NaN is stored as -inf, and its column reports NaN while the NaN is in the window (see count_nans()).
+
+        :Runtime: O(m) per column, where m is the window size, but with no per-column python code.
+
+        Params:
+        :scan - an input array of size self.scan_size.
+        :out - an optional array of size self.scan_size to write the result into.
+
+        :return - the current running-window median, read from the middle of the sorted window.
+        """
+        scan = np.asarray(scan)
+        if (out is None):
+            out = np.empty((self.scan_size,))
+        if (self.drop_invalid):
+            new_valid, expired_valid = self.count_valid(scan)
+            values = self.mask_invalid(scan, new_valid)
+            expired = self.expired_scan()
+            expired = None if expired is None else self.mask_invalid(expired, expired_valid)
+        else:
+            values, expired = self.count_nans(scan)
+        self.map_tiles(self.sorted_tile, values, expired, out)
+        self.store_scan(scan)
+        return out
+
+    def sorted_tile(self, lo, hi, scan, expired, out):
+        """ Slides the sorted window of columns [lo, hi) for sorted_update(), and writes their medians to 'out'. """
+        count = self.count
+        sorted_tile = self.sorted[:, lo:hi]
+        window = sorted_tile[:count]
+        scan = scan[lo:hi]
+
+        insert = np.count_nonzero(window < scan, axis=0)
+        if expired is None:
+            # Nothing leaves the window; it grows by one row.
+            size = count + 1
+            removed = count
+        else:
+            expired = expired[lo:hi]
+            size = count
+            # The first occurrence of the expired value in each column.
+            removed = np.count_nonzero(window < expired, axis=0)
+            insert -= (expired < scan)
+
+        # Row k of the new window comes from row k (before the insertion point) or row k-1 (after it) of the window with the expired value removed,
+        # which in turn is row j or j+1 of the current window, depending on whether j is before or after the removed value.
+        rows = self.rows[:size]
+        src = np.where(rows < insert, rows, rows - 1)
+        src += (src >= removed)
+        np.maximum(src, 0, out=src)
+
+        shifted = np.take_along_axis(sorted_tile, src, axis=0)
+        shifted[insert, self.cols[:hi - lo]] = scan
+        sorted_tile[:size] = shifted
 
-    def update(self, scan):
-        """ Chooses the appropriate update() method, based on the filter type. """
+        out = out[lo:hi]
+        if (self.drop_invalid):
+            self.valid_median(sorted_tile[:size], self.valid[lo:hi], out)
+            return
+        half = size // 2
+        if (size % 2 == 1):
+            np.copyto(out, sorted_tile[half])
+        else:
+            np.add(sorted_tile[half - 1], sorted_tile[half], out=out, dtype=out.dtype)
+            np.divide(out, 2.0, out=out)
+
+    def quantize(self, scan):
+        """ Maps each (stored) value of a scan to the index of its histogram bin; values outside [MIN_RANGE, MAX_RANGE] fall in the first or last bin. """
+        scan = np.asarray(scan, dtype=float)
+        if (self.scale is not None):
+            scan = scan * self.scale
+        bins = np.floor((scan - self.MIN_RANGE) / self.resolution)
+        # fmax() also maps NaN (a dropout) to the first bin.
+        return np.minimum(np.fmax(bins, 0), self.bins - 1).astype(np.intp)
+
+    def histogram_select(self, rank, lo, hi):
+        """
+        Finds the bin holding the rank-th smallest value (counting from 0) of each of the windows of columns [lo, hi); 'rank' is either one rank for every column, or an array of one rank per column.
+
+        First, a running sum over the coarse counts finds the block each rank falls in; then a running sum over that block's bins finds the bin.
+
+        :Runtime: O(bins / HISTOGRAM_BLOCK + HISTOGRAM_BLOCK) per column, regardless of the window size.
+
+        :return - an array of bin indices, one per column.
+        """
+        cols = self.cols[:hi - lo]
+        coarse = self.coarse[lo:hi]
+        coarse_sums = np.cumsum(coarse, axis=1)
+        rank = np.reshape(rank, (-1, 1))
+        # A column with no (valid) values at all has no rank to find; keep its search within the histogram.
+        block = np.minimum(np.count_nonzero(coarse_sums <= rank, axis=1), coarse.shape[1] - 1)
+        rank = rank[:, 0] - (coarse_sums[cols, block] - coarse[cols, block])
+
+        first = block * self.HISTOGRAM_BLOCK
+        fine_sums = np.cumsum(self.hist[lo:hi][cols[:, None], first[:, None] + self.block_offsets], axis=1)
+        return first + np.count_nonzero(fine_sums <= rank[:, None], axis=1)
+
+    def histogram_update(self, scan, out=None):
+        """
+        A sliding-window-median filter that approximates each column's window with a histogram of quantized values.
+
+        Each update removes the expired value from, and adds the new value to, every column's histogram in O(1) time; the median is then found by a two-level search of the histogram counts (see histogram_select()).  Neither step depends on the window size, so windows of thousands of scans are practical.
+
+        The result is the center of the median's bin (or the mean of the two middle bins' centers), so for values within [MIN_RANGE, MAX_RANGE] it is within resolution / 2 of the exact median.
+
+        :Runtime: O(bins / HISTOGRAM_BLOCK + HISTOGRAM_BLOCK) per column.
+
+        Params:
+        :scan - an input array of size self.scan_size.
+        :out - an optional array of size self.scan_size to write the result into.
+
+        :return - the current running-window median, quantized to the histogram's resolution.
+        """
+        expired = self.expired_scan()
+        expired_bins = None if expired is None else self.quantize(expired)
+        new_bins = self.quantize(scan)
+        # With drop_invalid, each invalid sample counts 0 rather than 1.
+        new_counts, expired_counts = self.count_valid(scan) if self.drop_invalid else (1, 1)
+        if (not self.drop_invalid):
+            # NaN falls in the first bin (see quantize()), but is counted so its column reports NaN, as for the exact types.
+            self.count_nans(scan)
+
+        self.store_scan(scan)
+
+        if (out is None):
+            out = np.empty((self.scan_size,))
+        self.map_tiles(self.histogram_tile, expired_bins, new_bins, expired_counts, new_counts, out)
+        return out
+
+    def histogram_tile(self, lo, hi, expired_bins, new_bins, expired_counts, new_counts, out):
+        """ Updates the histograms of columns [lo, hi) for histogram_update(), and writes their medians to 'out'. """
+        cols = self.cols[:hi - lo]
+        hist = self.hist[lo:hi]
+        coarse = self.coarse[lo:hi]
+
+        if expired_bins is not None:
+            expired_bins = expired_bins[lo:hi]
+            expired_counts = expired_counts if np.isscalar(expired_counts) else expired_counts[lo:hi]
+            hist[cols, expired_bins] -= expired_counts
+            coarse[cols, expired_bins // self.HISTOGRAM_BLOCK] -= expired_counts
+
+        new_bins = new_bins[lo:hi]
+        new_counts = new_counts if np.isscalar(new_counts) else new_counts[lo:hi]
+        hist[cols, new_bins] += new_counts
+        coarse[cols, new_bins // self.HISTOGRAM_BLOCK] += new_counts
+
+        out = out[lo:hi]
+        if (self.drop_invalid):
+            # Each column's median is at its own rank among its valid samples.
+            valid = self.valid[lo:hi]
+            np.add(self.histogram_select((valid - 1) // 2, lo, hi), self.histogram_select(valid // 2, lo, hi), out=out)
+            np.divide(out, 2.0, out=out)
+        else:
+            lower = self.histogram_select((self.count - 1) // 2, lo, hi)
+            if (self.count % 2 == 1):
+                np.copyto(out, lower)
+            else:
+                np.add(lower, self.histogram_select(self.count // 2, lo, hi), out=out)
+                np.divide(out, 2.0, out=out)
+        # Report the center of each bin.
+        out += 0.5
+        out *= self.resolution
+        out += self.MIN_RANGE
+
+    def decayed_update(self, scan, out=None):
+        """
+        An approximate, constant-memory sliding-window-median filter, for windows far too long to store: each column's history is summarized by a histogram of exponentially decayed weights, and no scans are kept at all.
+
+        Every scan adds a weight to the bin of each column's new value, and all earlier weights decay by (1 - 1 / (window + 1)) per scan, so the weights sum to window + 1, like the history of the other types.  The result is the center of the bin holding each column's weighted median (found by a two-level search, as for TYPE_HISTOGRAM).  Memory is scan_size * bins weights, and an update costs O(bins / HISTOGRAM_BLOCK + HISTOGRAM_BLOCK) per column, both independent of the window size.
+
+        Error bound: old scans never leave the summary, they only fade, so this is not the median of exactly the last 'window' scans.  Instead, for values within [MIN_RANGE, MAX_RANGE]: if the last k scans of a column all lie within [a, b], and k > ln(2) * (window + 1) (so that they carry over half of the total weight), the result is within [a - resolution / 2, b + resolution / 2].  In particular, a steady value is tracked to within resolution / 2 about 0.7 windows after it appears.
+
+        NaN has no bin, so it adds no weight.  Without drop_invalid, a column instead reports NaN for the next 'window + 1' scans after a NaN, exactly as long as the other types' windows would hold it.
+
+        :Runtime: O(bins / HISTOGRAM_BLOCK + HISTOGRAM_BLOCK) per column, regardless of the window size.
+
+        Params:
+        :scan - an input array of size self.scan_size.
+        :out - an optional array of size self.scan_size to write the result into.
+
+        :return - the weighted running median, quantized to the histogram's resolution.
+        """
+        new_bins = self.quantize(scan)
+        gain = self.gain
+        # With drop_invalid, each invalid sample adds no weight; without it, neither does NaN.
+        if (self.drop_invalid):
+            weights = gain * self.valid_mask(scan)
+        else:
+            weights = gain
+            self.nan_age += 1
+            np.minimum(self.nan_age, self.capacity, out=self.nan_age)
+            nan = np.isnan(scan)
+            if (nan.any()):
+                self.nan_age[nan] = 0
+                weights = gain * ~nan
+        self.total += weights
+        if (self.drop_invalid):
+            # The decayed number of valid samples, in which the newest sample counts 1.
+            np.divide(self.total, gain, out=self.valid)
+
+        if (out is None):
+            out = np.empty((self.scan_size,))
+        self.map_tiles(self.decayed_tile, new_bins, weights, out)
+        if (not self.drop_invalid):
+            out[self.nan_age < self.capacity] = np.nan
+
+        self.gain *= self.growth
+        if (self.gain > self.DECAYED_RENORMALIZE):
+            # Rescale every weight before the increments overflow.
+            self.hist /= self.gain
+            self.coarse /= self.gain
+            self.total /= self.gain
+            self.gain = 1.0
+
+        if (self.count < self.capacity):
+            self.count += 1
+        return out
+
+    def decayed_tile(self, lo, hi, new_bins, weights, out):
+        """ Adds the new values of columns [lo, hi) to their weight histograms for decayed_update(), and writes their weighted medians to 'out'. """
+        cols = self.cols[:hi - lo]
+        new_bins = new_bins[lo:hi]
+        weights = weights if np.isscalar(weights) else weights[lo:hi]
+        self.hist[lo:hi][cols, new_bins] += weights
+        self.coarse[lo:hi][cols, new_bins // self.HISTOGRAM_BLOCK] += weights
+
+        out = out[lo:hi]
+        np.copyto(out, self.decayed_select(self.total[lo:hi] / 2.0, lo, hi))
+        # Report the center of each bin.
+        out += 0.5
+        out *= self.resolution
+        out += self.MIN_RANGE
+
+    def decayed_select(self, target, lo, hi):
+        """
+        Finds the first bin at which the running sum of the weights of each of columns [lo, hi) reaches that column's 'target', with the same two-level search as histogram_select().
+
+        :return - an array of bin indices, one per column.
+        """
+        cols = self.cols[:hi - lo]
+        coarse = self.coarse[lo:hi]
+        coarse_sums = np.cumsum(coarse, axis=1)
+        # Rounding may leave the last running sum a hair short of the target, so clamp to the last block (and, below, to its last bin).
+        target = target[:, None]
+        block = np.minimum(np.count_nonzero(coarse_sums < target, axis=1), coarse.shape[1] - 1)
+        before = coarse_sums[cols, block] - coarse[cols, block]
+
+        first = block * self.HISTOGRAM_BLOCK
+        fine_sums = np.cumsum(self.hist[lo:hi][cols[:, None], first[:, None] + self.block_offsets], axis=1)
+        fine_sums += before[:, None]
+        offset = np.minimum(np.count_nonzero(fine_sums < target, axis=1), self.HISTOGRAM_BLOCK - 1)
+        return np.minimum(first + offset, self.bins - 1)
+
+    def update(self, scan, out=None):
+        """
+        Chooses the appropriate update() method, based on the filter type.
+
+        Params:
+        :scan - an input array of size self.scan_size.
+        :out - an optional array of size self.scan_size to write the result into, instead of allocating a new one.
+
+        :return - the current running-window median (which is 'out', if given).
+        """
         if (len(scan) != self.scan_size):
             raise ValueError("TemporalMedianFilter.update(): input scan must be of size self.scan_size")
+        if (out is not None and out.shape != (self.scan_size,)):
+            raise ValueError("TemporalMedianFilter.update(): out must be of size self.scan_size")
+
+        if (self.latency is None):
+            return self.engine_update(scan, out)
 
+        start = time.perf_counter_ns()
+        result = self.engine_update(scan, out)
+        self.latency.record(time.perf_counter_ns() - start)
+        return result
+
+    def engine_update(self, scan, out=None):
+        """ Converts the scan to self.dtype, runs the update() method of this filter's type, and converts the result back, without validating its arguments. """
+        scan = self.encode(scan)
         if self.type == self.TYPE_NUMPY:
-            return self.numpy_update(scan)
-        elif self.type == self.TYPE_HEAP:
-            return self.heap_update(scan)
+            result = self.numpy_update(scan, out)
+        elif self.type in self.HEAP_TYPES:
+            result = self.heap_update(scan, out)
+        elif self.type == self.TYPE_SORTED:
+            result = self.sorted_update(scan, out)
+        elif self.type == self.TYPE_HEAP_ARRAY:
+            result = self.heap_array_update(scan, out)
+        elif self.type == self.TYPE_HISTOGRAM:
+            result = self.histogram_update(scan, out)
+        elif self.type == self.TYPE_DECAYED:
+            result = self.decayed_update(scan, out)
         else:
             raise RuntimeError("TemporalMedianFilter: type is invalid")
+
+        # The histograms already report their medians in the scans' units.
+        if (self.scale is not None and self.hist is None):
+            result *= self.scale
+        if (self.drop_invalid):
+            result[self.valid < self.min_valid] = np.nan
+        elif (self.nans.any()):
+            result[self.nans > 0] = np.nan
+        return result
+
+    def stats(self):
+        """
+        Reports cheap numeric statistics about the filter's memory, meant to be polled to catch heap bloat early.
+
+        :Runtime: O(scan_size) for the per-column types, which sum the stats() of every column's structure; otherwise O(1).
+
+        :return - a dict of:
+            - 'type', 'window', 'scan_size', 'dtype' and 'count' (the number of scans in the history buffer)
+            - 'scan_bytes': the bytes held by the history buffer, self.scans
+            - 'engine_bytes': the bytes held by the type's own numpy buffers (e.g. the sorted window, or the histograms)
+            - 'heaps': for the per-column types, the sum of each statistic over every column's structure, except 'offset', which is the largest absolute offset of any column; otherwise None
+        """
+        engine_bytes = sum(buf.nbytes for buf in (self.sorted, self.scratch, self.hist, self.coarse, self.heap_vals, self.heap_rows, self.heap_sizes, self.heap_side, self.heap_pos) if buf is not None)
+
+        heaps = None
+        if (self.med_heaps):
+            heaps = {}
+            for med_heap in self.med_heaps:
+                for key, value in med_heap.stats().items():
+                    if (key == "offset"):
+                        heaps[key] = max(heaps.get(key, 0), abs(value))
+                    else:
+                        heaps[key] = heaps.get(key, 0) + value
+
+        return {
+            "type": self.type,
+            "window": self.window,
+            "scan_size": self.scan_size,
+            "dtype": self.dtype.name,
+            "count": self.count,
+            "scan_bytes": self.scans.nbytes,
+            "engine_bytes": engine_bytes,
+            "heaps": heaps
+        }
+
+    def enable_latency(self, deadline=None):
+        """
+        Starts recording the latency of every update() call into a fixed-memory LatencyHistogram, replacing any latencies recorded so far.
+
+        When disabled (the default), update() pays for a single attribute check.  Scans filtered by update_batch() are recorded too, one latency per scan (see update_batch()).
+
+        Params:
+        :deadline - an optional latency budget per update(), in seconds; calls slower than this are counted.
+        """
+        self.latency = LatencyHistogram(deadline=deadline)
+
+    def disable_latency(self):
+        """ Stops recording latencies, and discards the ones recorded so far. """
+        self.latency = None
+
+    def latency_stats(self):
+        """
+        Summarizes the latency of update() calls since enable_latency() was called.
+
+        :return - a dict of the call count, the mean, p50, p99, p99.9 and max latencies (in seconds), the deadline, and the number of calls over it (see LatencyHistogram.summary()); None if latencies are not being recorded.
+        """
+        if (self.latency is None):
+            return None
+        return self.latency.summary()
+
+    def update_batch(self, scans):
+        """
+        Filters a block of scans at once.
+
+        The result is identical to calling update() on each scan in turn, and leaves the filter ready for the next scan.  For TYPE_NUMPY (without drop_invalid), the medians are computed with vectorized windowed operations: the history and the new scans are stacked in order, every window of that stack is viewed at once (without copying) via sliding_window_view, and each view is reduced with a partition-based median.  The other types are inherently sequential, so they run their update() method once per scan.
+
+        While latencies are recorded (see enable_latency()), every scan adds one latency: its own update() time, or for the vectorized path, the block's time divided by K.
+
+        Params:
+        :scans - a 2D array of shape (K, self.scan_size), in the order the scans were measured.
+
+        :return - a (K, self.scan_size) array whose k-th row is the running-window median after the k-th scan.
+        """
+        scans = np.asarray(scans)
+        if (scans.ndim != 2 or scans.shape[1] != self.scan_size):
+            raise ValueError("TemporalMedianFilter.update_batch(): input scans must be of shape (K, self.scan_size)")
+
+        return self.batch_update(scans, np.empty(scans.shape))
+
+    def batch_update(self, scans, result):
+        """
+        The body of update_batch(), without validating its arguments: filters a (K, self.scan_size) block of scans, and writes the K medians into 'result'.
+
+        :return - result
+        """
+        if (self.type != self.TYPE_NUMPY or self.drop_invalid):
+            # update() only adds its validation (already done for the whole block) and the latency recording.
+            update = self.engine_update if self.latency is None else self.update
+            for k, scan in enumerate(scans):
+                update(scan, out=result[k])
+            return result
+
+        if (self.latency is not None):
+            start = time.perf_counter_ns()
+
+        scans = self.encode(scans)
+        self.numpy_batch(scans, result)
+        if (self.scale is not None):
+            result *= self.scale
+
+        if (self.latency is not None and len(scans)):
+            # The scans of a block are computed together, so each is charged an equal share of the block's time.
+            per_scan = (time.perf_counter_ns() - start) // len(scans)
+            for k in range(len(scans)):
+                self.latency.record(per_scan)
+        return result
+
+    def numpy_batch(self, scans, result):
+        """ The TYPE_NUMPY body of batch_update(), on scans already converted to self.dtype. """
+        # While the history is filling up, every scan sees a window of a different size, so fill it up one scan at a time.
+        start = 0
+        while (start < len(scans) and not self.is_full()):
+            self.numpy_update(scans[start], out=result[start])
+            start += 1
+        if (start == len(scans)):
+            return result
+
+        # The history, oldest scan first, minus the scan that is about to expire, followed by the new scans.
+        # The window of the k-th new scan is then rows [k, k + capacity) of the stack.
+        stacked = np.concatenate((self.scans[self.head + 1:], self.scans[:self.head], scans[start:]))
+        windows = sliding_window_view(stacked, self.capacity, axis=0)
+
+        chunk = max(1, self.BATCH_CHUNK_SIZE // (self.capacity * self.scan_size))
+        for lo in range(0, len(windows), chunk):
+            hi = min(lo + chunk, len(windows))
+            self.window_median(np.array(windows[lo:hi]), out=result[start + lo:start + hi])
+
+        self.scans[:] = stacked[-self.capacity:]
+        self.head = 0
+        self.staged = False
+
+        return result
+
+    @staticmethod
+    def update_many(filters, scans, out=None):
+        """
+        Updates several filters with one scan each: the same as calling filters[i].update(scans[i]) for each i, but the medians of every TYPE_NUMPY filter with a full window are computed together, with one vectorized partition per set of specs, as TemporalMedianFilterBank does.  So the per-call overhead is paid once for the whole group, not once per filter, e.g. for a service whose sensors each send one scan at a time.
+
+        Filters of the other types (or with drop_invalid, or latency recording, or a window still filling) are updated one at a time with update().
+
+        Params:
+        :filters - a sequence of distinct filters, all with the same scan_size.
+        :scans - one scan per filter, each of size scan_size.
+        :out - an optional (len(filters), scan_size) array to write the results into.
+
+        :return - a (len(filters), scan_size) array whose i-th row is the running-window median of filters[i].
+        """
+        if (len(filters) != len(scans)):
+            raise ValueError("TemporalMedianFilter.update_many(): there must be one scan per filter")
+        scan_sizes = { f.scan_size for f in filters }
+        if (len(scan_sizes) > 1):
+            raise ValueError("TemporalMedianFilter.update_many(): every filter must have the same scan_size")
+        if (out is None):
+            out = np.empty((len(filters), scan_sizes.pop() if scan_sizes else 0))
+
+        # Group the filters that can share one partition by the shape and type of their windows.
+        groups = {}
+        for i, (f, scan) in enumerate(zip(filters, scans)):
+            if (f.type == f.TYPE_NUMPY and f.is_full() and not f.drop_invalid and f.latency is None):
+                if (len(scan) != f.scan_size):
+                    raise ValueError("TemporalMedianFilter.update_many(): input scans must be of size scan_size")
+                groups.setdefault((f.capacity, f.dtype, f.scale), []).append(i)
+            else:
+                f.update(scan, out=out[i])
+
+        for (capacity, dtype, scale), members in groups.items():
+            # As in numpy_tile(), each column's window is copied out transposed, so it is contiguous, then partitioned in place.
+            windows = np.empty((len(members), out.shape[1], capacity), dtype=dtype)
+            for k, i in enumerate(members):
+                f = filters[i]
+                f.store_scan(f.encode(scans[i]))
+                np.copyto(windows[k], f.scans.T)
+            medians = TemporalMedianFilter.window_median(windows)
+            if (scale is not None):
+                medians *= scale
+            out[members] = medians
+        return out
+
+    def stream(self, scans, batch_size=64, copy=False):
+        """
+        Lazily filters a stream of scans, yielding the running-window median after each one.
+
+        The source is only ever read 'batch_size' scans ahead, and each batch is filtered with update_batch()'s machinery into reused buffers, so replaying a log of any length takes constant memory, and the per-scan python overhead of update() is paid once per batch.  Only the first scan's size is checked explicitly; after that, every scan is copied into the input buffer in bulk, which rejects scans of any other size (except single values, which numpy broadcasts) without a per-scan check.  If 'scans' is a 2D numpy array, it is validated once and sliced into batches without copying.
+
+        NOTE: unless 'copy' is set, each yielded array is a view into an output buffer that is overwritten 'batch_size' scans later, so a consumer that keeps references to the results must pass copy=True.
+
+        Params:
+        :scans - an iterable (or iterator) of scans, each of size self.scan_size.
+        :batch_size - the number of scans to read from the source at a time.
+        :copy - whether to yield a fresh copy of every result, instead of a view into a reused buffer.
+
+        :return - a generator of filtered scans, one per input scan.
+        """
+        if (batch_size < 1):
+            raise ValueError("TemporalMedianFilter.stream(): batch_size must be > 0")
+
+        result = np.empty((batch_size, self.scan_size))
+
+        if (isinstance(scans, np.ndarray)):
+            if (scans.ndim != 2 or scans.shape[1] != self.scan_size):
+                raise ValueError("TemporalMedianFilter.stream(): input scans must be of shape (K, self.scan_size)")
+            for lo in range(0, len(scans), batch_size):
+                batch = scans[lo:lo + batch_size]
+                filtered = self.batch_update(batch, result[:len(batch)])
+                for row in filtered:
+                    yield row.copy() if copy else row
+            return
+
+        source = iter(scans)
+        buffer = np.empty((batch_size, self.scan_size))
+        first = True
+        while (True):
+            n = 0
+            for scan in itertools.islice(source, batch_size):
+                if (first):
+                    if (len(scan) != self.scan_size):
+                        raise ValueError("TemporalMedianFilter.stream(): input scan must be of size self.scan_size")
+                    first = False
+                buffer[n] = scan
+                n += 1
+            if (n == 0):
+                return
+
+            filtered = self.batch_update(buffer[:n], result[:n])
+            for row in filtered:
+                yield row.copy() if copy else row
+
+    @staticmethod
+    def window_median(values, out=None, top=None):
+        """
+        Computes the median along the last axis of an array with a partition, which only places the middle one or two order statistics instead of sorting.
+
+        NOTE: the array is partitioned in place.
+
+        Params:
+        :values - the array of windows, one window per row along the last axis.
+        :out - an optional array to write the medians into.
+        :top - an optional array shaped like 'out', in the type of 'values', for the largest value of the upper half of each window.  With both 'out' and 'top' given, nothing is allocated.
+
+        :return - the medians, computed exactly as numpy.median computes them: a window holding a NaN has a NaN median.  The middle values are averaged in the type of 'out', so that e.g. uint16 values cannot overflow.
+        """
+        size = values.shape[-1]
+        half = size // 2
+        if (out is None):
+            out = np.empty(values.shape[:-1])
+        if (size % 2 == 1):
+            values.partition(half, axis=-1)
+            np.copyto(out, values[..., half])
+        else:
+            values.partition((half - 1, half), axis=-1)
+            np.add(values[..., half - 1], values[..., half], out=out, dtype=out.dtype)
+            np.divide(out, 2.0, out=out)
+        if (values.dtype.kind == 'f'):
+            # A partition orders NaN after every other value, so any NaN in a window lands in its upper half, whose max is then NaN.  (numpy.median instead places the last value as well, which costs a second selection.)
+            # Every median is <= the max of its window's upper half, so the (NaN-propagating) minimum of the two is the median, or NaN.
+            top = np.max(values[..., half:], axis=-1, out=top)
+            np.minimum(out, top, out=out)
+        return out
+
+
+class TemporalMedianFilterBank:
+    """
+    A bank of sliding-window-median filters over N independent streams of scans (e.g. a fleet of sensors), all with the same window and scan_size.
+
+    Rather than N TemporalMedianFilters, each paying python dispatch and a small median computation per scan, the bank holds the history of every stream in one (N, window + 1, scan_size) array, takes one (N, scan_size) frame of scans per tick, and computes all N medians with a single vectorized partition.  The results are identical to those of N TemporalMedianFilters of TYPE_NUMPY.
+    """
+
+    def __init__(self, streams, window, scan_size):
+        """
+        Creates a new filter bank with the given specs.
+
+        Params:
+        :streams - the number of independent streams, N.
+        :window, scan_size - as for TemporalMedianFilter, shared by every stream.
+        """
+        if (streams < 1):
+            raise ValueError("TemporalMedianFilterBank: streams must be > 0")
+        if (window < 1):
+            raise ValueError("TemporalMedianFilterBank: window size must be > 0")
+        if (scan_size < 1):
+            raise ValueError("TemporalMedianFilterBank: scan_size must be > 0")
+
+        self.streams = streams
+        self.window = window
+        self.scan_size = scan_size
+
+        # As in TemporalMedianFilter, every stream keeps its 'window + 1' most recent scans, in a circular buffer with a shared head.
+        self.capacity = window + 1
+        self.scans = np.empty((streams, self.capacity, scan_size))
+        self.head = 0
+        self.count = 0
+        # The history is partitioned in a transposed copy, so each column's window is contiguous in memory.
+        self.scratch = np.empty((streams, scan_size, self.capacity))
+        self.top = np.empty((streams, scan_size))
+
+    def update(self, frame, out=None):
+        """
+        Filters one frame: the next scan of every stream.
+
+        :Runtime: O(m) per column of every stream, where m is the window size, in a single vectorized computation.
+
+        Params:
+        :frame - an (N, scan_size) array whose i-th row is the next scan of the i-th stream.
+        :out - an optional (N, scan_size) array to write the result into.
+
+        :return - an (N, scan_size) array of the running-window median of every stream (which is 'out', if given).
+        """
+        if (np.shape(frame) != (self.streams, self.scan_size)):
+            raise ValueError("TemporalMedianFilterBank.update(): input frame must be of shape (streams, scan_size)")
+        if (out is not None and out.shape != (self.streams, self.scan_size)):
+            raise ValueError("TemporalMedianFilterBank.update(): out must be of shape (streams, scan_size)")
+
+        self.scans[:, self.head] = frame
+        self.head = (self.head + 1) % self.capacity
+        if (self.count < self.capacity):
+            self.count += 1
+
+        if (out is None):
+            out = np.empty((self.streams, self.scan_size))
+        # The buffer fills from row 0, so rows [0, count) are always the valid ones.
+        scratch = self.scratch[:, :, :self.count]
+        np.copyto(scratch, self.scans[:, :self.count].transpose(0, 2, 1))
+        return TemporalMedianFilter.window_median(scratch, out=out, top=self.top)
+
+    def update_batch(self, frames):
+        """
+        Filters a block of frames, one frame at a time.
+
+        Params:
+        :frames - a 3D array of shape (K, N, scan_size), in the order the frames were measured.
+
+        :return - a (K, N, scan_size) array whose k-th entry is the output of update() on the k-th frame.
+        """
+        frames = np.asarray(frames)
+        if (frames.ndim != 3 or frames.shape[1:] != (self.streams, self.scan_size)):
+            raise ValueError("TemporalMedianFilterBank.update_batch(): input frames must be of shape (K, streams, scan_size)")
+
+        result = np.empty(frames.shape)
+        for k, frame in enumerate(frames):
+            self.update(frame, out=result[k])
+        return result
+
+
+class FilterChain:
+    """
+    A pipeline of filters, applied in order, e.g. a RangeFilter followed by a TemporalMedianFilter.
+
+    Each scan flows through the whole chain without allocating intermediate arrays: every filter writes its output into a buffer preallocated for it, except that a filter followed by a TemporalMedianFilter (storing floats) writes its output straight into that median filter's next history row (see TemporalMedianFilter.stage_scan()).  So a RangeFilter clips each scan in place, directly into the median filter's history.
+
+    Any filter with an update(scan, out=None) method (and, for update_batch(), an update_batch(scans) method) may be chained.
+    """
+
+    def __init__(self, filters):
+        """
+        Creates a new chain of the given filters.
+
+        Params:
+        :filters - a non-empty sequence of filters, in the order they are applied.  Every TemporalMedianFilter in the chain must have the same scan_size.
+        """
+        self.filters = list(filters)
+        if (not self.filters):
+            raise ValueError("FilterChain: must chain at least one filter")
+
+        scan_sizes = { f.scan_size for f in self.filters if isinstance(f, TemporalMedianFilter) }
+        if (len(scan_sizes) > 1):
+            raise ValueError("FilterChain: every TemporalMedianFilter must have the same scan_size")
+        self.scan_size = scan_sizes.pop() if scan_sizes else None
+
+        self.buffers = None
+        if (self.scan_size is not None):
+            self.init_buffers()
+
+    def stages_into(self, i):
+        """ Returns whether the i-th filter is a TemporalMedianFilter that the filter before it can write straight into (see TemporalMedianFilter.stage_scan()). """
+        return isinstance(self.filters[i], TemporalMedianFilter) and self.filters[i].can_stage()
+
+    def init_buffers(self):
+        """ Preallocates an output buffer for every filter that is neither last, nor followed by a TemporalMedianFilter it can stage into. """
+        self.buffers = [
+            np.empty((self.scan_size,)) if (i + 1 < len(self.filters) and not self.stages_into(i + 1)) else None
+            for i in range(len(self.filters))
+        ]
+
+    def update(self, scan, out=None):
+        """
+        Runs one scan through every filter in the chain.
+
+        Params:
+        :scan - an input array of size self.scan_size.
+        :out - an optional array of size self.scan_size to write the result into.
+
+        :return - the output of the last filter (which is 'out', if given).
+        """
+        if (self.scan_size is None):
+            # A chain of RangeFilters only learns its scan_size from its first scan.
+            self.scan_size = len(scan)
+            self.init_buffers()
+        if (len(scan) != self.scan_size):
+            raise ValueError("FilterChain.update(): input scan must be of size self.scan_size")
+
+        current = scan
+        last = len(self.filters) - 1
+        for i, f in enumerate(self.filters):
+            if (i == last):
+                dest = out
+            elif (self.stages_into(i + 1)):
+                dest = self.filters[i + 1].stage_scan()
+            else:
+                dest = self.buffers[i]
+            current = f.update(current, out=dest)
+        return current
+
+    def update_batch(self, scans):
+        """
+        Runs a block of scans through every filter in the chain, using each filter's own batch update.
+
+        RangeFilters clip a single working copy of the block in place.
+
+        Params:
+        :scans - a 2D array of shape (K, self.scan_size).
+
+        :return - a (K, self.scan_size) array of the outputs of the last filter.
+        """
+        scans = np.array(scans, dtype=float)
+        if (scans.ndim != 2 or (self.scan_size is not None and scans.shape[1] != self.scan_size)):
+            raise ValueError("FilterChain.update_batch(): input scans must be of shape (K, self.scan_size)")
+
+        for f in self.filters:
+            if (isinstance(f, RangeFilter)):
+                f.update(scans, out=scans)
+            else:
+                scans = f.update_batch(scans)
+        return scans
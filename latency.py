@@ -0,0 +1,118 @@
+"""
+    This file defines a fixed-memory histogram of call latencies, for finding the tail latency of a filter.
+
+    :author - Nick Tripp, 2018
+"""
+import math
+
+
+class LatencyHistogram:
+    """
+    A log-bucketed histogram of latencies, in nanoseconds.
+
+    Each power of two is split into SUB_BUCKETS linear buckets, so every recorded latency is placed in a bucket whose width is at most 1/SUB_BUCKETS of its value (12.5% by default); latencies under SUB_BUCKETS nanoseconds get exact buckets.  The number of buckets is fixed up front, so recording is O(1) and the histogram never grows, no matter how many latencies it records.
+
+    Percentiles are reported as the upper edge of the bucket they fall in (capped at the largest latency seen), so they never understate the true latency.
+    """
+
+    SUB_BITS = 3 # log2 of the number of buckets per power of two
+    SUB_BUCKETS = 1 << SUB_BITS
+    MAX_BITS = 42 # Latencies of 2^42 ns (~73 minutes) or more all share the last bucket
+
+    def __init__(self, deadline=None):
+        """
+        Creates a new empty histogram.
+
+        Params:
+        :deadline - an optional latency budget, in seconds; calls slower than this are counted in 'over_deadline'.
+        """
+        if (deadline is not None and deadline <= 0):
+            raise ValueError("LatencyHistogram: deadline must be > 0")
+        self.deadline = deadline
+        self.deadline_ns = None if deadline is None else int(deadline * 1e9)
+        self.buckets = [0] * self.bucket_index((1 << self.MAX_BITS) - 1) + [0]
+        self.reset()
+
+    def reset(self):
+        """ Forgets every recorded latency. """
+        for i in range(len(self.buckets)):
+            self.buckets[i] = 0
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.over_deadline = 0
+
+    @classmethod
+    def bucket_index(cls, ns):
+        """ Returns the index of the bucket a latency of 'ns' nanoseconds falls in. """
+        if (ns < cls.SUB_BUCKETS):
+            return max(ns, 0)
+        exponent = ns.bit_length() - 1
+        if (exponent >= cls.MAX_BITS):
+            exponent = cls.MAX_BITS - 1
+            ns = (1 << cls.MAX_BITS) - 1
+        shift = exponent - cls.SUB_BITS
+        return ((shift + 1) << cls.SUB_BITS) + ((ns >> shift) & (cls.SUB_BUCKETS - 1))
+
+    @classmethod
+    def bucket_upper(cls, idx):
+        """ Returns the largest latency, in nanoseconds, that falls in the given bucket. """
+        if (idx < cls.SUB_BUCKETS):
+            return idx
+        shift = (idx >> cls.SUB_BITS) - 1
+        mantissa = cls.SUB_BUCKETS + (idx & (cls.SUB_BUCKETS - 1))
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, ns):
+        """
+        Records one latency.
+
+        :Runtime: O(1)
+
+        Params:
+        :ns - the latency, in nanoseconds.
+        """
+        self.buckets[self.bucket_index(ns)] += 1
+        self.count += 1
+        self.total_ns += ns
+        if (ns > self.max_ns):
+            self.max_ns = ns
+        if (self.deadline_ns is not None and ns > self.deadline_ns):
+            self.over_deadline += 1
+
+    def percentile(self, p):
+        """
+        Returns the latency, in seconds, below which a fraction 'p' of the recorded latencies fall; None if nothing has been recorded.
+
+        :Runtime: O(number of buckets)
+        """
+        if (not 0 <= p <= 1):
+            raise ValueError("LatencyHistogram: percentile must be within [0, 1]")
+        if (self.count == 0):
+            return None
+
+        # Round before taking the ceiling, so that e.g. 0.99 * 100 is 99 rather than 99.00000000000001.
+        target = max(1, math.ceil(round(p * self.count, 6)))
+        seen = 0
+        for idx, bucket in enumerate(self.buckets):
+            seen += bucket
+            if (seen >= target):
+                return min(self.bucket_upper(idx), self.max_ns) / 1e9
+        return self.max_ns / 1e9
+
+    def summary(self):
+        """
+        Summarizes the recorded latencies.
+
+        :return - a dict of the call count, the mean, p50, p99, p99.9 and max latencies (in seconds), the deadline, and the number of calls over it.
+        """
+        return {
+            "count": self.count,
+            "mean": self.total_ns / self.count / 1e9 if self.count else None,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "p99.9": self.percentile(0.999),
+            "max": self.max_ns / 1e9 if self.count else None,
+            "deadline": self.deadline,
+            "over_deadline": self.over_deadline
+        }
@@ -1,10 +1,15 @@
 """
     This file defines a MedianHeap data structure that tracks a median over a sliding window using two heaps.
 
+    It also defines two alternatives with the same push/remove/median interface: IndexedMedianHeap, which deletes eagerly, and SortedWindow, an order-statistic sorted list.
+
     :author - Nick Tripp, 2018
 """
+import bisect
 import heapq
 
+import numpy as np
+
 class MedianHeap:
     """
     Like a minHeap or maxHeap, except a MedianHeap uses one of each of those to keep track of a median value.
@@ -14,16 +19,71 @@ class MedianHeap:
     Uses lazy heap-deleting to remove elements; that is, if the element to be removed is not on top of either minHeap or maxHeap, then we simply mark it as 'dirty' and adjust an offset to note the heap that contains a new dirty element.  Then, whenever there is a new top of either heap, we check to see if it is dirty, and remove it if so.  This strategy reduces the heap delete operation from O(log(n)) to an O(1) operation, but increases worst case space complexity (and thus, worst case insertion time complexity) from O(log(m)), where m is the number of all ~current~ elements, to O(log(n)), where n is the number of all elements ~ever~ seen. However, on average, both of those remain O(log(m)).
 
     The number of non-dirty elements in each heap must not differ by more than 1; if so, the MedianHeap is said to be 'unbalanced', and must call self.balance().
+
+    To keep the dirty elements from piling up over a long-running data stream, the heap compacts itself (see compact()) whenever the number of dirty elements exceeds 'compact_ratio' times the number of live elements.  This bounds the space complexity to O((1 + compact_ratio) * m).
     """
 
-    def __init__(self):
+    def __init__(self, compact_ratio=1.0):
         """
         Initializes a new empty heap.
+
+        Params:
+        :compact_ratio - the ratio of dirty elements to live elements above which the heap is compacted.  None disables compaction.
         """
+        if (compact_ratio is not None and compact_ratio < 0):
+            raise ValueError("MedianHeap: compact_ratio must be >= 0")
+
         self.max_heap = [] # All Elements <= median; top is the max of these
         self.min_heap = [] # All Elements >= median; top is the min of these
         self.offset = 0 # An integer to track the balance of how many 'extra' 'dirty' elements there are in the minHeap and maxHeap.  Specifically, this should always be equal to ((#dirty elements in minHeap) - (# dirty elements in maxHeap))
-        self.dirty = {} # A dictionary of 'dirty' elements to remove if we see them later (lazy delete)
+        self.dirty = {} # A dictionary of 'dirty' elements to remove if we see them later (lazy delete); only holds positive counts
+        self.dead = 0 # The total number of dirty elements still stored in either heap, i.e. the sum of self.dirty's counts
+        self.compact_ratio = compact_ratio
+
+    @classmethod
+    def from_sorted(cls, values, compact_ratio=1.0):
+        """
+        Builds a heap holding the given values in bulk, without pushing them one at a time.
+
+        A sorted list is already a valid minHeap, so the upper half of the values becomes the minHeap as-is, and the lower half, reversed and negated, becomes the maxHeap.
+
+        :Runtime: O(m), where m is the number of values.
+
+        Params:
+        :values - a list of values in ascending order.
+        :compact_ratio - as for the constructor.
+        """
+        med_heap = cls(compact_ratio=compact_ratio)
+        half = (len(values) + 1) // 2
+        med_heap.max_heap = [-elem for elem in reversed(values[:half])]
+        med_heap.min_heap = list(values[half:])
+        return med_heap
+
+    @classmethod
+    def from_iterable(cls, values, compact_ratio=1.0):
+        """
+        Builds a heap holding the given values (in any order) in bulk, without pushing them one at a time.
+
+        The values are split around their median with a selection (numpy's introselect) rather than a sort, and each half is turned into a heap in place with heapq.heapify.
+
+        :Runtime: O(m), where m is the number of values.
+
+        Params:
+        :values - an iterable of values.
+        :compact_ratio - as for the constructor.
+        """
+        values = list(values)
+        med_heap = cls(compact_ratio=compact_ratio)
+        if (not values):
+            return med_heap
+
+        half = (len(values) + 1) // 2
+        split = np.partition(np.array(values), half - 1).tolist()
+        med_heap.max_heap = [-elem for elem in split[:half]]
+        med_heap.min_heap = split[half:]
+        heapq.heapify(med_heap.max_heap)
+        heapq.heapify(med_heap.min_heap)
+        return med_heap
 
     def __str__(self):
         """
@@ -33,6 +93,23 @@ class MedianHeap:
         """
         return "Max Heap: " + str([-x for x in self.max_heap]) + "\nMin Heap: " + str(self.min_heap) + "\nOffset: " + str(self.offset) + "\nDelete: " +  str({ k:self.dirty[k] for k in self.dirty if self.dirty[k] > 0 }) + "\nMedian: " + str(self.median())
 
+    def stats(self):
+        """
+        Reports cheap numeric statistics about the heap's size and garbage, e.g. for monitoring heap bloat.
+
+        :Runtime: O(1)
+
+        :return - a dict of the number of live elements, the physical lengths of the maxHeap and minHeap, the number of dead (dirty) elements still stored in them, the number of keys in the dirty dict, and the current offset.
+        """
+        return {
+            "live": self.live_size(),
+            "max_heap": len(self.max_heap),
+            "min_heap": len(self.min_heap),
+            "dead": self.dead,
+            "dirty_keys": len(self.dirty),
+            "offset": self.offset
+        }
+
     def max_top(self):
         """
         Peeks at the current top of the maxHeap.
@@ -122,7 +199,7 @@ class MedianHeap:
         while (not self.max_empty() and self.is_dirty(self.max_top())):
             # Top is dirty
             self.offset += 1
-            self.dirty[self.max_top()] -= 1
+            self.scrub(self.max_top())
             heapq.heappop(self.max_heap)
 
 
@@ -139,12 +216,59 @@ class MedianHeap:
         while (not self.min_empty() and self.is_dirty(self.min_top())):
             # Top is dirty
             self.offset -= 1
-            self.dirty[self.min_top()] -= 1
+            self.scrub(self.min_top())
             heapq.heappop(self.min_heap)
 
+    def scrub(self, elem):
+        """ Unmarks one dirty copy of the given element, dropping its key from the dirty dict once no copies are left. """
+        count = self.dirty[elem] - 1
+        if (count == 0):
+            del self.dirty[elem]
+        else:
+            self.dirty[elem] = count
+        self.dead -= 1
+
     def is_dirty(self, elem):
         """ Returns True if the given element is marked for deletion. """
-        return elem in self.dirty and self.dirty[elem] > 0
+        return elem in self.dirty
+
+    def live_size(self):
+        """ Returns the number of non-dirty elements in the heap. """
+        return len(self.max_heap) + len(self.min_heap) - self.dead
+
+    def needs_compaction(self):
+        """ Returns True if the number of dirty elements exceeds compact_ratio times the number of live elements. """
+        return self.compact_ratio is not None and self.dead > self.compact_ratio * self.live_size()
+
+    def compact(self):
+        """
+        Physically removes every dirty element from both heaps, then re-heapifies them.
+
+        Dirty copies of a value are dropped from whichever heap they are found in first; since every element of the maxHeap is <= every element of the minHeap, the heaps still partition the live elements correctly, and a final balance() evens out their sizes.  Afterwards there are no dirty elements, so self.dirty is empty and self.offset is 0.
+
+        :Runtime: O(m + d), where m is the number of live elements and d is the number of dirty elements.
+        """
+        dirty = self.dirty
+
+        def keep(elem):
+            if (elem in dirty):
+                count = dirty[elem] - 1
+                if (count == 0):
+                    del dirty[elem]
+                else:
+                    dirty[elem] = count
+                return False
+            return True
+
+        self.max_heap = [neg for neg in self.max_heap if keep(-neg)]
+        self.min_heap = [elem for elem in self.min_heap if keep(elem)]
+        heapq.heapify(self.max_heap)
+        heapq.heapify(self.min_heap)
+
+        self.dirty = {}
+        self.dead = 0
+        self.offset = 0
+        self.balance()
 
     def median(self):
         """
@@ -183,6 +307,15 @@ class MedianHeap:
 
         :Runtime: Average O(log(m)), Worst O(log(n)), as per push_max() and push_min().
         """
+        self.place(elem)
+        self.balance()
+
+    def place(self, elem):
+        """
+        Adds an element to the heap it belongs in, without rebalancing.
+
+        Calling this method can unbalance the heap, so self.balance() should be called after this.
+        """
         if (not self.min_empty() and elem > self.min_top()):
             # Elem in upper half, belongs in min heap
             self.push_min(elem)
@@ -196,8 +329,6 @@ class MedianHeap:
             else:
                 self.push_min(elem)
 
-        self.balance()
-
     def is_balanced(self):
         """ Returns true if the difference between the # of non-dirty elements in each heap is <= 1. """
         return abs(len(self.max_heap) - len(self.min_heap) + self.offset) <= 1
@@ -226,24 +357,660 @@ class MedianHeap:
         In actuality, this function performs a 'lazy' delete; if the element to be removed is not the top of either minHeap or maxHeap, it simply marks an element as 'dirty', and expects it will be removed later (in clean_top_max/min()) when it is again encountered.
 
         :Runtime: O(1), but this 'lazy delete' has non-trival implications for the overall space and time performance of MedianHeap; that is, this strategy reduces the heap delete operation from O(log(n)) to an O(1) operation, but increases space complexity (and thus, insertion time complexity) from O(log(m)), where m is the number of all ~current~ elements, to O(log(n)), where n is the number of all elements ~ever~ seen.  An additional side affect is that occasionally pop_max/min() (and thus, balance()) operations run MUCH slower than normal; over many removals, this is amortized to O(1).
+        When compaction is enabled, the heap is compacted in O(m) time once too many dirty elements build up, which caps the space back at O(m); over many removals this is also amortized to O(1).
 
         Params:
         :elem - the element to remove from the heap.
             NOTE: due to the nature of lazy delete, no checks are made to see if this element is actually in the heap; if it is not, it will still be marked for future deletion, and will result in undefined behavior.
         """
-        if (elem == self.min_top()):
+        self.discard(elem)
+        self.balance()
+
+        if (self.needs_compaction()):
+            self.compact()
+
+    def discard(self, elem):
+        """
+        Removes a given element (lazily; see remove()) without rebalancing.
+
+        Calling this method can unbalance the heap, so self.balance() should be called after this.
+        """
+        if (not self.min_empty() and elem == self.min_top()):
             self.pop_min()
-        elif (elem == self.max_top()):
+        elif (not self.max_empty() and elem == self.max_top()):
             self.pop_max()
         else:
             if (elem in self.dirty):
                 self.dirty[elem] += 1
             else:
                 self.dirty[elem] = 1
+            self.dead += 1
 
             if (elem < self.median()):
                 self.offset -= 1
             else:
                 self.offset += 1
 
+    def slide(self, old, new):
+        """
+        Replaces one element with another, i.e. slides a window by one element: the same as remove(old) followed by push(new), but fused into a single pass with at most one rebalance.
+
+        If both elements are equal, the heap's contents would not change, so nothing is done at all.  If the old element is the top of a heap that the new element also belongs in, it is replaced with a single heapreplace() rather than a pop and a push.  Otherwise the old element is marked dirty (or popped), the new one is pushed onto its heap, and the heap is only rebalanced if that left it unbalanced.
+
+        :Runtime: Average O(log(m)), as per remove() and push(); roughly half of their combined cost.
+
+        Params:
+        :old - the element leaving the window; see remove() for the lazy-delete caveats.
+        :new - the element entering the window.
+        """
+        if (old == new):
+            return
+
+        max_heap = self.max_heap
+        min_heap = self.min_heap
+
+        # Remove the old element.  Both tops are always clean, so if it is not a top, it is in the maxHeap exactly when it is below the maxHeap's top.
+        if (min_heap and old == min_heap[0]):
+            if (not max_heap or new >= -max_heap[0]):
+                heapq.heapreplace(min_heap, new)
+                self.clean_top_min()
+                self.balance()
+                return
+            heapq.heappop(min_heap)
+            self.clean_top_min()
+        elif (max_heap and old == -max_heap[0]):
+            if (not min_heap or new <= min_heap[0]):
+                heapq.heapreplace(max_heap, -new)
+                self.clean_top_max()
+                self.balance()
+                return
+            heapq.heappop(max_heap)
+            self.clean_top_max()
+        else:
+            self.dirty[old] = self.dirty.get(old, 0) + 1
+            self.dead += 1
+            if (max_heap and old < -max_heap[0]):
+                self.offset -= 1
+            else:
+                self.offset += 1
+
+        # Push the new element, as per push().
+        if (min_heap and new > min_heap[0]):
+            heapq.heappush(min_heap, new)
+        elif (max_heap and new < -max_heap[0]):
+            heapq.heappush(max_heap, -new)
+        elif (len(min_heap) >= len(max_heap) + self.offset):
+            heapq.heappush(max_heap, -new)
+        else:
+            heapq.heappush(min_heap, new)
+
         self.balance()
+
+        if (self.needs_compaction()):
+            self.compact()
+
+
+class IndexedMedianHeap:
+    """
+    A MedianHeap alternative that deletes eagerly, so its memory is bounded by the number of ~current~ elements.
+
+    Like MedianHeap, the lower half of the elements is kept in a maxHeap and the upper half in a minHeap.  Unlike MedianHeap, every element lives in a 'node' that records its position in its heap, and every value maps to the nodes that hold it.  Removing an element therefore finds its node in O(1), swaps it with the last node of its heap and sifts that node into place, in O(log(m)) time where m is the number of current elements.  There are no 'dirty' elements, so there is no offset to track and no scrubbing of heap tops.
+
+    Each node is a list [key, index, in_max], where 'key' is the value (negated in the maxHeap, so both heaps can be sifted as minHeaps), 'index' is the node's position in its heap, and 'in_max' is True if the node lives in the maxHeap.
+
+    The number of elements in each heap must not differ by more than 1; push() and remove() rebalance after every call.
+    """
+
+    def __init__(self):
+        """
+        Initializes a new empty heap.
+        """
+        self.max_heap = [] # Nodes of all elements <= median, keyed by -value; top is the max of these
+        self.min_heap = [] # Nodes of all elements >= median, keyed by value; top is the min of these
+        self.nodes = {} # A dictionary mapping each value to the list of nodes currently holding it
+
+    @classmethod
+    def from_sorted(cls, values):
+        """
+        Builds a heap holding the given values in bulk, without pushing them one at a time.
+
+        As for MedianHeap.from_sorted(), the sorted halves of the values are already valid heaps, so each node is simply created at its final index.
+
+        :Runtime: O(m), where m is the number of values.
+
+        Params:
+        :values - a list of values in ascending order.
+        """
+        med_heap = cls()
+        half = (len(values) + 1) // 2
+        med_heap.max_heap = [[-elem, idx, True] for idx, elem in enumerate(reversed(values[:half]))]
+        med_heap.min_heap = [[elem, idx, False] for idx, elem in enumerate(values[half:])]
+        for node in med_heap.max_heap:
+            med_heap.nodes.setdefault(-node[0], []).append(node)
+        for node in med_heap.min_heap:
+            med_heap.nodes.setdefault(node[0], []).append(node)
+        return med_heap
+
+    @classmethod
+    def from_iterable(cls, values):
+        """
+        Builds a heap holding the given values (in any order) in bulk.
+
+        :Runtime: O(m * log(m)), where m is the number of values; each node's index must be known, so the values are sorted rather than heapified.
+
+        Params:
+        :values - an iterable of values.
+        """
+        return cls.from_sorted(sorted(values))
+
+    def __len__(self):
+        """ Returns the number of elements in the heap. """
+        return len(self.max_heap) + len(self.min_heap)
+
+    def stats(self):
+        """
+        Reports cheap numeric statistics about the heap's size, in the same form as MedianHeap.stats().  There is never any garbage, so 'dead', 'dirty_keys' and 'offset' are always 0.
+
+        :Runtime: O(1)
+
+        :return - a dict of the number of live elements, the lengths of the maxHeap and minHeap, the number of distinct values, and (always 0) 'dead', 'dirty_keys' and 'offset'.
+        """
+        return {
+            "live": len(self),
+            "max_heap": len(self.max_heap),
+            "min_heap": len(self.min_heap),
+            "dead": 0,
+            "dirty_keys": 0,
+            "offset": 0,
+            "value_keys": len(self.nodes)
+        }
+
+    def __str__(self):
+        """ Pretty-prints the current heap status to a string. """
+        return "Max Heap: " + str([-node[0] for node in self.max_heap]) + "\nMin Heap: " + str([node[0] for node in self.min_heap]) + "\nMedian: " + str(self.median())
+
+    def max_top(self):
+        """ Peeks at the current top of the maxHeap. """
+        if (not self.max_heap):
+            raise RuntimeError("IndexedMedianHeap: cannot peek at empty max_heap")
+
+        return -self.max_heap[0][0]
+
+    def min_top(self):
+        """ Peeks at the current top of the minHeap. """
+        if (not self.min_heap):
+            raise RuntimeError("IndexedMedianHeap: cannot peek at empty min_heap")
+
+        return self.min_heap[0][0]
+
+    def sift_up(self, heap, idx):
+        """
+        Moves the node at heap[idx] up towards the root until its parent's key is no larger, keeping every node's index current.
+
+        :Runtime: O(log(m))
+        """
+        node = heap[idx]
+        while (idx > 0):
+            parent_idx = (idx - 1) >> 1
+            parent = heap[parent_idx]
+            if (node[0] >= parent[0]):
+                break
+            heap[idx] = parent
+            parent[1] = idx
+            idx = parent_idx
+        heap[idx] = node
+        node[1] = idx
+
+    def sift_down(self, heap, idx):
+        """
+        Moves the node at heap[idx] down towards the leaves until neither child's key is smaller, keeping every node's index current.
+
+        :Runtime: O(log(m))
+        """
+        size = len(heap)
+        node = heap[idx]
+        child_idx = 2 * idx + 1
+        while (child_idx < size):
+            right_idx = child_idx + 1
+            if (right_idx < size and heap[right_idx][0] < heap[child_idx][0]):
+                child_idx = right_idx
+            child = heap[child_idx]
+            if (child[0] >= node[0]):
+                break
+            heap[idx] = child
+            child[1] = idx
+            idx = child_idx
+            child_idx = 2 * idx + 1
+        heap[idx] = node
+        node[1] = idx
+
+    def insert_node(self, node, in_max):
+        """ Appends a node to the maxHeap (if in_max) or the minHeap, and sifts it into place. """
+        heap = self.max_heap if in_max else self.min_heap
+        node[2] = in_max
+        node[1] = len(heap)
+        heap.append(node)
+        self.sift_up(heap, node[1])
+
+    def delete_node(self, node):
+        """
+        Removes a node from whichever heap holds it, by moving the last node of that heap into its place and sifting it.
+
+        :Runtime: O(log(m))
+        """
+        heap = self.max_heap if node[2] else self.min_heap
+        last = heap.pop()
+        if (last is not node):
+            idx = node[1]
+            heap[idx] = last
+            last[1] = idx
+            if (idx > 0 and last[0] < heap[(idx - 1) >> 1][0]):
+                self.sift_up(heap, idx)
+            else:
+                self.sift_down(heap, idx)
+
+    def move_top(self, from_max):
+        """ Moves the top node of one heap to the other, re-keying it for its new heap. """
+        heap = self.max_heap if from_max else self.min_heap
+        node = heap[0]
+        self.delete_node(node)
+        node[0] = -node[0]
+        self.insert_node(node, not from_max)
+
+    def balance(self):
+        """
+        Rebalances the heap so the number of elements in each half does not differ by more than 1.
+
+        :Runtime: O(log(m)); after a single push() or remove() at most one node needs to move.
+        """
+        diff = len(self.max_heap) - len(self.min_heap)
+        if (diff > 1):
+            self.move_top(True)
+        elif (diff < -1):
+            self.move_top(False)
+
+    def push(self, elem):
+        """
+        Inserts an element into the heap.
+
+        If elem < median, the element is added to the maxHeap, otherwise it is added to the minHeap.
+
+        :Runtime: O(log(m))
+
+        Params:
+        :elem - the element to insert.  Raises a ValueError if it is NaN, which can neither be ordered nor found again by value.
+        """
+        if (elem != elem):
+            raise ValueError("IndexedMedianHeap: cannot push NaN")
+        in_max = bool(self.max_heap) and elem <= -self.max_heap[0][0]
+        node = [-elem if in_max else elem, 0, in_max]
+        self.insert_node(node, in_max)
+
+        if (elem in self.nodes):
+            self.nodes[elem].append(node)
+        else:
+            self.nodes[elem] = [node]
+
+        self.balance()
+
+    def remove(self, elem):
+        """
+        Removes one occurrence of a given element from the heap.
+
+        :Runtime: O(log(m))
+
+        Params:
+        :elem - the element to remove from the heap.  Raises a RuntimeError if the element is not in the heap.
+        """
+        nodes = self.nodes.get(elem)
+        if (not nodes):
+            raise RuntimeError("IndexedMedianHeap: cannot remove an element that is not in the heap")
+
+        node = nodes.pop()
+        if (not nodes):
+            del self.nodes[elem]
+        self.delete_node(node)
+
+        self.balance()
+
+    def slide(self, old, new):
+        """
+        Replaces one occurrence of an element with another, i.e. slides a window by one element: the same as remove(old) followed by push(new).
+
+        The old element's node is reused.  If the new element belongs in the same half of the heap, the node is simply re-keyed and sifted in place, and no rebalancing is needed at all; otherwise it moves to the other heap, followed by a single rebalance.
+
+        :Runtime: O(log(m))
+
+        Params:
+        :old - the element leaving the window.  Raises a RuntimeError if the element is not in the heap.
+        :new - the element entering the window.  Raises a ValueError if it is NaN, as for push().
+        """
+        nodes = self.nodes.get(old)
+        if (not nodes):
+            raise RuntimeError("IndexedMedianHeap: cannot remove an element that is not in the heap")
+        if (new != new):
+            raise ValueError("IndexedMedianHeap: cannot push NaN")
+        if (old == new):
+            return
+
+        node = nodes.pop()
+        if (not nodes):
+            del self.nodes[old]
+        if (new in self.nodes):
+            self.nodes[new].append(node)
+        else:
+            self.nodes[new] = [node]
+
+        if (node[2]):
+            if (not self.min_heap or new <= self.min_heap[0][0]):
+                self.rekey(self.max_heap, node, -new)
+                return
+        elif (not self.max_heap or new >= -self.max_heap[0][0]):
+            self.rekey(self.min_heap, node, new)
+            return
+
+        # The new element belongs in the other half of the heap.
+        self.delete_node(node)
+        in_max = not node[2]
+        node[0] = -new if in_max else new
+        self.insert_node(node, in_max)
+        self.balance()
+
+    def rekey(self, heap, node, key):
+        """ Changes the key of a node in place, and sifts it into its new position. """
+        old_key = node[0]
+        node[0] = key
+        if (key < old_key):
+            self.sift_up(heap, node[1])
+        else:
+            self.sift_down(heap, node[1])
+
+    def median(self):
+        """
+        Computes the median from the top of the heaps.  In particular, returns the mean of the tops if both heaps hold the same number of elements, otherwise, returns the top of the larger heap.
+
+        :Runtime: O(1)
+
+        :return - the median of data in the heap.
+        """
+        max_size = len(self.max_heap)
+        min_size = len(self.min_heap)
+        if (max_size == 0 and min_size == 0):
+            return None
+
+        if (min_size > max_size):
+            return self.min_top()
+        elif (min_size < max_size):
+            return self.max_top()
+        else:
+            return (self.min_top() + self.max_top()) / 2.0
+
+
+class SortedWindow:
+    """
+    A MedianHeap alternative that keeps every element in sorted order, so it can answer any rank query, not just the median.
+
+    The elements are kept in a 'blocked' sorted list: a list of sorted blocks of between 'load' / 2 and 2 * 'load' elements each (except when there are too few elements to fill one), along with the maximum of each block.  To find an element's block, we bisect the block maximums; to find the element within its block, we bisect the block.  A Fenwick tree (binary indexed tree) over the block lengths finds the block holding the k-th element in O(log(b)) time, where b is the number of blocks.
+
+    There is no lazy deletion, so there is no garbage, memory is strictly proportional to the number of elements, and no operation ever has to scrub an unbounded number of dirty elements.  Blocks are only split or merged once every ~'load' operations, which costs O(load + b).
+    """
+
+    LOAD = 64 # The default target block size
+
+    def __init__(self, load=LOAD):
+        """
+        Initializes a new empty window.
+
+        Params:
+        :load - the target block size.  Larger blocks mean fewer blocks to bisect, but larger lists to insert into.
+        """
+        if (load < 1):
+            raise ValueError("SortedWindow: load must be > 0")
+
+        self.load = load
+        self.blocks = [] # Sorted lists of elements; every element of a block is <= every element of the next block
+        self.maxes = [] # The largest element of each block
+        self.tree = [0] # A 1-indexed Fenwick tree of the block lengths
+        self.size = 0
+
+    @classmethod
+    def from_sorted(cls, values, load=LOAD):
+        """
+        Builds a window holding the given values in bulk, by cutting them into blocks of 'load' elements.
+
+        :Runtime: O(m), where m is the number of values.
+
+        Params:
+        :values - a list of values in ascending order.
+        :load - as for the constructor.
+        """
+        window = cls(load=load)
+        window.blocks = [list(values[i:i + load]) for i in range(0, len(values), load)]
+        window.maxes = [block[-1] for block in window.blocks]
+        window.size = len(values)
+        window.build_tree()
+        return window
+
+    @classmethod
+    def from_iterable(cls, values, load=LOAD):
+        """
+        Builds a window holding the given values (in any order) in bulk, by sorting them once.
+
+        :Runtime: O(m * log(m)), where m is the number of values.
+
+        Params:
+        :values - an iterable of values.
+        :load - as for the constructor.
+        """
+        return cls.from_sorted(sorted(values), load=load)
+
+    def __len__(self):
+        """ Returns the number of elements in the window. """
+        return self.size
+
+    def stats(self):
+        """
+        Reports cheap numeric statistics about the window's size, in the same form as MedianHeap.stats().  There is never any garbage, so 'dead' is always 0.
+
+        :Runtime: O(1)
+
+        :return - a dict of the number of live elements, the number of blocks, and (always 0) 'dead'.
+        """
+        return {
+            "live": self.size,
+            "blocks": len(self.blocks),
+            "dead": 0
+        }
+
+    def __str__(self):
+        """ Pretty-prints the current window status to a string. """
+        return "Blocks: " + str(self.blocks) + "\nMedian: " + str(self.median())
+
+    def __getitem__(self, rank):
+        """ Returns the rank-th smallest element (counting from 0); negative ranks count from the largest element, like list indices. """
+        return self.select(rank)
+
+    def build_tree(self):
+        """
+        Rebuilds the Fenwick tree from the block lengths.
+
+        :Runtime: O(b), where b is the number of blocks.
+        """
+        tree = [0] + [len(block) for block in self.blocks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if (parent < len(tree)):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def tree_add(self, block_idx, delta):
+        """
+        Adds 'delta' to the length of the given block in the Fenwick tree.
+
+        :Runtime: O(log(b))
+        """
+        tree = self.tree
+        i = block_idx + 1
+        while (i < len(tree)):
+            tree[i] += delta
+            i += i & -i
+
+    def locate(self, rank):
+        """
+        Finds the block holding the rank-th smallest element, by descending the Fenwick tree.
+
+        :Runtime: O(log(b))
+
+        :return - (the block's index, the element's index within the block)
+        """
+        tree = self.tree
+        pos = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while (step):
+            nxt = pos + step
+            if (nxt < len(tree) and tree[nxt] <= rank):
+                pos = nxt
+                rank -= tree[nxt]
+            step >>= 1
+        return pos, rank
+
+    def push(self, elem):
+        """
+        Inserts an element into the window.
+
+        :Runtime: O(log(m) + load) where m is the number of elements; the load term is a memmove within a single block.
+
+        Params:
+        :elem - the element to insert.  Raises a ValueError if it is NaN, which can't be ordered, so bisect could never find it again.
+        """
+        if (elem != elem):
+            raise ValueError("SortedWindow: cannot push NaN")
+        self.size += 1
+        if (not self.blocks):
+            self.blocks.append([elem])
+            self.maxes.append(elem)
+            self.build_tree()
+            return
+
+        idx = bisect.bisect_left(self.maxes, elem)
+        if (idx == len(self.maxes)):
+            # Larger than every element; append it to the last block.
+            idx -= 1
+            self.blocks[idx].append(elem)
+            self.maxes[idx] = elem
+        else:
+            bisect.insort(self.blocks[idx], elem)
+
+        block = self.blocks[idx]
+        if (len(block) > 2 * self.load):
+            # Split the block in half.
+            upper = block[self.load:]
+            del block[self.load:]
+            self.blocks.insert(idx + 1, upper)
+            self.maxes[idx] = block[-1]
+            self.maxes.insert(idx + 1, upper[-1])
+            self.build_tree()
+        else:
+            self.tree_add(idx, 1)
+
+    def remove(self, elem):
+        """
+        Removes one occurrence of a given element from the window.
+
+        :Runtime: O(log(m) + load)
+
+        Params:
+        :elem - the element to remove.  Raises a RuntimeError if the element is not in the window.
+        """
+        idx = bisect.bisect_left(self.maxes, elem)
+        if (idx == len(self.maxes)):
+            raise RuntimeError("SortedWindow: cannot remove an element that is not in the window")
+        block = self.blocks[idx]
+        pos = bisect.bisect_left(block, elem)
+        # NaN compares false to everything, so bisect may point past the end of the block.
+        if (pos == len(block) or block[pos] != elem):
+            raise RuntimeError("SortedWindow: cannot remove an element that is not in the window")
+
+        del block[pos]
+        self.size -= 1
+
+        if (len(block) * 2 < self.load and len(self.blocks) > 1):
+            # Merge the block into a neighbour, then split the result again if it got too big.
+            if (idx == 0):
+                idx = 1
+            lower = self.blocks[idx - 1]
+            lower.extend(self.blocks[idx])
+            del self.blocks[idx]
+            del self.maxes[idx]
+            if (len(lower) > 2 * self.load):
+                half = len(lower) // 2
+                self.blocks.insert(idx, lower[half:])
+                del lower[half:]
+                self.maxes.insert(idx, self.blocks[idx][-1])
+            self.maxes[idx - 1] = lower[-1]
+            self.build_tree()
+        elif (not block):
+            del self.blocks[idx]
+            del self.maxes[idx]
+            self.build_tree()
+        else:
+            self.maxes[idx] = block[-1]
+            self.tree_add(idx, -1)
+
+    def slide(self, old, new):
+        """
+        Replaces one occurrence of an element with another, i.e. slides a window by one element: the same as remove(old) followed by push(new).
+
+        If the new element belongs in the old element's block, it replaces it within that block, so no block changes length, and neither the Fenwick tree nor the block structure needs updating.  Otherwise this falls back to remove() and push().
+
+        :Runtime: O(log(m) + load)
+
+        Params:
+        :old - the element leaving the window.  Raises a RuntimeError if the element is not in the window.
+        :new - the element entering the window.  Raises a ValueError if it is NaN, as for push().
+        """
+        idx = bisect.bisect_left(self.maxes, old)
+        pos = -1 if idx == len(self.maxes) else bisect.bisect_left(self.blocks[idx], old)
+        if (pos < 0 or pos == len(self.blocks[idx]) or self.blocks[idx][pos] != old):
+            raise RuntimeError("SortedWindow: cannot remove an element that is not in the window")
+        if (new != new):
+            raise ValueError("SortedWindow: cannot push NaN")
+
+        block = self.blocks[idx]
+        if ((idx == 0 or new >= self.maxes[idx - 1]) and (idx == len(self.blocks) - 1 or new <= self.blocks[idx + 1][0])):
+            del block[pos]
+            bisect.insort(block, new)
+            self.maxes[idx] = block[-1]
+        else:
+            self.remove(old)
+            self.push(new)
+
+    def select(self, rank):
+        """
+        Returns the rank-th smallest element (counting from 0); negative ranks count from the largest element.
+
+        :Runtime: O(log(b))
+        """
+        if (rank < 0):
+            rank += self.size
+        if (rank < 0 or rank >= self.size):
+            raise IndexError("SortedWindow: rank out of range")
+
+        idx, pos = self.locate(rank)
+        return self.blocks[idx][pos]
+
+    def median(self):
+        """
+        Computes the median from the middle one or two elements.
+
+        :Runtime: O(log(b))
+
+        :return - the median of data in the window.
+        """
+        if (self.size == 0):
+            return None
+
+        half = self.size // 2
+        if (self.size % 2 == 1):
+            return self.select(half)
+        return (self.select(half) + self.select(half - 1)) / 2.0
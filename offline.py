@@ -0,0 +1,161 @@
+"""
+    This file defines offline filtering of recorded scan logs that may be far larger than memory.
+
+    The log is memory-mapped rather than loaded, and filtered in large chunks of consecutive scans, so the OS pages it in (and the results out) with sequential I/O.  Run it from the command line with
+
+        python -m offline input.npy output.npy --window 5 --minimum 0.03 --maximum 50
+
+    or see 'python -m offline --help' for every option.
+
+    :author - Nick Tripp, 2018
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from filter import FilterChain, RangeFilter, TemporalMedianFilter
+
+
+def open_scans(path, scan_size=None, dtype=None):
+    """
+    Memory-maps a log of scans, read-only.
+
+    Params:
+    :path - a '.npy' file holding a 2D array of scans, or a raw file of consecutive scans.
+    :scan_size - the number of values per scan.  Required for raw files; checked against the file for '.npy' files.
+    :dtype - the type of every value of a raw file, e.g. 'float32' or 'float64'.  Ignored for '.npy' files, which record their own type.
+
+    :return - a (scan count, scan_size) read-only memmap of the scans.
+    """
+    if (path.endswith(".npy")):
+        scans = np.load(path, mmap_mode='r')
+        if (scans.ndim != 2 or (scan_size is not None and scans.shape[1] != scan_size)):
+            raise ValueError("open_scans: '{}' must hold a 2D array of shape (K, scan_size)".format(path))
+        return scans
+
+    if (scan_size is None or scan_size < 1):
+        raise ValueError("open_scans: scan_size must be > 0 for a raw file")
+    dtype = np.dtype(dtype or np.float64)
+    values = np.memmap(path, dtype=dtype, mode='r')
+    if (len(values) % scan_size != 0):
+        raise ValueError("open_scans: '{}' does not hold a whole number of scans of size {}".format(path, scan_size))
+    return values.reshape(-1, scan_size)
+
+def create_output(path, shape, dtype):
+    """
+    Creates a writable memmap for the filtered scans: a '.npy' file if the path ends in '.npy', otherwise a raw file.
+
+    :return - a writable memmap of the given shape and type.
+    """
+    if (path.endswith(".npy")):
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    return np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+
+def filter_file(input_path, output_path, window=None, minimum=None, maximum=None, scan_size=None, dtype=None,
+                f_type=TemporalMedianFilter.TYPE_NUMPY, chunk_size=4096, progress=None):
+    """
+    Filters a recorded log of scans into a new file, with a RangeFilter and/or a TemporalMedianFilter.
+
+    The input is memory-mapped, and every chunk of 'chunk_size' scans is filtered with a single FilterChain.update_batch() call, then written straight into the memory-mapped output, so memory use is bounded by the chunk size, not the length of the log.  The results are identical to calling update() on every scan in turn.
+
+    Params:
+    :input_path - the log to filter; see open_scans().
+    :output_path - the file to write the filtered scans to ('.npy' or raw), in the same type as the input.
+    :window - the window of the TemporalMedianFilter; None for no median filter.
+    :minimum, maximum - the bounds of the RangeFilter; both None for no range filter.
+    :scan_size, dtype - describe a raw input file; see open_scans().
+    :f_type - the TemporalMedianFilter type.  TYPE_NUMPY is the default, since its update_batch() is vectorized across a whole chunk.
+    :chunk_size - the number of scans filtered at a time.
+    :progress - an optional function called after every chunk as progress(scans done, total scans, input bytes done, seconds elapsed).
+
+    :return - a dict of the number of 'scans' filtered, the 'seconds' taken, and the throughput in 'scans_per_second' and 'mb_per_second' (of input read).
+    """
+    if (chunk_size < 1):
+        raise ValueError("filter_file: chunk_size must be > 0")
+
+    scans = open_scans(input_path, scan_size=scan_size, dtype=dtype)
+    count, scan_size = scans.shape
+
+    filters = []
+    if (minimum is not None or maximum is not None):
+        filters.append(RangeFilter(minimum=minimum, maximum=maximum))
+    if (window is not None):
+        filters.append(TemporalMedianFilter(window, scan_size, f_type=f_type))
+    if (not filters):
+        raise ValueError("filter_file: at least one of window, minimum or maximum must be given")
+    chain = FilterChain(filters)
+
+    output = create_output(output_path, scans.shape, scans.dtype)
+
+    start = time.perf_counter()
+    for lo in range(0, count, chunk_size):
+        hi = min(lo + chunk_size, count)
+        output[lo:hi] = chain.update_batch(scans[lo:hi])
+        if (progress is not None):
+            progress(hi, count, hi * scan_size * scans.itemsize, time.perf_counter() - start)
+    output.flush()
+    elapsed = time.perf_counter() - start
+
+    for f in filters:
+        if (isinstance(f, TemporalMedianFilter)):
+            f.close()
+    del output
+
+    return {
+        "scans": count,
+        "seconds": elapsed,
+        "scans_per_second": count / elapsed if elapsed > 0 else None,
+        "mb_per_second": scans.nbytes / elapsed / 1e6 if elapsed > 0 else None
+    }
+
+def print_progress(done, total, nbytes, elapsed):
+    """ Reports progress and throughput on standard error, overwriting the previous report. """
+    elapsed = max(elapsed, 1e-9)
+    sys.stderr.write("\r{}/{} scans ({:.1%}), {:.0f} scans/s, {:.1f} MB/s".format(done, total, done / total, done / elapsed, nbytes / elapsed / 1e6))
+    sys.stderr.flush()
+
+
+def parse_args(argv=None):
+    """ Parses the command line. """
+    parser = argparse.ArgumentParser(description="Filters a recorded log of scans, memory-mapping the input and output.")
+    parser.add_argument("input", help="the log to filter: a '.npy' file of shape (K, scan_size), or a raw file (see --scan-size and --dtype)")
+    parser.add_argument("output", help="the file to write the filtered scans to; a '.npy' file if it ends in '.npy', otherwise raw")
+    parser.add_argument("--window", type=int, default=None, help="the window of the temporal median filter; omit for no median filter")
+    parser.add_argument("--minimum", type=float, default=None, help="the minimum of the range filter")
+    parser.add_argument("--maximum", type=float, default=None, help="the maximum of the range filter")
+    parser.add_argument("--scan-size", type=int, default=None, help="the number of values per scan (required for raw input)")
+    parser.add_argument("--dtype", choices=["float32", "float64"], default="float64", help="the type of every value of a raw input")
+    parser.add_argument("--engine", default=TemporalMedianFilter.TYPE_NUMPY, help="the TemporalMedianFilter type to use")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="the number of scans filtered at a time")
+    parser.add_argument("--quiet", action="store_true", help="don't report progress")
+    args = parser.parse_args(argv)
+
+    if (args.window is None and args.minimum is None and args.maximum is None):
+        parser.error("at least one of --window, --minimum or --maximum is required")
+    if (args.engine not in TemporalMedianFilter.TYPES | {TemporalMedianFilter.TYPE_AUTO}):
+        parser.error("engine '{}' does not exist".format(args.engine))
+
+    return args
+
+def main(argv=None):
+    """
+    Filters the log named on the command line, then reports the throughput.
+
+    :return - the process exit code.
+    """
+    args = parse_args(argv)
+    summary = filter_file(
+        args.input, args.output, window=args.window, minimum=args.minimum, maximum=args.maximum,
+        scan_size=args.scan_size, dtype=args.dtype, f_type=args.engine, chunk_size=args.chunk_size,
+        progress=None if args.quiet else print_progress
+    )
+    if (not args.quiet):
+        sys.stderr.write("\n")
+    print("{} scans in {:.2f} s: {:.0f} scans/s, {:.1f} MB/s".format(
+        summary["scans"], summary["seconds"], summary["scans_per_second"] or 0.0, summary["mb_per_second"] or 0.0))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
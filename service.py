@@ -0,0 +1,238 @@
+"""
+    This file defines an asyncio service that filters the scans of many sensors in a single thread.
+
+    :author - Nick Tripp, 2018
+"""
+import asyncio
+import struct
+
+import numpy as np
+
+from filter import TemporalMedianFilter
+
+
+class SensorState:
+    """ The per-sensor state of a FilterService: the sensor's filter, and its bounded queue of pending (scan, future) pairs. """
+
+    def __init__(self, med_filter, max_pending):
+        self.filter = med_filter
+        self.queue = asyncio.Queue(maxsize=max_pending)
+
+
+class FilterService:
+    """
+    Filters the scans of many sensors, each with its own TemporalMedianFilter state, from a single asyncio task.
+
+    Rather than one thread per sensor (which all contend for the GIL), sensors submit scans with 'await service.update(sensor_id, scan)', either in-process or through a local Unix socket (see serve_unix()).  Scans wait in a bounded per-sensor queue, and once per event-loop tick, the service drains every queue at once.  Sensors with a single pending scan (e.g. every sensor that awaits each result before sending its next scan) are filtered together, with one TemporalMedianFilter.update_many() call, which computes all of their TYPE_NUMPY medians in one vectorized partition.  A sensor with several pending scans has them filtered with a single update_batch() call, which is vectorized over its scans for TYPE_NUMPY.
+
+    Backpressure: each sensor may have at most 'max_pending' scans queued.  Once its queue is full, update() waits for room instead of queueing more, and a socket connection stops reading until its reply has been written, so neither a fast sensor nor a slow reader can grow memory without bound.
+    """
+
+    HEADER = struct.Struct("<I") # A socket request is a little-endian uint32 sensor id, followed by the scan as scan_size little-endian float64 values
+
+    def __init__(self, window, scan_size, f_type=TemporalMedianFilter.TYPE_NUMPY, max_pending=64, resolution=0.01):
+        """
+        Creates a new service, filtering every sensor with the given specs.
+
+        Params:
+        :window, scan_size, f_type, resolution - as for TemporalMedianFilter; every sensor gets its own filter with these specs.
+        :max_pending - the most scans any one sensor may have queued at once.
+        """
+        # Validate the specs once, before any sensor connects.
+        TemporalMedianFilter(window, scan_size, f_type=f_type, resolution=resolution)
+        if (max_pending < 1):
+            raise ValueError("FilterService: max_pending must be > 0")
+
+        self.window = window
+        self.scan_size = scan_size
+        self.type = f_type
+        self.resolution = resolution
+        self.max_pending = max_pending
+
+        self.sensors = {} # Maps sensor ids to SensorStates
+        self.ready = None
+        self.task = None
+        self.servers = []
+
+    def sensor(self, sensor_id):
+        """ Returns the state of a sensor, creating it the first time the sensor is seen. """
+        state = self.sensors.get(sensor_id)
+        if (state is None):
+            med_filter = TemporalMedianFilter(self.window, self.scan_size, f_type=self.type, resolution=self.resolution)
+            state = self.sensors[sensor_id] = SensorState(med_filter, self.max_pending)
+        return state
+
+    async def start(self):
+        """ Starts the task that filters queued scans.  Must be called from the event loop the service runs in. """
+        if (self.task is None):
+            self.ready = asyncio.Event()
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def close(self):
+        """ Stops serving sockets and filtering scans; scans still queued fail with a RuntimeError.  Calling this more than once is harmless. """
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.servers = []
+
+        if (self.task is not None):
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+        for state in self.sensors.values():
+            while (not state.queue.empty()):
+                scan, future = state.queue.get_nowait()
+                if (not future.done()):
+                    future.set_exception(RuntimeError("FilterService: service is closed"))
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def update(self, sensor_id, scan):
+        """
+        Queues a scan from a sensor, and waits for it to be filtered.
+
+        Params:
+        :sensor_id - any hashable id of the sensor; each id gets its own filter state.
+        :scan - an input array of size self.scan_size.
+
+        :return - the sensor's running-window median after this scan.
+        """
+        if (self.task is None):
+            raise RuntimeError("FilterService: service is not started")
+        if (len(scan) != self.scan_size):
+            raise ValueError("FilterService.update(): input scan must be of size self.scan_size")
+
+        future = asyncio.get_running_loop().create_future()
+        await self.sensor(sensor_id).queue.put((scan, future))
+        self.ready.set()
+        return await future
+
+    def tick(self):
+        """
+        Filters every queued scan: the sensors with a single pending scan are filtered together with one update_many() call, and each other sensor's pending scans with one update_batch() call.
+
+        :return - the number of scans filtered.
+        """
+        filtered = 0
+        singles = []
+        for state in self.sensors.values():
+            pending = [state.queue.get_nowait() for i in range(state.queue.qsize())]
+            if (len(pending) == 1):
+                singles.append((state, pending))
+            elif (pending):
+                filtered += self.resolve(pending, lambda: state.filter.update_batch(np.array([scan for scan, future in pending], dtype=float)))
+
+        if (singles):
+            filters = [state.filter for state, pending in singles]
+            pending = [pending[0] for state, pending in singles]
+            filtered += self.resolve(pending, lambda: TemporalMedianFilter.update_many(filters, [scan for scan, future in pending]))
+        return filtered
+
+    def resolve(self, pending, filter_scans):
+        """
+        Filters a list of pending (scan, future) pairs with filter_scans(), and sets each future to its result, or every future to the exception it raised.
+
+        :return - the number of scans filtered.
+        """
+        try:
+            results = filter_scans()
+        except Exception as e:
+            for scan, future in pending:
+                if (not future.done()):
+                    future.set_exception(e)
+            return 0
+
+        for (scan, future), result in zip(pending, results):
+            if (not future.done()):
+                future.set_result(result)
+        return len(pending)
+
+    async def run(self):
+        """ The service's main loop: waits for scans to be queued, then filters everything queued so far, once per event-loop tick. """
+        while (True):
+            await self.ready.wait()
+            self.ready.clear()
+            self.tick()
+            # Let the sensors queue more scans (and pick up their results) before the next tick.
+            await asyncio.sleep(0)
+
+    async def serve_unix(self, path):
+        """
+        Accepts scans over a Unix socket at 'path', and starts the service if needed.
+
+        Each request is a HEADER holding the sensor id, followed by the scan as self.scan_size little-endian float64 values; the reply is the filtered scan, in the same format.  A connection may send scans for any sensors, but its requests are answered one at a time, in order.
+
+        :return - the asyncio server.
+        """
+        await self.start()
+        server = await asyncio.start_unix_server(self.handle_connection, path=path)
+        self.servers.append(server)
+        return server
+
+    async def handle_connection(self, reader, writer):
+        """ Answers the requests of one socket connection until it closes. """
+        scan_bytes = self.scan_size * 8
+        try:
+            while (True):
+                try:
+                    header = await reader.readexactly(self.HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                (sensor_id,) = self.HEADER.unpack(header)
+                scan = np.frombuffer(await reader.readexactly(scan_bytes), dtype='<f8')
+
+                result = await self.update(sensor_id, scan)
+                writer.write(np.asarray(result, dtype='<f8').tobytes())
+                # Stop reading until the reply is on its way, so a slow reader cannot pile up replies.
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class SensorClient:
+    """ A client for a FilterService served over a Unix socket. """
+
+    def __init__(self, reader, writer, scan_size):
+        self.reader = reader
+        self.writer = writer
+        self.scan_size = scan_size
+
+    @classmethod
+    async def connect(cls, path, scan_size):
+        """ Connects to the service at the Unix socket 'path', which filters scans of size 'scan_size'. """
+        reader, writer = await asyncio.open_unix_connection(path)
+        return cls(reader, writer, scan_size)
+
+    async def update(self, sensor_id, scan):
+        """
+        Sends one scan from a sensor, and waits for the filtered scan.
+
+        Params:
+        :sensor_id - the id of the sensor, an integer in [0, 2^32).
+        :scan - an input array of size self.scan_size.
+
+        :return - the sensor's running-window median after this scan.
+        """
+        scan = np.asarray(scan, dtype='<f8')
+        if (scan.shape != (self.scan_size,)):
+            raise ValueError("SensorClient.update(): input scan must be of size self.scan_size")
+
+        self.writer.write(FilterService.HEADER.pack(sensor_id) + scan.tobytes())
+        await self.writer.drain()
+        return np.frombuffer(await self.reader.readexactly(self.scan_size * 8), dtype='<f8').astype(np.float64)
+
+    async def close(self):
+        """ Closes the connection. """
+        self.writer.close()
+        await self.writer.wait_closed()
@@ -0,0 +1,189 @@
+"""
+    This file defines a TemporalMedianFilter that shards its columns across a pool of worker processes.
+
+    :author - Nick Tripp, 2018
+"""
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from filter import TemporalMedianFilter
+
+
+def attach_shared_array(name, shape):
+    """
+    Attaches to an existing block of shared memory, and views it as a float64 array of the given shape.
+
+    NOTE: the block is owned (and eventually unlinked) by the process that created it; workers only ever close() their handle.
+
+    :return - (the SharedMemory object, the array viewing it)
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+
+def shard_worker(conn, scan_name, result_name, scan_size, lo, hi, window, f_type, resolution):
+    """
+    The main loop of a worker process, which filters columns [lo, hi) of every scan.
+
+    The worker owns the median state of its shard.  Scans are read from, and results are written to, shared memory, so the only messages sent over 'conn' are one-byte commands:
+        - b'u': filter the scan currently in shared memory, then reply b'd' (or b'e' followed by an error message).
+        - b'q': quit.
+    """
+    scan_shm, scans = attach_shared_array(scan_name, (scan_size,))
+    result_shm, results = attach_shared_array(result_name, (scan_size,))
+    scan = scans[lo:hi]
+    result = results[lo:hi]
+
+    med_filter = TemporalMedianFilter(window, hi - lo, f_type=f_type, resolution=resolution)
+
+    try:
+        while (conn.recv_bytes() == b'u'):
+            try:
+                med_filter.update(scan, out=result)
+            except Exception as e:
+                conn.send_bytes(b'e' + repr(e).encode())
+            else:
+                conn.send_bytes(b'd')
+    finally:
+        del scan, result, scans, results
+        scan_shm.close()
+        result_shm.close()
+        conn.close()
+
+
+class ShardedTemporalMedianFilter:
+    """
+    A sliding-window-median filter that splits the columns of each scan across a pool of worker processes.
+
+    Every column of a TemporalMedianFilter is independent, so each worker runs its own TemporalMedianFilter over a contiguous shard of the columns.  This sidesteps the GIL, so the per-column engines (i.e. the heap engines) scale close to linearly with the number of cores for wide scans.
+
+    Scans and results are exchanged through two blocks of shared memory, so no scan data is ever pickled; each update only sends a one-byte command to every worker and waits for a one-byte reply.
+
+    The filter holds processes and shared memory, so call close() (or use it as a context manager) when done with it.
+    """
+
+    def __init__(self, window, scan_size, f_type=TemporalMedianFilter.TYPE_HEAP, workers=None, resolution=0.01):
+        """
+        Creates a new sharded Median Filter with the given specs, and starts its worker processes.
+
+        Params:
+        :window, scan_size, f_type, resolution - as for TemporalMedianFilter.
+        :workers - the number of worker processes.  Defaults to the number of CPUs, and is capped at scan_size.
+        """
+        # Validate the parameters in this process, before starting any workers.
+        TemporalMedianFilter(window, 1, f_type=f_type, resolution=resolution)
+        if (scan_size < 1):
+            raise ValueError("ShardedTemporalMedianFilter: scan_size must be > 0")
+        if (workers is None):
+            workers = os.cpu_count() or 1
+        if (workers < 1):
+            raise ValueError("ShardedTemporalMedianFilter: workers must be > 0")
+
+        self.window = window
+        self.scan_size = scan_size
+        self.type = f_type
+        self.workers = min(workers, scan_size)
+
+        self.scan_shm = shared_memory.SharedMemory(create=True, size=scan_size * 8)
+        self.result_shm = shared_memory.SharedMemory(create=True, size=scan_size * 8)
+        self.scan = np.ndarray((scan_size,), dtype=np.float64, buffer=self.scan_shm.buf)
+        self.result = np.ndarray((scan_size,), dtype=np.float64, buffer=self.result_shm.buf)
+
+        self.bounds = np.linspace(0, scan_size, self.workers + 1).astype(int)
+        self.conns = []
+        self.processes = []
+        for lo, hi in zip(self.bounds[:-1], self.bounds[1:]):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=shard_worker,
+                args=(child_conn, self.scan_shm.name, self.result_shm.name, scan_size, lo, hi, window, f_type, resolution),
+                daemon=True
+            )
+            process.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.processes.append(process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def update(self, scan, out=None):
+        """
+        Filters one scan across all workers.
+
+        Params:
+        :scan - an input array of size self.scan_size.
+        :out - an optional array of size self.scan_size to write the result into.
+
+        :return - the current running-window median (which is 'out', if given).
+        """
+        if (self.scan is None):
+            raise RuntimeError("ShardedTemporalMedianFilter: filter is closed")
+        if (len(scan) != self.scan_size):
+            raise ValueError("ShardedTemporalMedianFilter.update(): input scan must be of size self.scan_size")
+
+        self.scan[:] = scan
+        for conn in self.conns:
+            conn.send_bytes(b'u')
+
+        errors = []
+        for conn in self.conns:
+            reply = conn.recv_bytes()
+            if (reply != b'd'):
+                errors.append(reply[1:].decode())
+        if (errors):
+            raise RuntimeError("ShardedTemporalMedianFilter: worker failed: " + "; ".join(errors))
+
+        if (out is None):
+            return self.result.copy()
+        np.copyto(out, self.result)
+        return out
+
+    def update_batch(self, scans):
+        """
+        Filters a block of scans, one scan at a time.
+
+        Params:
+        :scans - a 2D array of shape (K, self.scan_size).
+
+        :return - a (K, self.scan_size) array whose k-th row is the running-window median after the k-th scan.
+        """
+        scans = np.asarray(scans)
+        if (scans.ndim != 2 or scans.shape[1] != self.scan_size):
+            raise ValueError("ShardedTemporalMedianFilter.update_batch(): input scans must be of shape (K, self.scan_size)")
+
+        result = np.empty(scans.shape)
+        for k, scan in enumerate(scans):
+            self.update(scan, out=result[k])
+        return result
+
+    def close(self):
+        """ Stops the worker processes, and frees the shared memory.  Calling this more than once is harmless. """
+        if (self.scan is None):
+            return
+
+        for conn in self.conns:
+            try:
+                conn.send_bytes(b'q')
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if (process.is_alive()):
+                process.terminate()
+                process.join()
+        for conn in self.conns:
+            conn.close()
+
+        self.scan = None
+        self.result = None
+        self.scan_shm.close()
+        self.scan_shm.unlink()
+        self.result_shm.close()
+        self.result_shm.unlink()
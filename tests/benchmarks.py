@@ -1,153 +1,167 @@
 """
-    This file defines timed benchmark tests for different parts of this project.
+    This file defines timed benchmark suites for different parts of this project.
 
-    Run with 'python benchmark.py'.
+    Run with 'python tests/benchmarks.py --help' to see every option.  For example,
 
-    *WARNING*: This script could take a long time! On my machine, running all tests with these parameters takes ~20 minutes!  If you don't want to run all tests, you can disable individual tests by commenting out the @test decorator tag prepending each test method. You can also change the test inputs to run in fewer iterations, but some implementations (i.e. MedianHeap) only show superior performance with a large number of iterations.
+        python tests/benchmarks.py --suite filter --windows 10,500 --scan-sizes 1000 --engines TYPE_NUMPY,TYPE_HEAP --output results.json
 
+    runs the TemporalMedianFilter suite over a grid of 2 windows x 1 scan size x 2 engines, and writes the results to results.json.  Passing '--baseline results.json' to a later run compares it against those results, and flags any regression.
+
+    All input data is generated from a fixed seed before any timing starts, so the timings measure only the code under test.  Every benchmark is repeated '--repeats' times, and the min, median and standard deviation of the repeats are reported.
 
     Benchmarked modules include:
-        - MedianHeap
+        - MedianHeap, IndexedMedianHeap and SortedWindow
         - TemporalMedianFilter
 
     :author - Nick Tripp, 2018
 """
-import timeit, time
-import os, sys
-import random
+import argparse
+import heapq
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 
-from med_heap import MedianHeap
-from filter import RangeFilter, TemporalMedianFilter
+from med_heap import MedianHeap, IndexedMedianHeap, SortedWindow
+from filter import TemporalMedianFilter
 
 ##############################################################
-##################   BENCHMARK SETUP   #################$$####
+##################   BENCHMARK SETUP   #######################
 ##############################################################
 
 ###
 # Benchmark globals
 ###
-suites = {} # Maps suite names to lists of test suite functions
+suites = {} # Maps suite names to suite functions
 suite_descriptions = {}
 # Test Suite Names:
-MEDIAN_HEAP = "MedianHeap"
-TEMPORAL_FILTER = "TemporalMedianFilter"
+MEDIAN_HEAP = "heap"
+TEMPORAL_FILTER = "filter"
+
+HEAP_STRUCTURES = { "MedianHeap":MedianHeap, "IndexedMedianHeap":IndexedMedianHeap, "SortedWindow":SortedWindow }
+PARAMS_WIDTH = 64 # The width of the Params column of the results tables
 
 
 ###
 # DECORATORS
 ###
 
-def test(name):
+def suite(name, description):
     """
-    A decorator for bench tests.
+    A decorator for bench suites.
 
-    Adds the marked test to the test suite holding the specified name.
+    Registers the marked suite under the given name.
 
-    Each marked test must take no parameters.
-
-    Each marked test should run its benchmark, printing to standard output, and return nothing.
+    Each marked suite takes the parsed command line arguments, and returns a list of result records (see run_benchmark()).
     """
 
-    def add_test_to_suite(func):
-        if name not in suites:
-            suites[name] = [func]
-        else:
-            suites[name].append(func)
+    def add_suite(func):
+        suites[name] = func
+        suite_descriptions[name] = description
+        return func
 
-    return add_test_to_suite
+    return add_suite
 
 ###
 # Helper functions
 ###
 
 class color:
-    """ A class for constants to stylize terminal output. """
-    PURPLE = '\033[95m'
-    CYAN = '\033[96m'
-    DARKCYAN = '\033[36m'
-    BLUE = '\033[94m'
-    GREEN = '\033[92m'
-    YELLOW = '\033[93m'
-    RED = '\033[91m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
-    END = '\033[0m'
-
-
-def print_header():
-    """ Prints a header for this benchmark testing session. """
-    rows, columns = os.popen('stty size', 'r').read().split()
-    head_str=color.BOLD + "{:=^" + columns + "}" + color.END
-    print(head_str.format(" Running Benchmark Test Suites "))
-
-def print_footer(tests_run, time_eleapsed):
-    """
-    Prints a footer for this benchmark testing session.
+    """ A class for constants to stylize terminal output.  Every constant is empty when standard output is not a terminal. """
+    tty = sys.stdout.isatty()
+    PURPLE = '\033[95m' if tty else ''
+    GREEN = '\033[92m' if tty else ''
+    RED = '\033[91m' if tty else ''
+    BOLD = '\033[1m' if tty else ''
+    UNDERLINE = '\033[4m' if tty else ''
+    END = '\033[0m' if tty else ''
 
-    Includes the total number of tests run and total time elapsed.
 
-    Params
-    :tests_run - the total number of ran tests to print.
-    :time_elapsed - the total amount of elapsed time, in seconds, to print.
-    """
-    rows, columns = os.popen('stty size', 'r').read().split()
-    head_str=color.BOLD + color.GREEN + "{:=^" + columns + "}" + color.END
-    print(head_str.format(" {} Tests Run, {} seconds elapsed ".format(tests_run, time_eleapsed)))
+def int_list(text):
+    """ Parses a comma-separated list of integers from the command line. """
+    return [int(x) for x in text.split(",") if x]
 
-def run_suite(suite_name):
-    """
-    Prints a header for the given test suite, then runs all tests under that suite name.
+def str_list(text):
+    """ Parses a comma-separated list of names from the command line. """
+    return [x for x in text.split(",") if x]
 
-    Params:
-    :suite_name - the name of the test suite to run.  Any given name string must match that passed to a @test decorator.
-
-    :return - the number of tests ran in this suite.
+def run_benchmark(suite_name, name, params, repeats, setup, run, teardown=None):
     """
-    if (suite_name not in suites):
-        raise ValueError("Suite '{}' does not exist".format(suite_name))
+    Times a benchmark 'repeats' times, and summarizes the timings.
 
-    rows, columns = os.popen('stty size', 'r').read().split()
-    head_str=color.PURPLE + "{:=^" + columns + "}" + color.END
-    print(head_str.format(" Bench-Test Suite: {} ".format(suite_name)))
-    if (suite_name in suite_descriptions):
-        print(suite_descriptions[suite_name])
+    Params:
+    :suite_name, name, params - identify the benchmark; (suite, name, params) must be unique within a run.
+    :repeats - the number of times to run the benchmark.
+    :setup - a function called, untimed, before every repeat; its return value is passed to 'run'.
+    :run - the function to time.
+    :teardown - an optional function called, untimed, after every repeat, with the same value as 'run'.
+
+    :return - a result record: a dict holding the identifying fields, and the 'min', 'median' and 'stddev' (in seconds) of the timings.
+    """
+    times = []
+    for i in range(repeats):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+        if (teardown is not None):
+            teardown(state)
+
+    return {
+        "suite": suite_name,
+        "name": name,
+        "params": params,
+        "repeats": repeats,
+        "min": min(times),
+        "median": statistics.median(times),
+        "stddev": statistics.stdev(times) if len(times) > 1 else 0.0
+    }
 
-    TESTS = suites[suite_name]
+def result_key(result):
+    """ Returns a hashable key identifying the benchmark a result record belongs to. """
+    return (result["suite"], result["name"], json.dumps(result["params"], sort_keys=True))
 
-    for test in TESTS:
-        print_bench_test(test)
+def format_params(params):
+    """ Formats a result's params for the Params column: padded to PARAMS_WIDTH, and always followed by at least one space, so that a long params string can't run into the next column. """
+    return "{:<{}} ".format(" ".join("{}={}".format(k, v) for k, v in sorted(params.items())), PARAMS_WIDTH - 1)
 
-    tests_count = len(TESTS)
-    head_str= color.PURPLE + "{:-^" + columns + "}" + color.END
-    print(head_str.format(" {}: {} Tests Run ".format(suite_name, tests_count)))
-    return tests_count
+def print_result(result):
+    """ Prints one result record as a row of the results table, with its speedup if it has one. """
+    speedup = "{:.2f}x".format(result["speedup"]) if result.get("speedup") is not None else ""
+    print("{:<22}{}{:<14.6f}{:<14.6f}{:<14.6f}{:<14}".format(result["name"], format_params(result["params"]), result["min"], result["median"], result["stddev"], speedup))
 
-###
-# WRAPPER FUNCTIONS
-###
-def print_bench_test(func):
+def compare_to_baseline(results, baseline, tolerance):
     """
-    Prints a header for the given test, then runs it.
+    Compares each result against the matching result of a baseline run.
 
-    Sepcifically, the header consists of the name of the test as specified by the name of the passed function and the doctstring of the given function.
+    A benchmark has regressed if its median time is more than (1 + tolerance) times the baseline's median time.  Benchmarks missing from the baseline are skipped.
 
-    Params
-    :func - a function defining the benchmark test to run. Must be a named function.
+    :return - a list of (result, baseline result) pairs, one per regression.
     """
-    rows, columns = os.popen('stty size', 'r').read().split()
+    baseline_results = { result_key(result):result for result in baseline["results"] }
+    regressions = []
 
-    head_str="{:_^" + columns + "}"
-    print(head_str.format(" {} ".format(func.__name__)))
-    if (func.__doc__ is not None):
-        print(func.__doc__)
-        head_str="{:.^" + columns + "}"
-    print(head_str.format("") + "\n")
-    func()
-    head_str="{:.^" + columns + "}"
-    print("\n" + head_str.format("") + "\n")
+    print(color.BOLD + "Comparison against baseline" + color.END)
+    print(color.UNDERLINE + "{:<22}{:<{}}{:<14}{:<14}{:<14}".format("Benchmark", "Params", PARAMS_WIDTH, "Baseline (s)", "Median (s)", "Change") + color.END)
+    for result in results:
+        base = baseline_results.get(result_key(result))
+        if (base is None):
+            continue
+        change = result["median"] / base["median"] - 1.0 if base["median"] > 0 else 0.0
+        regressed = change > tolerance
+        if (regressed):
+            regressions.append((result, base))
+        flag = (color.RED + "REGRESSION" + color.END) if regressed else (color.GREEN + "ok" + color.END)
+        print("{:<22}{}{:<14.6f}{:<14.6f}{:<+14.1%}{}".format(result["name"], format_params(result["params"]), base["median"], result["median"], change, flag))
+
+    return regressions
 
 
 ##############################################################
@@ -157,389 +171,173 @@ def print_bench_test(func):
 ##########################
 # MEDIAN HEAP TEST SUITE #
 ##########################
-@test(MEDIAN_HEAP)
-def test_push_speed():
-    """
-    Tests the speed of different sets of many insertions to MedianHeap compared to the same insertions over a python heapq heap.
+@suite(MEDIAN_HEAP, """
+    Times a sliding window over a single data stream of 'scan_count' values, for each structure with the MedianHeap interface: every value is pushed, and once the window is full, the value leaving the window is removed.
 
-    The insertions are randomized on each run of the test, but identically seeded across insertion sets within the same test.
+    'heapq' times a plain heapq push and pop of the same values, as a reference point for raw heap speed.
+""")
+def heap_suite(args):
+    results = []
+    rng = np.random.RandomState(args.seed)
 
-    Insertion on both MedianHeap and heapq should run in O(log(n)) time; inserting n numbers should yield a running time of O(nlog(n)).
+    for scan_count in args.scan_counts:
+        data = rng.uniform(TemporalMedianFilter.MIN_RANGE, TemporalMedianFilter.MAX_RANGE, size=scan_count).tolist()
 
-    EXPECTED BEHAVIOUR: insertion times for Median Heap and heapq should be comparable.
-    """
-    ### COMMON SETUP ###
-    SEED = random.randrange(sys.maxsize)
-    ITERATIONS = [ 10**i for i in range(3,7) ] # List of numbers of iterations to run
-
-    ### MEDIAN HEAP ###
-    setup= """
-from med_heap import MedianHeap
-import random
-med_heap = MedianHeap()
-    """
-    stmt = """
-random.seed({})
-med_heap.push(random.uniform(0.03,50))
-        """.format(SEED)
-
-    med_heap_times = { i:timeit.timeit(setup=setup,stmt=stmt,number=i) for i in ITERATIONS }
-
-    ### HEAPQ ###
-    setup="""
-import heapq, random
-heap = []
-        """
-    stmt = """
-random.seed({})
-elem = random.uniform(0.03,50)
-heapq.heappush(heap,elem)
-heapq.heappop(heap)
-heapq.heappush(heap, elem)
-        """ .format(SEED)
+        for window in args.windows:
+            for name, structure in sorted(HEAP_STRUCTURES.items()):
+                def run(med_heap):
+                    for i, datum in enumerate(data):
+                        if (i >= window):
+                            med_heap.remove(data[i - window])
+                        med_heap.push(datum)
+                        med_heap.median()
 
-    heapq_times = { i:timeit.timeit(setup=setup,stmt=stmt,number=i) for i in ITERATIONS }
+                result = run_benchmark(MEDIAN_HEAP, name, { "window":window, "scan_count":scan_count }, args.repeats, structure, run)
+                print_result(result)
+                results.append(result)
 
+        def run_heapq(heap):
+            for datum in data:
+                heapq.heappush(heap, datum)
+                heapq.heappop(heap)
+                heapq.heappush(heap, datum)
 
-    ### PRINT RESULTS ###
-    print(color.UNDERLINE + "{:<15}{:<15}{:<15}".format("# Of Inserts","MedHeap","Heapq") + color.END)
-    for i in ITERATIONS:
-        print("{:<15}{:<15.7f}{:<15.7f}".format(i,med_heap_times[i],heapq_times[i]))
+        result = run_benchmark(MEDIAN_HEAP, "heapq", { "scan_count":scan_count }, args.repeats, list, run_heapq)
+        print_result(result)
+        results.append(result)
 
+    return results
 
 
 #####################################
 # TEMPORAL MEDIAN FILTER TEST SUITE #
 #####################################
+@suite(TEMPORAL_FILTER, """
+    Times TemporalMedianFilter.update() over a data stream of 'scan_count' scans of width 'scan_size', for each engine, window size and thread count.
 
-###
-# HELPER FUNCS
-###
-
-def time_filter_with_params(window,scan_count,scan_size,seed):
-    """
-    Helper function to run a benchmark with given filering parameters.
-
-    Filters a random data stream of width 'scan_size', with 'scan_count' entries using a filter with a window size 'window'.
-    The data stream is seeded with the given 'seed'.
-
-    The total time to filter all 'scan_count' scans using each of the types of TemporalMedianFilter is recorded and returned.
-
-    Params:
-    :window - the size of the window to pass to the filter
-    :scan_size - the width of each scan
-    :scan_count - the total final number of scans in the data stream
-    :seed - the seed for our psuedo-random number generator.
-
-    :return (int,int) - a tuple of the time it takes to filter the data stream using MedianHeap and numpy.median, respectively.
-    """
-
-    ### COMMON SETUP ###
-    SCAN_COUNT = scan_count
-    params = {
-        "SCAN_SIZE": scan_size, # Width of each scan
-        "WINDOW": window, # window size
-        "SEED": seed,
-        "TYPE": TemporalMedianFilter.TYPE_HEAP
-    }
-    base_setup="""
-import numpy as np
-import random
-from filter import TemporalMedianFilter
-
-filter = TemporalMedianFilter(window={WINDOW}, scan_size={SCAN_SIZE}, f_type="{TYPE}")
-
-random.seed({SEED})
-        """
-    stmt = """
-scan = np.array([random.uniform(0.03,50) for x in range({SCAN_SIZE})])
-filter.update(scan)
-        """.format(**params)
-
-    ### MEDIAN HEAP TIME ###
-    setup=base_setup.format(**params)
-
-    med_heap_time = timeit.timeit(stmt=stmt,setup=setup, number=SCAN_COUNT)
-
-    ### NUMPY MEDIAN TIME ###
-    params["TYPE"] = TemporalMedianFilter.TYPE_NUMPY
-    setup=base_setup.format(**params)
-
-    numpy_time = timeit.timeit(stmt=stmt, setup=setup, number=SCAN_COUNT)
-
-    return med_heap_time, numpy_time
-
-def test_iterations_with_params(scan_counts, scan_size, window_ratio, window=None):
-    """
-    Helper function that runs Median Filter updates over each member of scan_counts, and pretty-prints the result.
-
-    Adjusting scan_counts and window_ratio affects which type of TemporalMedianFilter performs better - in each case, a large scan_count or window_ratio results in the MedianHeap filter outperforming the numpy.median filter.
-
-    Params:
-    :scan_counts list(ints) - an array of scan sets to run.  Each element represents another set of 'element' # of scans to run.
-    :scan_size - the width of each scans to run.
-    :window_ratio - the ratio of the window to the scan_count
-    :window - if a specific window is specified, window_ratio is ignored, and window is used instead.
-    """
-    SEED = random.randrange(sys.maxsize)
-
-    exec_times = { i:(time_filter_with_params(window=(window if window is not None else i*window_ratio), scan_count=i, scan_size=scan_size, seed=SEED)) for i in scan_counts}
-
-    ### PRINT RESULTS ###
-    print("Test Parameters")
-    print(":Scan Width: {} elements".format(scan_size))
-    if window is not None:
-        print(":Window Size: {}\n".format(window))
-    else:
-        print(":Window Size: {}% of scan count\n".format(window_ratio*100))
-    print(color.UNDERLINE + "{:<15}{:<15}{:<15}{:<15}".format("Scan Count","MedHeap (s)","Numpy (s)","Faster Version") + color.END)
-
-    for i in scan_counts:
-        print("{:<15}{:<15.7f}{:<15.7f}{:<15}".format(i,exec_times[i][0],exec_times[i][1],color.GREEN + "Median Heap" + color.END if exec_times[i][0] < exec_times[i][1] else color.RED + "Numpy.median" + color.END ))
-
-
-
-###
-# BENCH TESTS
-###
-suite_descriptions[TEMPORAL_FILTER] =     """
-    Tests different versions of TemporalMedianFilter.update(), including numpy.median and MedianHeap filtering.
-
-    Insertions via update() are randomized on each run of the test, but identically seeded within a test.
+    Thread counts other than 1 only apply to the vectorized engines (see TemporalMedianFilter.VECTORIZED_TYPES).  For those, each result's 'speedup' is the median time of the same engine and parameters with n_threads=1 (which is always run) divided by its own median time.
 
     Runtime comparisions:
     (where 'm' is the window size and 'n' is the total number of scans)
     MedianHeap (average):
         - per update(): O(log(m))
         - total:        O(n*log(m))
-    numpy.median:
+    numpy:
         - per update(): O(m)
         - total:        O(n*m)
-    """
-
-
-
-@test(TEMPORAL_FILTER)
-def test_1DataStream_10percentWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap perfoms increasingly better than Numpy.median as scan_count and/or window_size grows larger.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,6)]
-    SCAN_SIZE = 1
-    WINDOW_RATIO = 0.1
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, WINDOW_RATIO)
-
-@test(TEMPORAL_FILTER)
-def test_1DataStream_50percentWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap perfoms increasingly better than Numpy.median as scan_count and/or window_size grows larger.
-    """
-
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,6)]
-    SCAN_SIZE = 1
-    WINDOW_RATIO = 0.5
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, WINDOW_RATIO)
-
-@test(TEMPORAL_FILTER)
-def test_1DataStream_100percentWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap perfoms increasingly better than Numpy.median as scan_count and/or window_size grows larger.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,6)]
-    SCAN_SIZE = 1
-    WINDOW_RATIO = 1.0
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, WINDOW_RATIO)
-
-@test(TEMPORAL_FILTER)
-def test_10DataStream_10percentWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap perfoms increasingly better than Numpy.median as scan_count and/or window_size grows larger.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,6)]
-    SCAN_SIZE = 10
-    WINDOW_RATIO = 0.1
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, WINDOW_RATIO)
-
-@test(TEMPORAL_FILTER)
-def test_10DataStream_50percentWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap perfoms increasingly better than Numpy.median as scan_count and/or window_size grows larger.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,5)]
-    SCAN_SIZE = 10
-    WINDOW_RATIO = 0.5
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, WINDOW_RATIO)
-
-@test(TEMPORAL_FILTER)
-def test_10DataStream_100percentWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap perfoms increasingly better than Numpy.median as scan_count and/or window_size grows larger.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,5)]
-    SCAN_SIZE = 10
-    WINDOW_RATIO = 1.0
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, WINDOW_RATIO)
-
-
-@test(TEMPORAL_FILTER)
-def test_200DataStream_10percentWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap perfoms increasingly better than Numpy.median as scan_count and/or window_size grows larger.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,5)]
-    SCAN_SIZE = 200
-    WINDOW_RATIO = 0.1
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, WINDOW_RATIO)
-
-@test(TEMPORAL_FILTER)
-def test_200DataStream_50percentWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap perfoms increasingly better than Numpy.median as scan_count and/or window_size grows larger.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,5)]
-    SCAN_SIZE = 200
-    WINDOW_RATIO = 0.5
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, WINDOW_RATIO)
-
-@test(TEMPORAL_FILTER)
-def test_200DataStream_100percentWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap perfoms increasingly better than Numpy.median as scan_count and/or window_size grows larger.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,5)]
-    SCAN_SIZE = 200
-    WINDOW_RATIO = 1.0
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, WINDOW_RATIO)
-
-@test(TEMPORAL_FILTER)
-def test_1000DataStream_10percentWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap perfoms increasingly better than Numpy.median as scan_count and/or window_size grows larger.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,5)]
-    SCAN_SIZE = 1000
-    WINDOW_RATIO = 0.1
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, WINDOW_RATIO)
-
-@test(TEMPORAL_FILTER)
-def test_1000DataStream_50percentWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap perfoms increasingly better than Numpy.median as scan_count and/or window_size grows larger.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,4)] + [2000]
-    SCAN_SIZE = 1000
-    WINDOW_RATIO = 0.5
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, WINDOW_RATIO)
-
-@test(TEMPORAL_FILTER)
-def test_1000DataStream_100percentWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap perfoms increasingly better than Numpy.median as scan_count and/or window_size grows larger.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,4)] + [2000]
-    SCAN_SIZE = 1000
-    WINDOW_RATIO = 1.0
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, WINDOW_RATIO)
-
-@test(TEMPORAL_FILTER)
-def test_1000DataStream_fixedSmallWindow():
-    """
-    EXPECTED BEHAVIOR: Numpy.median runs much faster than MedianHeap for this small window_size.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,4)]
-    SCAN_SIZE = 1000
-    WINDOW = 10
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, None, window=WINDOW)
-
-@test(TEMPORAL_FILTER)
-def test_1000DataStream_fixedLargeWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap runs increasingly faster than numpy.median as scan_count grows larger.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,5)]
-    SCAN_SIZE = 1000
-    WINDOW = 1000
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, None, window=WINDOW)
-
-@test(TEMPORAL_FILTER)
-def test_10DataStream_fixedSmallWindow():
-    """
-    EXPECTED BEHAVIOR: MedianHeap is slower than numpy.median for this small window size.
-    """
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,6)]
-    SCAN_SIZE = 10
-    WINDOW = 10
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, None, window=WINDOW)
-
-@test(TEMPORAL_FILTER)
-def test_10DataStream_fixedLargeWindow():
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,6)]
-    SCAN_SIZE = 10
-    WINDOW = 1000
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, None, window=WINDOW)
-
-@test(TEMPORAL_FILTER)
-def test_1DataStream_fixedLargeWindow():
-
-    ### SETUP ###
-    ITERATIONS = [10**x for x in range(1,6)]
-    SCAN_SIZE = 1
-    WINDOW = 1000
-
-    test_iterations_with_params(ITERATIONS, SCAN_SIZE, None, window=WINDOW)
+    histogram:
+        - per update(): O(1)
+        - total:        O(n)
+""")
+def filter_suite(args):
+    results = []
+    rng = np.random.RandomState(args.seed)
+
+    for scan_size in args.scan_sizes:
+        for scan_count in args.scan_counts:
+            scans = rng.uniform(TemporalMedianFilter.MIN_RANGE, TemporalMedianFilter.MAX_RANGE, size=(scan_count, scan_size))
+
+            for window in args.windows:
+                for engine in args.engines:
+                    thread_counts = [1]
+                    if (engine in TemporalMedianFilter.VECTORIZED_TYPES):
+                        # The single-threaded run is the reference for every speedup.
+                        thread_counts += sorted(set(args.threads) - {1})
+                    single = None
+
+                    for n_threads in thread_counts:
+                        def setup():
+                            return TemporalMedianFilter(window=window, scan_size=scan_size, f_type=engine, n_threads=n_threads), np.empty(scan_size)
+
+                        def run(state):
+                            med_filter, out = state
+                            for scan in scans:
+                                med_filter.update(scan, out=out)
+
+                        def teardown(state):
+                            state[0].close()
+
+                        params = { "window":window, "scan_size":scan_size, "scan_count":scan_count, "n_threads":n_threads }
+                        result = run_benchmark(TEMPORAL_FILTER, engine, params, args.repeats, setup, run, teardown)
+                        if (n_threads == 1):
+                            single = result
+                        result["speedup"] = single["median"] / result["median"] if result["median"] > 0 else None
+                        print_result(result)
+                        results.append(result)
+
+    return results
 
 
 #####################
 #######  MAIN  ######
 #####################
 
-
-def main():
-    tests_run = 0
-
-    print_header()
-
+def parse_args(argv=None):
+    """ Parses the command line; every grid parameter is a comma-separated list. """
+    parser = argparse.ArgumentParser(description="Runs benchmark suites over a grid of parameters.")
+    parser.add_argument("--suite", type=str_list, default=sorted(suites), help="the suites to run: " + ", ".join(sorted(suites)))
+    parser.add_argument("--windows", type=int_list, default=[10, 100], help="the window sizes to run")
+    parser.add_argument("--scan-sizes", type=int_list, default=[200, 1000], help="the scan widths to run (filter suite only)")
+    parser.add_argument("--scan-counts", type=int_list, default=[200], help="the lengths of the data streams to run")
+    parser.add_argument("--engines", type=str_list, default=sorted(TemporalMedianFilter.TYPES), help="the TemporalMedianFilter types to run (filter suite only)")
+    parser.add_argument("--threads", type=int_list, default=[1], help="the thread counts to run (filter suite only)")
+    parser.add_argument("--repeats", type=int, default=5, help="the number of times to repeat each benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="the seed for the generated input data")
+    parser.add_argument("--output", type=str, default=None, help="a path to write the results to, as JSON")
+    parser.add_argument("--baseline", type=str, default=None, help="a path to the JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="the relative slowdown of a median time, compared to the baseline, that counts as a regression")
+    args = parser.parse_args(argv)
+
+    for name in args.suite:
+        if (name not in suites):
+            parser.error("suite '{}' does not exist".format(name))
+    for engine in args.engines:
+        if (engine not in TemporalMedianFilter.TYPES):
+            parser.error("engine '{}' does not exist".format(engine))
+    if (args.repeats < 1):
+        parser.error("--repeats must be > 0")
+
+    return args
+
+def main(argv=None):
+    """
+    Runs the selected suites, then writes and compares the results.
+
+    :return - the process exit code: 1 if any benchmark regressed against the baseline, otherwise 0.
+    """
+    args = parse_args(argv)
     start = time.time()
 
-    for suite in suites:
-        tests_run += run_suite(suite)
-
-    end = time.time()
-    elapsed = end - start
-
-    print_footer(tests_run, elapsed)
+    results = []
+    for name in args.suite:
+        print(color.PURPLE + color.BOLD + "Bench-Test Suite: {}".format(name) + color.END)
+        print(suite_descriptions[name])
+        print(color.UNDERLINE + "{:<22}{:<{}}{:<14}{:<14}{:<14}{:<14}".format("Benchmark", "Params", PARAMS_WIDTH, "Min (s)", "Median (s)", "Stddev (s)", "Speedup") + color.END)
+        results += suites[name](args)
+        print()
+
+    elapsed = time.time() - start
+    print(color.BOLD + "{} benchmarks run, {:.1f} seconds elapsed".format(len(results), elapsed) + color.END)
+
+    if (args.output is not None):
+        report = {
+            "machine": { "python":platform.python_version(), "numpy":np.__version__, "platform":platform.platform(), "cpus":os.cpu_count() },
+            "args": { k:v for k, v in vars(args).items() if k not in ("output", "baseline") },
+            "results": results
+        }
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if (args.baseline is not None):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        print()
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if (regressions):
+            print(color.RED + color.BOLD + "{} benchmarks regressed by more than {:.0%}".format(len(regressions), args.tolerance) + color.END)
+            return 1
+
+    return 0
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -4,13 +4,15 @@
     :author - Nick Tripp, 2018
 """
 
+import json
+
 import pytest
 import numpy as np
 import random
 import timeit
 
 
-from filter import RangeFilter, TemporalMedianFilter
+from filter import FilterChain, RangeFilter, TemporalMedianFilter, TemporalMedianFilterBank
 
 class TestTemporalMedianFilter:
     """ Correctness Tests for TemporalMedianFilter, a sliding-window-median filter. """
@@ -97,6 +99,770 @@ class TestTemporalMedianFilter:
         for (scan, expected_median) in zip(scans, expected_median):
             np.testing.assert_array_almost_equal(med_filter.update(scan), expected_median)
 
+    def test_sorted_update(self):
+        """
+        Tests basic filter updates with known data and expected medians.
+
+        This test uses a sorted window to find the median of a datastream in O(m) time per column, vectorized over all columns.
+        """
+        scans = [
+            np.array([0,1,2,1,3]),
+            np.array([1,5,7,1,3]),
+            np.array([2,3,4,1,0]),
+            np.array([3,3,3,1,3]),
+            np.array([10,2,4,0,0])
+        ]
+
+        expected_median = [
+            np.array([0,1,2,1,3]),
+            np.array([0.5,3,4.5,1,3]),
+            np.array([1,3,4,1,3]),
+            np.array([1.5,3,3.5,1,3]),
+            np.array([2.5,3,4,1,1.5])
+        ]
+
+
+        med_filter= TemporalMedianFilter(3, 5, f_type=TemporalMedianFilter.TYPE_SORTED)
+
+        for (scan, expected_median) in zip(scans, expected_median):
+            np.testing.assert_array_almost_equal(med_filter.update(scan), expected_median)
+
+    def test_sorted_update_duplicates(self):
+        """ Tests the sorted window on a stream with many repeated values, where expired and inserted values tie with others in the window. """
+        WINDOW = 3
+        SCAN_SIZE = 9
+        rng = np.random.RandomState(1)
+        scans = rng.randint(0, 4, size=(60, SCAN_SIZE)).astype(float)
+
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_SORTED)
+
+        for i, scan in enumerate(scans):
+            expected = np.median(scans[max(0, i - WINDOW):i + 1], axis=0)
+            np.testing.assert_array_equal(med_filter.update(scan), expected)
+
+    @pytest.mark.parametrize("resolution", [0.001, 0.01, 0.37])
+    def test_histogram_error_bound(self, resolution):
+        """ Tests that the histogram filter stays within resolution / 2 of the exact median for in-range data. """
+        WINDOW = 9
+        SCAN_SIZE = 20
+        rng = np.random.RandomState(6)
+        scans = rng.uniform(TemporalMedianFilter.MIN_RANGE, TemporalMedianFilter.MAX_RANGE, size=(100, SCAN_SIZE))
+
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_HISTOGRAM, resolution=resolution)
+
+        for i, scan in enumerate(scans):
+            expected = np.median(scans[max(0, i - WINDOW):i + 1], axis=0)
+            assert np.all(np.abs(med_filter.update(scan) - expected) <= resolution / 2 + 1e-12)
+
+    def test_histogram_large_window(self):
+        """ Tests the histogram filter with a window of thousands of scans, on values that lie exactly on bin centers. """
+        WINDOW = 3000
+        SCAN_SIZE = 4
+        RESOLUTION = 0.01
+        rng = np.random.RandomState(7)
+        bins = rng.randint(0, 4997, size=(4000, SCAN_SIZE))
+        scans = TemporalMedianFilter.MIN_RANGE + (bins + 0.5) * RESOLUTION
+
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_HISTOGRAM, resolution=RESOLUTION)
+
+        for i, scan in enumerate(scans):
+            result = med_filter.update(scan)
+            if i % 500 == 0 or i == len(scans) - 1:
+                np.testing.assert_array_almost_equal(result, np.median(scans[max(0, i - WINDOW):i + 1], axis=0))
+
+    def test_histogram_invalid_resolution(self):
+        """ Tests creating a histogram filter with a non-positive resolution. """
+        with pytest.raises(ValueError):
+            TemporalMedianFilter(3, 5, f_type=TemporalMedianFilter.TYPE_HISTOGRAM, resolution=0)
+
+    @pytest.mark.parametrize("f_type", sorted(TemporalMedianFilter.TYPES - TemporalMedianFilter.APPROXIMATE_TYPES))
+    def test_history_wraparound(self, f_type):
+        """
+        Tests a long random data stream against a brute-force median of the most recent scans.
+
+        The stream is many times longer than the window, so the history buffer wraps around repeatedly.
+        """
+        WINDOW = 4
+        SCAN_SIZE = 7
+        rng = np.random.RandomState(0)
+        scans = rng.uniform(0.03, 50, size=(40, SCAN_SIZE))
+
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)
+
+        for i, scan in enumerate(scans):
+            expected = np.median(scans[max(0, i - WINDOW):i + 1], axis=0)
+            np.testing.assert_array_almost_equal(med_filter.update(scan), expected)
+
+    @pytest.mark.parametrize("f_type", sorted(TemporalMedianFilter.TYPES))
+    def test_update_batch(self, f_type):
+        """
+        Tests that filtering blocks of scans with update_batch() is identical to calling update() on each scan.
+
+        The blocks straddle the point where the history fills up, and are interleaved with single updates, to check that the filter state is left ready for the next scan.
+        """
+        WINDOW = 5
+        SCAN_SIZE = 6
+        rng = np.random.RandomState(3)
+        scans = rng.uniform(0.03, 50, size=(50, SCAN_SIZE))
+
+        seq_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)
+        batch_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)
+
+        expected = np.array([seq_filter.update(scan) for scan in scans])
+        result = np.concatenate([
+            batch_filter.update_batch(scans[:3]),
+            batch_filter.update_batch(scans[3:20]),
+            np.array([batch_filter.update(scan) for scan in scans[20:23]]),
+            batch_filter.update_batch(scans[23:])
+        ])
+
+        np.testing.assert_array_equal(result, expected)
+
+    @pytest.mark.parametrize("f_type", sorted(TemporalMedianFilter.TYPES - TemporalMedianFilter.APPROXIMATE_TYPES))
+    def test_update_out(self, f_type):
+        """ Tests that update() writes its result into a caller-owned array when given one, with the same result as numpy.median. """
+        WINDOW = 6
+        SCAN_SIZE = 5
+        rng = np.random.RandomState(5)
+        scans = rng.uniform(0.03, 50, size=(20, SCAN_SIZE))
+
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)
+        out = np.empty(SCAN_SIZE)
+
+        for i, scan in enumerate(scans):
+            result = med_filter.update(scan, out=out)
+            assert result is out
+            np.testing.assert_array_equal(out, np.median(scans[max(0, i - WINDOW):i + 1], axis=0))
+
+        with pytest.raises(ValueError):
+            med_filter.update(scans[0], out=np.empty(SCAN_SIZE + 1))
+
+    @pytest.mark.parametrize("f_type", sorted(TemporalMedianFilter.VECTORIZED_TYPES))
+    def test_threaded_tiles(self, f_type):
+        """ Tests that splitting the columns into tiles processed by a thread pool gives exactly the same results as a single thread. """
+        WINDOW = 7
+        SCAN_SIZE = 50
+        rng = np.random.RandomState(9)
+        scans = rng.uniform(0.03, 50, size=(30, SCAN_SIZE))
+
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)
+        threaded_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type, n_threads=3)
+        assert len(threaded_filter.tiles) >= 3
+
+        for scan in scans:
+            np.testing.assert_array_equal(threaded_filter.update(scan), med_filter.update(scan))
+
+        threaded_filter.close()
+        assert threaded_filter.pool is None
+        np.testing.assert_array_equal(threaded_filter.update(scans[0]), med_filter.update(scans[0]))
+
+        with pytest.raises(ValueError):
+            TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type, n_threads=0)
+
+    @pytest.mark.parametrize("dtype", ["float64", "float32", "uint16"])
+    def test_tile_size(self, dtype):
+        """ Tests that each tile holds about TILE_SIZE bytes of window data, whatever the dtype. """
+        med_filter = TemporalMedianFilter(511, 4096, f_type=TemporalMedianFilter.TYPE_NUMPY, n_threads=2, dtype=dtype)
+        assert len(med_filter.tiles) == 4096 * 512 * np.dtype(dtype).itemsize // TemporalMedianFilter.TILE_SIZE
+        med_filter.close()
+
+    def test_auto_type(self, tmp_path, monkeypatch):
+        """ Tests that TYPE_AUTO calibrates once for a given set of specs, caches its choice in the profile, and reuses it afterwards. """
+        profile_path = str(tmp_path / "profile.json")
+
+        med_filter = TemporalMedianFilter(3, 5, f_type=TemporalMedianFilter.TYPE_AUTO, profile_path=profile_path)
+        assert med_filter.type in TemporalMedianFilter.TYPES - TemporalMedianFilter.APPROXIMATE_TYPES
+
+        with open(profile_path) as profile_file:
+            profile = json.load(profile_file)
+        entry = profile["window=3,scan_size=5,n_threads=1,dtype=float64,drop_invalid=False"]
+        assert entry["type"] == med_filter.type
+        assert set(entry["times"]) == TemporalMedianFilter.TYPES - TemporalMedianFilter.APPROXIMATE_TYPES
+
+        # A cached choice must not be recalibrated; new specs, including a new dtype or drop_invalid, must be, with those specs.
+        calibrations = []
+        def calibrate(window, scan_size, n_threads=None, dtype=np.float64, drop_invalid=False):
+            calibrations.append((window, scan_size, np.dtype(dtype), drop_invalid))
+            return { TemporalMedianFilter.TYPE_SORTED:1.0, TemporalMedianFilter.TYPE_HEAP:2.0 }
+        monkeypatch.setattr(TemporalMedianFilter, "calibrate", staticmethod(calibrate))
+
+        assert TemporalMedianFilter(3, 5, f_type=TemporalMedianFilter.TYPE_AUTO, profile_path=profile_path).type == med_filter.type
+        assert TemporalMedianFilter(4, 5, f_type=TemporalMedianFilter.TYPE_AUTO, profile_path=profile_path).type == TemporalMedianFilter.TYPE_SORTED
+        TemporalMedianFilter(3, 5, f_type=TemporalMedianFilter.TYPE_AUTO, profile_path=profile_path, dtype=np.float32)
+        TemporalMedianFilter(3, 5, f_type=TemporalMedianFilter.TYPE_AUTO, profile_path=profile_path, drop_invalid=True)
+        assert calibrations == [(4, 5, np.float64, False), (3, 5, np.float32, False), (3, 5, np.float64, True)]
+
+        with open(profile_path) as profile_file:
+            profile = json.load(profile_file)
+        assert len(profile) == 4
+        assert "window=3,scan_size=5,n_threads=1,dtype=float32,drop_invalid=False" in profile
+        assert "window=3,scan_size=5,n_threads=1,dtype=float64,drop_invalid=True" in profile
+
+    def test_calibrate_specs(self):
+        """ Tests that calibrate() times every exact type with the given dtype and drop_invalid. """
+        times = TemporalMedianFilter.calibrate(3, 5, dtype=np.uint16, drop_invalid=True)
+        assert set(times) == TemporalMedianFilter.TYPES - TemporalMedianFilter.APPROXIMATE_TYPES
+
+    def test_auto_type_corrupt_profile(self, tmp_path):
+        """ Tests that TYPE_AUTO recalibrates, and rewrites the profile, if the profile cannot be read. """
+        profile_path = tmp_path / "profile.json"
+        profile_path.write_text("not json")
+
+        med_filter = TemporalMedianFilter(2, 3, f_type=TemporalMedianFilter.TYPE_AUTO, profile_path=str(profile_path))
+
+        assert json.loads(profile_path.read_text())["window=2,scan_size=3,n_threads=1,dtype=float64,drop_invalid=False"]["type"] == med_filter.type
+
+    def test_latency_stats(self):
+        """ Tests that update() latencies are only recorded while instrumentation is enabled. """
+        med_filter = TemporalMedianFilter(3, 5, f_type=TemporalMedianFilter.TYPE_NUMPY)
+        scan = np.arange(5.0)
+
+        med_filter.update(scan)
+        assert med_filter.latency_stats() is None
+
+        med_filter.enable_latency(deadline=1e-12)
+        for i in range(10):
+            med_filter.update(scan)
+
+        stats = med_filter.latency_stats()
+        assert stats["count"] == 10
+        assert stats["over_deadline"] == 10
+        assert 0 < stats["p50"] <= stats["p99"] <= stats["p99.9"] <= stats["max"]
+
+        med_filter.disable_latency()
+        med_filter.update(scan)
+        assert med_filter.latency_stats() is None
+
+    @pytest.mark.parametrize("f_type", [TemporalMedianFilter.TYPE_NUMPY, TemporalMedianFilter.TYPE_HEAP])
+    def test_latency_stats_batch(self, f_type):
+        """ Tests that every scan filtered by update_batch() is recorded, including on the vectorized TYPE_NUMPY path. """
+        med_filter = TemporalMedianFilter(3, 5, f_type=f_type)
+        med_filter.enable_latency()
+        med_filter.update_batch(np.random.RandomState(0).uniform(size=(12, 5)))
+        med_filter.update_batch(np.empty((0, 5)))
+
+        stats = med_filter.latency_stats()
+        assert stats["count"] == 12
+        assert 0 < stats["mean"] <= stats["max"]
+
+    @pytest.mark.parametrize("f_type", sorted(TemporalMedianFilter.TYPES))
+    def test_stats(self, f_type):
+        """ Tests that stats() reports the history buffer, and sums the live elements of every column's structure for the per-column types. """
+        WINDOW = 4
+        SCAN_SIZE = 6
+        rng = np.random.RandomState(11)
+
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)
+        med_filter.update_batch(rng.uniform(0.03, 50, size=(20, SCAN_SIZE)))
+
+        stats = med_filter.stats()
+        assert stats["type"] == f_type
+        assert stats["count"] == WINDOW + 1
+        assert stats["scan_bytes"] == (0 if f_type in TemporalMedianFilter.SKETCH_TYPES else (WINDOW + 1) * SCAN_SIZE * 8)
+
+        if f_type in TemporalMedianFilter.HEAP_TYPES:
+            assert stats["heaps"]["live"] == (WINDOW + 1) * SCAN_SIZE
+        else:
+            assert stats["heaps"] is None
+
+    def test_heap_array_ignores_threads(self):
+        """ Tests that TYPE_HEAP_ARRAY, whose updates hold the GIL, is never split into tiles for a thread pool. """
+        med_filter = TemporalMedianFilter(500, 1000, f_type=TemporalMedianFilter.TYPE_HEAP_ARRAY, n_threads=4)
+        assert med_filter.pool is None
+        assert med_filter.tiles == [(0, 1000)]
+
+    @pytest.mark.parametrize("window", [1, 2, 5, 16])
+    def test_heap_array_duplicates(self, window):
+        """ Tests TYPE_HEAP_ARRAY against TYPE_NUMPY on data with many duplicate values, while the window fills and after it wraps, checking that every history value's recorded node really holds it. """
+        SCAN_SIZE = 40
+        rng = np.random.RandomState(15)
+        scans = rng.randint(0, 4, size=(60, SCAN_SIZE)).astype(float)
+
+        reference = TemporalMedianFilter(window, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_NUMPY)
+        med_filter = TemporalMedianFilter(window, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_HEAP_ARRAY)
+        for scan in scans:
+            np.testing.assert_array_equal(med_filter.update(scan), reference.update(scan))
+
+            rows = np.arange(med_filter.count)[:, None]
+            cols = med_filter.cols
+            nodes = med_filter.heap_vals[med_filter.heap_side[rows, cols], med_filter.heap_pos[rows, cols], cols]
+            np.testing.assert_array_equal(nodes, med_filter.scans[:med_filter.count])
+            assert np.all(med_filter.heap_sizes.sum(axis=0) == med_filter.count)
+
+    @pytest.mark.parametrize("f_type", sorted(TemporalMedianFilter.TYPES))
+    def test_stream(self, f_type):
+        """ Tests that streaming scans, from an iterator or a 2D array, gives the same results as calling update() on each scan. """
+        WINDOW = 5
+        SCAN_SIZE = 8
+        rng = np.random.RandomState(5)
+        scans = rng.uniform(0.03, 50, size=(50, SCAN_SIZE))
+
+        seq_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)
+        expected = np.array([seq_filter.update(scan) for scan in scans])
+
+        iter_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)
+        results = list(iter_filter.stream((list(scan) for scan in scans), batch_size=7, copy=True))
+        np.testing.assert_array_equal(np.array(results), expected)
+
+        array_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)
+        results = [row.copy() for row in array_filter.stream(scans, batch_size=16)]
+        np.testing.assert_array_equal(np.array(results), expected)
+
+    def test_stream_is_lazy(self):
+        """ Tests that stream() only reads its source one batch ahead, so it can filter an endless source. """
+        BATCH_SIZE = 4
+        pulled = []
+
+        def source():
+            while (True):
+                pulled.append(None)
+                yield np.ones(3)
+
+        stream = TemporalMedianFilter(3, 3).stream(source(), batch_size=BATCH_SIZE)
+        for i in range(5):
+            np.testing.assert_array_equal(next(stream), np.ones(3))
+
+        assert len(pulled) == 2 * BATCH_SIZE
+
+    def test_stream_copy(self):
+        """ Tests that results are views into a reused buffer, unless copy is set. """
+        scans = np.arange(12, dtype=float).reshape(4, 3)
+
+        shared = list(TemporalMedianFilter(1, 3).stream(iter(scans), batch_size=2))
+        assert shared[0] is not shared[2] and np.shares_memory(shared[0], shared[2])
+
+        copied = list(TemporalMedianFilter(1, 3).stream(iter(scans), batch_size=2, copy=True))
+        assert not np.shares_memory(copied[0], copied[2])
+
+    def test_stream_invalid(self):
+        """ Tests streaming scans that are a different size than scan_size, or with an invalid batch_size. """
+        with pytest.raises(ValueError):
+            list(TemporalMedianFilter(3, 10).stream(iter([np.zeros(9)])))
+
+        with pytest.raises(ValueError):
+            list(TemporalMedianFilter(3, 10).stream(np.zeros((4, 9))))
+
+        with pytest.raises(ValueError):
+            list(TemporalMedianFilter(3, 10).stream(iter([np.zeros(10), np.zeros(9)])))
+
+        with pytest.raises(ValueError):
+            list(TemporalMedianFilter(3, 10).stream([], batch_size=0))
+
+    @pytest.mark.parametrize("dtype", ["float32", "uint16"])
+    @pytest.mark.parametrize("f_type", sorted(TemporalMedianFilter.TYPES - TemporalMedianFilter.APPROXIMATE_TYPES))
+    def test_compact_dtype(self, f_type, dtype):
+        """ Tests that every exact type stores its history as the given dtype, agrees exactly with TYPE_NUMPY, and stays within the storage precision of a float64 filter. """
+        WINDOW = 6
+        SCAN_SIZE = 12
+        rng = np.random.RandomState(6)
+        scans = rng.uniform(0.03, 50, size=(40, SCAN_SIZE))
+
+        reference = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_NUMPY, dtype=dtype).update_batch(scans)
+        exact = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_NUMPY).update_batch(scans)
+
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type, dtype=dtype)
+        results = np.array([med_filter.update(scan) for scan in scans[:25]] + list(med_filter.update_batch(scans[25:])))
+
+        assert med_filter.scans.dtype == np.dtype(dtype)
+        assert results.dtype == np.float64
+        np.testing.assert_array_equal(results, reference)
+        tolerance = TemporalMedianFilter.UINT16_SCALE / 2 if dtype == "uint16" else 50 * np.finfo(np.float32).eps
+        assert np.max(np.abs(results - exact)) <= tolerance + 1e-12
+
+    def test_uint16_scale(self):
+        """ Tests a custom uint16 scale, and that values beyond the uint16 range are clipped. """
+        med_filter = TemporalMedianFilter(1, 3, f_type=TemporalMedianFilter.TYPE_NUMPY, dtype=np.uint16, scale=0.01)
+
+        np.testing.assert_array_almost_equal(med_filter.update(np.array([1.234, -5.0, 1000.0])), [1.23, 0.0, 655.35])
+        assert med_filter.stats()["scan_bytes"] == 2 * 3 * 2
+
+    @pytest.mark.parametrize("f_type", sorted(TemporalMedianFilter.TYPES))
+    def test_uint16_nan(self, f_type):
+        """ Tests that a uint16 filter rejects NaN without drop_invalid, leaving the filter unchanged, and leaves it out of the window with drop_invalid. """
+        med_filter = TemporalMedianFilter(2, 3, f_type=f_type, dtype=np.uint16)
+        reference = TemporalMedianFilter(2, 3, f_type=f_type, dtype=np.uint16)
+        scans = np.array([[1.0, 2.0, 3.0], [2.0, 3.0, 4.0], [3.0, 4.0, 5.0]])
+        for scan in scans[:2]:
+            med_filter.update(scan)
+            reference.update(scan)
+
+        with pytest.raises(ValueError):
+            med_filter.update(np.array([1.0, np.nan, 3.0]))
+        with pytest.raises(ValueError):
+            med_filter.update_batch(np.array([[1.0, np.nan, 3.0]]))
+        np.testing.assert_array_equal(med_filter.update(scans[2]), reference.update(scans[2]))
+
+        # TYPE_DECAYED counts valid samples with decayed weights, so a single older sample falls below min_valid.
+        if (f_type in TemporalMedianFilter.SKETCH_TYPES):
+            return
+        dropping = TemporalMedianFilter(2, 3, f_type=f_type, dtype=np.uint16, drop_invalid=True)
+        dropping.update(scans[0])
+        np.testing.assert_allclose(dropping.update(np.array([np.nan, np.nan, np.nan])), scans[0], atol=TemporalMedianFilter.UINT16_SCALE + 0.005)
+
+    def test_dtype_invalid(self):
+        """ Tests creating a filter with an unsupported dtype, or with an invalid or misplaced scale. """
+        with pytest.raises(ValueError):
+            TemporalMedianFilter(3, 10, dtype=np.int32)
+
+        with pytest.raises(ValueError):
+            TemporalMedianFilter(3, 10, dtype=np.uint16, scale=0)
+
+        with pytest.raises(ValueError):
+            TemporalMedianFilter(3, 10, dtype=np.float32, scale=0.001)
+
+    @pytest.mark.parametrize("scans_before", [3, 30])
+    @pytest.mark.parametrize("f_type", sorted(TemporalMedianFilter.TYPES - TemporalMedianFilter.SKETCH_TYPES))
+    def test_save_load(self, tmp_path, f_type, scans_before):
+        """ Tests that a filter loaded from a snapshot, with a partial or full window, continues exactly as the original filter would have. """
+        WINDOW = 6
+        SCAN_SIZE = 10
+        rng = np.random.RandomState(14)
+        scans = rng.uniform(0.03, 50, size=(45, SCAN_SIZE))
+
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type, dtype=np.uint16)
+        for scan in scans[:scans_before]:
+            med_filter.update(scan)
+        med_filter.save(str(tmp_path / "snapshot.npz"))
+        expected = np.array([med_filter.update(scan) for scan in scans[scans_before:]])
+
+        loaded = TemporalMedianFilter.load(str(tmp_path / "snapshot.npz"))
+        assert (loaded.type, loaded.window, loaded.dtype, loaded.count) == (f_type, WINDOW, np.uint16, min(scans_before, WINDOW + 1))
+
+        np.testing.assert_array_equal(np.array([loaded.update(scan) for scan in scans[scans_before:]]), expected)
+
+    @pytest.mark.parametrize("f_type", sorted(TemporalMedianFilter.TYPES - TemporalMedianFilter.SKETCH_TYPES))
+    def test_save_load_nan(self, tmp_path, f_type):
+        """ Tests that a filter loaded with a NaN in its history reports NaN only until that NaN expires, as the original filter does. """
+        med_filter = TemporalMedianFilter(2, 2, f_type=f_type)
+        for scan in ([1.0, np.nan], [2.0, 2.0]):
+            med_filter.update(scan)
+        med_filter.save(str(tmp_path / "snapshot.npz"))
+        loaded = TemporalMedianFilter.load(str(tmp_path / "snapshot.npz"))
+
+        for i in range(4):
+            expected = med_filter.update([3.0, 3.0])
+            np.testing.assert_array_equal(loaded.update([3.0, 3.0]), expected)
+        assert not np.isnan(expected).any()
+
+    def test_decayed_bounds(self):
+        """ Tests that TYPE_DECAYED tracks a steady value to within half a bin, and follows a step change once the new value holds over half the weight. """
+        WINDOW = 200
+        SCAN_SIZE = 30
+        RESOLUTION = 0.01
+        rng = np.random.RandomState(16)
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_DECAYED, resolution=RESOLUTION)
+
+        before = rng.uniform(1, 2, size=SCAN_SIZE)
+        for i in range(3 * WINDOW):
+            result = med_filter.update(before)
+        assert np.all(np.abs(result - before) <= RESOLUTION / 2 + 1e-9)
+
+        # The new values, within [20, 30], carry over half the weight once k > ln(2) * (WINDOW + 1) scans.
+        steps = int(np.ceil(np.log(2) * (WINDOW + 1))) + 1
+        for i in range(steps):
+            result = med_filter.update(rng.uniform(20, 30, size=SCAN_SIZE))
+        assert np.all(result >= 20 - RESOLUTION / 2) and np.all(result <= 30 + RESOLUTION / 2)
+
+    def test_decayed_constant_memory(self):
+        """ Tests that TYPE_DECAYED keeps no history, so its memory doesn't depend on the window, and that it renormalizes its weights over a long stream. """
+        SCAN_SIZE = 8
+        short = TemporalMedianFilter(10, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_DECAYED)
+        long = TemporalMedianFilter(10 ** 6, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_DECAYED)
+        assert short.stats()["scan_bytes"] == long.stats()["scan_bytes"] == 0
+        assert short.stats()["engine_bytes"] == long.stats()["engine_bytes"]
+
+        # With a window of 10, the weight increment passes DECAYED_RENORMALIZE after ~2500 scans.
+        scans = np.full((5000, SCAN_SIZE), 7.0)
+        results = short.update_batch(scans)
+        assert short.gain < TemporalMedianFilter.DECAYED_RENORMALIZE
+        assert np.all(np.isfinite(short.hist))
+        np.testing.assert_allclose(results, 7.0, atol=0.005 + 1e-9)
+
+        with pytest.raises(ValueError):
+            short.history()
+        with pytest.raises(ValueError):
+            short.restore(scans[:2])
+
+    @pytest.mark.parametrize("f_type", [TemporalMedianFilter.TYPE_NUMPY, TemporalMedianFilter.TYPE_SORTED, TemporalMedianFilter.TYPE_HEAP, TemporalMedianFilter.TYPE_INDEXED_HEAP, TemporalMedianFilter.TYPE_SORTED_WINDOW, TemporalMedianFilter.TYPE_HEAP_ARRAY])
+    def test_nan_propagates(self, f_type):
+        """ Tests that without drop_invalid, a NaN neither corrupts nor crashes an engine: its column reports NaN while the NaN is in the window, as numpy.median does, and is exact again once it expires. """
+        WINDOW = 10
+        SCAN_SIZE = 50
+        rng = np.random.RandomState(19)
+        scans = rng.uniform(0.03, 50, size=(80, SCAN_SIZE))
+        scans[rng.rand(*scans.shape) < 0.1] = np.nan
+        # Leave the last window free of NaN.
+        scans[-WINDOW - 1:] = rng.uniform(0.03, 50, size=(WINDOW + 1, SCAN_SIZE))
+        expected = np.array([np.median(scans[max(0, k - WINDOW):k + 1], axis=0) for k in range(len(scans))])
+
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)
+        np.testing.assert_array_equal(np.array([med_filter.update(scan) for scan in scans[:40]]), expected[:40])
+
+        restored = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)
+        restored.restore(med_filter.history())
+        np.testing.assert_array_equal(restored.update_batch(scans[40:]), expected[40:])
+        assert not np.isnan(expected[-1]).any()
+
+    def test_histogram_nan(self):
+        """ Tests that without drop_invalid, TYPE_HISTOGRAM reports NaN for a column while its window holds a NaN, and is accurate again once it expires. """
+        WINDOW = 4
+        scans = np.full((12, 3), 7.0)
+        scans[2, 1] = np.nan
+        med_filter = TemporalMedianFilter(WINDOW, 3, f_type=TemporalMedianFilter.TYPE_HISTOGRAM)
+        result = med_filter.update_batch(scans)
+
+        assert np.all(np.isnan(result[2:2 + WINDOW + 1, 1]))
+        np.testing.assert_allclose(result[2 + WINDOW + 1:], 7.0, atol=0.005 + 1e-9)
+        np.testing.assert_allclose(result[:, [0, 2]], 7.0, atol=0.005 + 1e-9)
+
+    def test_decayed_nan(self):
+        """ Tests that without drop_invalid, TYPE_DECAYED gives NaN no weight, and reports NaN for a column for as long as an exact type's window would hold the NaN. """
+        WINDOW = 4
+        scans = np.full((20, 3), 7.0)
+        scans[2, 1] = np.nan
+        scans[5:15, 2] = np.nan
+        med_filter = TemporalMedianFilter(WINDOW, 3, f_type=TemporalMedianFilter.TYPE_DECAYED)
+        result = med_filter.update_batch(scans)
+
+        assert np.all(np.isnan(result[2:2 + WINDOW + 1, 1]))
+        assert np.all(np.isnan(result[5:15 + WINDOW, 2]))
+        # The NaNs never dragged the median towards MIN_RANGE.
+        np.testing.assert_allclose(result[2 + WINDOW + 1:, 1], 7.0, atol=0.005 + 1e-9)
+        np.testing.assert_allclose(result[15 + WINDOW:, 2], 7.0, atol=0.005 + 1e-9)
+        np.testing.assert_allclose(result[:, 0], 7.0, atol=0.005 + 1e-9)
+
+    def dropout_scans(self, rng, count, scan_size):
+        """ Returns random scans with many duplicate values, and dropouts of every kind (NaN, 0, inf and negative values); the first column is always a dropout. """
+        scans = rng.randint(1, 6, size=(count, scan_size)).astype(float)
+        r = rng.rand(count, scan_size)
+        scans[r < 0.15] = np.nan
+        scans[(r >= 0.15) & (r < 0.25)] = 0
+        scans[(r >= 0.25) & (r < 0.3)] = np.inf
+        scans[(r >= 0.3) & (r < 0.33)] = -1
+        scans[:, 0] = np.nan
+        return scans
+
+    def valid_medians(self, scans, window, min_valid):
+        """ Returns the median of the valid values of every column's window after each scan, via numpy.nanmedian; NaN where fewer than 'min_valid' are valid. """
+        medians = []
+        for k in range(len(scans)):
+            values = scans[max(0, k - window):k + 1]
+            values = np.where((values > 0) & (values < np.inf), values, np.nan)
+            valid = np.count_nonzero(~np.isnan(values), axis=0)
+            median = np.full(scans.shape[1], np.nan)
+            median[valid > 0] = np.nanmedian(values[:, valid > 0], axis=0)
+            median[valid < min_valid] = np.nan
+            medians.append(median)
+        return np.array(medians)
+
+    @pytest.mark.parametrize("min_valid", [1, 2])
+    @pytest.mark.parametrize("window", [1, 4, 5])
+    @pytest.mark.parametrize("f_type", sorted(TemporalMedianFilter.TYPES - TemporalMedianFilter.SKETCH_TYPES))
+    def test_drop_invalid(self, f_type, window, min_valid):
+        """ Tests that with drop_invalid, every engine takes its medians over the valid values of each column's window only, and reports NaN for columns with fewer than min_valid of them. """
+        SCAN_SIZE = 25
+        RESOLUTION = 0.001
+        rng = np.random.RandomState(17)
+        scans = self.dropout_scans(rng, 60, SCAN_SIZE)
+        expected = self.valid_medians(scans, window, min_valid)
+
+        med_filter = TemporalMedianFilter(window, SCAN_SIZE, f_type=f_type, resolution=RESOLUTION, drop_invalid=True, min_valid=min_valid)
+        result = np.array([med_filter.update(scan) for scan in scans])
+        tolerance = RESOLUTION / 2 if f_type in TemporalMedianFilter.APPROXIMATE_TYPES else 0
+        np.testing.assert_allclose(result, expected, atol=tolerance + 1e-12)
+        assert np.all(np.isnan(result[:, 0]))
+
+        # A restored filter carries on with the same valid counts.
+        restored = TemporalMedianFilter(window, SCAN_SIZE, f_type=f_type, resolution=RESOLUTION, drop_invalid=True, min_valid=min_valid)
+        restored.restore(med_filter.history())
+        more = self.dropout_scans(rng, 20, SCAN_SIZE)
+        np.testing.assert_array_equal(restored.update_batch(more), med_filter.update_batch(more))
+
+    @pytest.mark.parametrize("dtype", ["float32", "uint16"])
+    def test_drop_invalid_dtype(self, dtype):
+        """ Tests that dropouts, including NaN and inf, are dropped the same way from windows stored as float32 or uint16. """
+        WINDOW = 6
+        SCAN_SIZE = 30
+        rng = np.random.RandomState(18)
+        scans = self.dropout_scans(rng, 50, SCAN_SIZE)
+
+        expected = self.valid_medians(scans, WINDOW, 2)
+        for f_type in sorted(TemporalMedianFilter.TYPES - TemporalMedianFilter.APPROXIMATE_TYPES):
+            med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type, dtype=dtype, drop_invalid=True, min_valid=2)
+            np.testing.assert_array_equal(med_filter.update_batch(scans), expected)
+
+    def test_drop_invalid_decayed(self):
+        """ Tests that TYPE_DECAYED gives dropouts no weight, and reports NaN until a column's decayed number of valid samples reaches min_valid. """
+        WINDOW = 20
+        SCAN_SIZE = 10
+        scans = np.full((200, SCAN_SIZE), 5.0)
+        scans[::2] = np.nan
+        scans[:, 0] = 0
+
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_DECAYED, drop_invalid=True, min_valid=3)
+        result = med_filter.update_batch(scans)
+        assert np.all(np.isnan(result[:5]))
+        assert np.all(np.isnan(result[:, 0]))
+        np.testing.assert_allclose(result[-1, 1:], 5.0, atol=0.005 + 1e-9)
+
+    def test_drop_invalid_specs(self, tmp_path):
+        """ Tests that min_valid must be within [1, window + 1], and only applies with drop_invalid, and that a snapshot keeps both. """
+        with pytest.raises(ValueError):
+            TemporalMedianFilter(3, 10, drop_invalid=True, min_valid=0)
+
+        with pytest.raises(ValueError):
+            TemporalMedianFilter(3, 10, drop_invalid=True, min_valid=5)
+
+        with pytest.raises(ValueError):
+            TemporalMedianFilter(3, 10, min_valid=2)
+
+        med_filter = TemporalMedianFilter(3, 10, f_type=TemporalMedianFilter.TYPE_SORTED, drop_invalid=True, min_valid=2)
+        med_filter.update(np.full(10, np.nan))
+        med_filter.save(str(tmp_path / "snapshot.npz"))
+        loaded = TemporalMedianFilter.load(str(tmp_path / "snapshot.npz"))
+        assert (loaded.drop_invalid, loaded.min_valid) == (True, 2)
+        np.testing.assert_array_equal(loaded.valid, np.zeros(10))
+
+    def test_restore_invalid(self):
+        """ Tests restoring a history with the wrong scan size, or more scans than the filter holds. """
+        med_filter = TemporalMedianFilter(3, 10)
+
+        with pytest.raises(ValueError):
+            med_filter.restore(np.zeros((2, 9)))
+
+        with pytest.raises(ValueError):
+            med_filter.restore(np.zeros((5, 10)))
+
+    def test_update_many(self):
+        """ Tests that update_many() gives the same results as updating each filter in turn, for a mix of types, dtypes and fill levels, including NaN. """
+        SCAN_SIZE = 8
+        rng = np.random.RandomState(20)
+        specs = [
+            (3, TemporalMedianFilter.TYPE_NUMPY, np.float64), (3, TemporalMedianFilter.TYPE_NUMPY, np.float64),
+            (4, TemporalMedianFilter.TYPE_NUMPY, np.uint16), (3, TemporalMedianFilter.TYPE_SORTED, np.float64),
+            (30, TemporalMedianFilter.TYPE_NUMPY, np.float32)
+        ]
+        filters = [TemporalMedianFilter(window, SCAN_SIZE, f_type=f_type, dtype=dtype) for window, f_type, dtype in specs]
+        references = [TemporalMedianFilter(window, SCAN_SIZE, f_type=f_type, dtype=dtype) for window, f_type, dtype in specs]
+
+        for k in range(12):
+            scans = rng.uniform(0.03, 50, size=(len(filters), SCAN_SIZE))
+            scans[rng.rand(*scans.shape) < 0.05] = np.nan
+            # uint16 has no NaN.
+            scans[2] = rng.uniform(0.03, 50, size=SCAN_SIZE)
+            expected = np.array([ref.update(scan) for ref, scan in zip(references, scans)])
+            np.testing.assert_array_equal(TemporalMedianFilter.update_many(filters, scans), expected)
+
+        with pytest.raises(ValueError):
+            TemporalMedianFilter.update_many(filters[:2], scans)
+
+    def test_update_batch_invalid_shape(self):
+        """ Tests calling update_batch on scans that are a different size than scan_size. """
+        med_filter = TemporalMedianFilter(3, 10, f_type=TemporalMedianFilter.TYPE_NUMPY)
+
+        with pytest.raises(ValueError):
+            med_filter.update_batch(np.zeros((4, 9)))
+
+        with pytest.raises(ValueError):
+            med_filter.update_batch(np.zeros(10))
+
+
+class TestTemporalMedianFilterBank:
+    """ Correctness tests for TemporalMedianFilterBank, a vectorized bank of filters over independent streams. """
+
+    @pytest.mark.parametrize("window", [1, 4, 5])
+    def test_bank_matches_filters(self, window):
+        """ Tests that a bank gives the same results as one TemporalMedianFilter per stream. """
+        STREAMS = 3
+        SCAN_SIZE = 7
+        rng = np.random.RandomState(9)
+        frames = rng.uniform(0.03, 50, size=(20, STREAMS, SCAN_SIZE))
+
+        filters = [TemporalMedianFilter(window, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_NUMPY) for i in range(STREAMS)]
+        expected = np.array([[med_filter.update(scan) for med_filter, scan in zip(filters, frame)] for frame in frames])
+
+        bank = TemporalMedianFilterBank(STREAMS, window, SCAN_SIZE)
+        out = np.empty((STREAMS, SCAN_SIZE))
+        results = [bank.update(frame).copy() for frame in frames[:8]]
+        results += [bank.update(frame, out=out).copy() for frame in frames[8:12]]
+        results += list(bank.update_batch(frames[12:]))
+
+        np.testing.assert_array_equal(np.array(results), expected)
+
+    def test_bank_nan(self):
+        """ Tests that a NaN makes its stream's column NaN, as numpy.median does, for as long as it is in the window. """
+        bank = TemporalMedianFilterBank(2, 2, 3)
+        frames = np.array([[[1.0, np.nan, 5.0], [1.0, 2.0, 3.0]]] + [[[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]] * 3)
+        results = bank.update_batch(frames)
+
+        expected = np.array([[np.median(frames[max(0, k - 2):k + 1, i], axis=0) for i in range(2)] for k in range(len(frames))])
+        np.testing.assert_array_equal(results, expected)
+        assert np.isnan(results[2, 0, 1]) and not np.isnan(results[3, 0, 1])
+
+    def test_bank_invalid(self):
+        """ Tests invalid specs, and updating with frames of the wrong shape. """
+        with pytest.raises(ValueError):
+            TemporalMedianFilterBank(0, 3, 4)
+
+        with pytest.raises(ValueError):
+            TemporalMedianFilterBank(2, 0, 4)
+
+        bank = TemporalMedianFilterBank(2, 3, 4)
+        with pytest.raises(ValueError):
+            bank.update(np.zeros((3, 4)))
+
+        with pytest.raises(ValueError):
+            bank.update(np.zeros((2, 4)), out=np.empty(4))
+
+        with pytest.raises(ValueError):
+            bank.update_batch(np.zeros((2, 4)))
+
+
+class TestFilterChain:
+    """ Correctness tests for FilterChain, a fused pipeline of filters. """
+
+    @pytest.mark.parametrize("f_type", sorted(TemporalMedianFilter.TYPES))
+    def test_chain_matches_separate_filters(self, f_type):
+        """ Tests that a chain gives the same results as running its filters one after the other, through update(), update(out=...) and update_batch(). """
+        WINDOW = 4
+        SCAN_SIZE = 12
+        rng = np.random.RandomState(3)
+        scans = rng.uniform(0.0, 60.0, size=(40, SCAN_SIZE))
+
+        range_filter = RangeFilter(minimum=5.0, maximum=45.0)
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)
+        expected = np.array([med_filter.update(range_filter.update(scan)) for scan in scans])
+
+        chain = FilterChain([RangeFilter(minimum=5.0, maximum=45.0), TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)])
+        out = np.empty(SCAN_SIZE)
+        results = [chain.update(scan) for scan in scans[:15]]
+        results += list(chain.update_batch(scans[15:30]))
+        results += [chain.update(scan, out=out).copy() for scan in scans[30:]]
+
+        np.testing.assert_array_equal(np.array(results), expected)
+
+    def test_chain_does_not_modify_input(self):
+        """ Tests that clipping in place never touches the caller's scan. """
+        scan = np.array([1.0, 50.0, 20.0])
+        original = scan.copy()
+        chain = FilterChain([RangeFilter(minimum=5.0, maximum=45.0), TemporalMedianFilter(2, 3)])
+
+        chain.update(scan)
+        chain.update_batch(np.array([scan, scan]))
+
+        np.testing.assert_array_equal(scan, original)
+
+    def test_chain_invalid(self):
+        """ Tests building a chain with no filters, or with mismatched scan sizes, and updating it with the wrong scan size. """
+        with pytest.raises(ValueError):
+            FilterChain([])
+
+        with pytest.raises(ValueError):
+            FilterChain([TemporalMedianFilter(2, 3), TemporalMedianFilter(2, 4)])
+
+        chain = FilterChain([RangeFilter(maximum=10), TemporalMedianFilter(2, 3)])
+        with pytest.raises(ValueError):
+            chain.update(np.zeros(4))
 
 
 class TestRangeFilter:
@@ -7,7 +7,7 @@
 import numpy as np
 import pytest
 
-from med_heap import MedianHeap
+from med_heap import MedianHeap, IndexedMedianHeap, SortedWindow
 
 
 class TestMedianHeap:
@@ -116,3 +116,308 @@ class TestMedianHeap:
         med_heap.remove(4)
 
         assert med_heap.median() == 6
+
+    def test_compaction_bounds_memory(self):
+        """
+        Tests a long sliding window of random data with the default compaction policy.
+
+        The dirty dict must never hold zero counts, and the heaps must never hold more than (1 + compact_ratio) times the window (plus the dirty element that triggers compaction).
+        """
+        WINDOW = 25
+        rng = np.random.RandomState(4)
+        data = rng.uniform(0.03, 50, size=5000)
+
+        med_heap = MedianHeap(compact_ratio=1.0)
+        for i, datum in enumerate(data):
+            if i >= WINDOW:
+                med_heap.remove(data[i - WINDOW])
+            med_heap.push(datum)
+
+            assert med_heap.median() == np.median(data[max(0, i - WINDOW + 1):i + 1])
+            assert all(count > 0 for count in med_heap.dirty.values())
+            assert med_heap.dead == sum(med_heap.dirty.values())
+            assert len(med_heap.max_heap) + len(med_heap.min_heap) <= 2 * WINDOW + 1
+
+    def test_compact(self):
+        """ Tests that compact() drops every dirty element, and leaves a balanced heap with the same median. """
+        med_heap = MedianHeap(compact_ratio=None)
+
+        for i in range(1,12):
+            med_heap.push(i)
+        for i in [2, 3, 9, 10]:
+            med_heap.remove(i)
+
+        median = med_heap.median()
+        assert med_heap.dead > 0
+
+        med_heap.compact()
+
+        assert med_heap.dirty == {}
+        assert med_heap.dead == 0
+        assert med_heap.offset == 0
+        assert med_heap.is_balanced()
+        assert sorted([-x for x in med_heap.max_heap] + med_heap.min_heap) == [1, 4, 5, 6, 7, 8, 11]
+        assert med_heap.median() == median
+
+
+    def test_stats(self):
+        """ Tests that stats() reports the live elements, the physical heap sizes and the dirty elements after a lazy delete. """
+        med_heap = MedianHeap(compact_ratio=None)
+
+        for i in range(1,8):
+            med_heap.push(i)
+        med_heap.remove(2)
+
+        stats = med_heap.stats()
+        assert stats["live"] == 6
+        assert stats["max_heap"] + stats["min_heap"] == 7
+        assert stats["dead"] == 1
+        assert stats["dirty_keys"] == 1
+        assert stats["offset"] == med_heap.offset
+
+    def test_from_sorted(self):
+        """ Tests that building a MedianHeap in bulk from sorted values gives the same medians as pushing them, and that the result slides correctly. """
+        rng = np.random.RandomState(20)
+        data = rng.randint(0, 20, size=200).astype(float).tolist()
+        WINDOW = 15
+
+        med_heap = MedianHeap.from_sorted(sorted(data[:WINDOW]))
+        assert med_heap.median() == np.median(data[:WINDOW])
+        for i in range(WINDOW, len(data)):
+            med_heap.remove(data[i - WINDOW])
+            med_heap.push(data[i])
+            assert med_heap.median() == np.median(data[i - WINDOW + 1:i + 1])
+
+        assert MedianHeap.from_sorted([]).median() is None
+
+
+class TestIndexedMedianHeap:
+    """ Correctness Tests for IndexedMedianHeap, a rolling-median heap data structure with eager, indexed deletion. """
+
+    def test_invalid_peek_remove(self):
+        """ Tests peeking at both heaps, and removing an element, when they are empty. """
+        med_heap = IndexedMedianHeap()
+
+        with pytest.raises(RuntimeError):
+            med_heap.min_top()
+
+        with pytest.raises(RuntimeError):
+            med_heap.max_top()
+
+        with pytest.raises(RuntimeError):
+            med_heap.remove(1)
+
+    def test_push_nan(self):
+        """ Tests that pushing (or sliding in) NaN is rejected before the heap is changed. """
+        med_heap = IndexedMedianHeap.from_iterable([1, 2, 3])
+
+        with pytest.raises(ValueError):
+            med_heap.push(float("nan"))
+
+        with pytest.raises(ValueError):
+            med_heap.slide(2, float("nan"))
+
+        assert len(med_heap) == 3
+        assert med_heap.median() == 2
+
+    def test_median_empty(self):
+        """ Tests computing the median of an empty heap. """
+        med_heap = IndexedMedianHeap()
+
+        assert med_heap.median() is None
+
+    def test_insert_remove_same(self):
+        """ Tests repeated insertions and removals of many identical elements. """
+        med_heap = IndexedMedianHeap()
+
+        for i in range(15):
+            med_heap.push(0)
+            assert med_heap.median() == 0
+
+        for i in range(6):
+            med_heap.remove(0)
+            assert med_heap.median() == 0
+
+        for i in range(11):
+            med_heap.push(1)
+        assert med_heap.median() == 1
+
+        for i in range(9):
+            med_heap.remove(0)
+            assert med_heap.median() == 1
+
+        assert len(med_heap) == 11
+        assert med_heap.stats()["live"] == 11
+        assert med_heap.stats()["value_keys"] == 1
+
+    def test_remove(self):
+        """ Tests insertion into an IndexedMedianHeap, and removal in a different order than before. """
+        med_heap = IndexedMedianHeap()
+
+        for i in range(1,8):
+            med_heap.push(i)
+
+        assert med_heap.median() == 4
+
+        for elem, expected in [(1, 4.5), (3, 5), (6, 4.5), (2, 5), (4, 6)]:
+            med_heap.remove(elem)
+            assert med_heap.median() == expected
+
+    def test_sliding_window_bounded(self):
+        """ Tests a long sliding window of random data against numpy.median, checking that the heap never holds more than the window. """
+        WINDOW = 25
+        rng = np.random.RandomState(2)
+        data = rng.randint(0, 20, size=2000).astype(float)
+
+        med_heap = IndexedMedianHeap()
+        for i, datum in enumerate(data):
+            if i >= WINDOW:
+                med_heap.remove(data[i - WINDOW])
+            med_heap.push(datum)
+
+            assert med_heap.median() == np.median(data[max(0, i - WINDOW + 1):i + 1])
+            assert len(med_heap.max_heap) + len(med_heap.min_heap) <= WINDOW
+            assert sum(len(nodes) for nodes in med_heap.nodes.values()) == len(med_heap)
+
+    def test_from_sorted(self):
+        """ Tests that building an IndexedMedianHeap in bulk from sorted values gives the same medians as pushing them, and that the result slides correctly. """
+        rng = np.random.RandomState(21)
+        data = rng.randint(0, 20, size=200).astype(float).tolist()
+        WINDOW = 15
+
+        med_heap = IndexedMedianHeap.from_sorted(sorted(data[:WINDOW]))
+        assert med_heap.median() == np.median(data[:WINDOW])
+        for i in range(WINDOW, len(data)):
+            med_heap.remove(data[i - WINDOW])
+            med_heap.push(data[i])
+            assert med_heap.median() == np.median(data[i - WINDOW + 1:i + 1])
+
+        assert IndexedMedianHeap.from_sorted([]).median() is None
+
+
+class TestSortedWindow:
+    """ Correctness Tests for SortedWindow, an order-statistic sorted list with the same interface as MedianHeap. """
+
+    def test_invalid(self):
+        """ Tests invalid block sizes, and rank queries and removals on an empty window. """
+        with pytest.raises(ValueError):
+            SortedWindow(load=0)
+
+        window = SortedWindow()
+
+        assert window.median() is None
+
+        with pytest.raises(IndexError):
+            window.select(0)
+
+        with pytest.raises(RuntimeError):
+            window.remove(1)
+
+        window.push(1)
+        with pytest.raises(RuntimeError):
+            window.remove(0.5)
+
+    def test_nan(self):
+        """ Tests that NaN is rejected by push() and slide() before the window is changed, and that removing NaN reports a missing element rather than running off the end of a block. """
+        window = SortedWindow.from_iterable([1, 2, 3])
+
+        with pytest.raises(ValueError):
+            window.push(float("nan"))
+
+        with pytest.raises(ValueError):
+            window.slide(2, float("nan"))
+
+        with pytest.raises(RuntimeError):
+            window.remove(float("nan"))
+
+        with pytest.raises(RuntimeError):
+            window.slide(float("nan"), 2)
+
+        assert len(window) == 3
+        assert window.median() == 2
+
+    def test_remove(self):
+        """ Tests insertion into a SortedWindow, and removal in a different order than before. """
+        window = SortedWindow(load=2)
+
+        for i in range(1,8):
+            window.push(i)
+
+        assert window.median() == 4
+
+        for elem, expected in [(1, 4.5), (3, 5), (6, 4.5), (2, 5), (4, 6)]:
+            window.remove(elem)
+            assert window.median() == expected
+
+    @pytest.mark.parametrize("load", [1, 3, 64])
+    def test_rank_queries(self, load):
+        """ Tests a long sliding window of random data against a sorted copy, checking the median and arbitrary ranks, and that the window holds nothing but its elements. """
+        WINDOW = 40
+        rng = np.random.RandomState(10)
+        data = rng.randint(0, 20, size=1500).astype(float)
+
+        window = SortedWindow(load=load)
+        for i, datum in enumerate(data):
+            if i >= WINDOW:
+                window.remove(data[i - WINDOW])
+            window.push(datum)
+
+            expected = sorted(data[max(0, i - WINDOW + 1):i + 1])
+            assert window.median() == np.median(expected)
+            assert window[0] == expected[0]
+            assert window[-1] == expected[-1]
+            assert window[len(expected) // 3] == expected[len(expected) // 3]
+            assert sum(len(block) for block in window.blocks) == len(window) == len(expected)
+
+    def test_from_sorted(self):
+        """ Tests that building a SortedWindow in bulk from sorted values gives the same medians as pushing them, and that the result slides correctly. """
+        rng = np.random.RandomState(22)
+        data = rng.randint(0, 20, size=200).astype(float).tolist()
+        WINDOW = 15
+
+        window = SortedWindow.from_sorted(sorted(data[:WINDOW]), load=4)
+        assert window.median() == np.median(data[:WINDOW])
+        for i in range(WINDOW, len(data)):
+            window.remove(data[i - WINDOW])
+            window.push(data[i])
+            assert window.median() == np.median(data[i - WINDOW + 1:i + 1])
+
+        assert SortedWindow.from_sorted([]).median() is None
+
+class TestSlide:
+    """ Correctness Tests for slide() and from_iterable(), which every structure with the MedianHeap interface provides. """
+
+    STRUCTURES = [MedianHeap, IndexedMedianHeap, SortedWindow]
+
+    @pytest.mark.parametrize("window", [1, 2, 9, 30])
+    @pytest.mark.parametrize("structure", STRUCTURES)
+    def test_slide(self, structure, window):
+        """ Tests a long sliding window of random data with many duplicates against numpy.median, priming the structure with from_iterable() and sliding it with slide(). """
+        rng = np.random.RandomState(23)
+        data = rng.randint(0, 12, size=1500).astype(float).tolist()
+
+        med_heap = structure.from_iterable(data[:window])
+        assert med_heap.median() == np.median(data[:window])
+        for i in range(window, len(data)):
+            med_heap.slide(data[i - window], data[i])
+            assert med_heap.median() == np.median(data[i - window + 1:i + 1])
+
+    def test_slide_compacts(self):
+        """ Tests that sliding a MedianHeap still compacts its dirty elements. """
+        rng = np.random.RandomState(24)
+        data = rng.uniform(0, 1, size=2000).tolist()
+        WINDOW = 20
+
+        med_heap = MedianHeap.from_iterable(data[:WINDOW], compact_ratio=1.0)
+        for i in range(WINDOW, len(data)):
+            med_heap.slide(data[i - WINDOW], data[i])
+            assert med_heap.live_size() == WINDOW
+            assert len(med_heap.max_heap) + len(med_heap.min_heap) <= 2 * WINDOW + 1
+
+    @pytest.mark.parametrize("structure", [IndexedMedianHeap, SortedWindow])
+    def test_slide_missing(self, structure):
+        """ Tests sliding out an element that is not in an eagerly-deleting structure. """
+        med_heap = structure.from_iterable([1, 2, 3])
+
+        with pytest.raises(RuntimeError):
+            med_heap.slide(5, 2)
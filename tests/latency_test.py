@@ -0,0 +1,68 @@
+"""
+    This file defines unit tests for the LatencyHistogram found in latency.py.
+
+    :author - Nick Tripp, 2018
+"""
+
+import pytest
+
+from latency import LatencyHistogram
+
+
+class TestLatencyHistogram:
+    """ Correctness Tests for LatencyHistogram, a fixed-memory log-bucketed histogram of latencies. """
+
+    def test_invalid(self):
+        """ Tests creating a histogram with an invalid deadline, and asking for an invalid percentile. """
+        with pytest.raises(ValueError):
+            LatencyHistogram(deadline=0)
+
+        with pytest.raises(ValueError):
+            LatencyHistogram().percentile(1.5)
+
+    def test_empty(self):
+        """ Tests summarizing a histogram with nothing recorded. """
+        summary = LatencyHistogram().summary()
+
+        assert summary["count"] == 0
+        assert summary["p50"] is None
+        assert summary["max"] is None
+
+    def test_buckets(self):
+        """ Tests that every latency falls in a bucket whose upper edge is within 1/SUB_BUCKETS of it, and that buckets are contiguous. """
+        for ns in list(range(0, 5000)) + [10**6 + 7, 123456789, 10**12]:
+            idx = LatencyHistogram.bucket_index(ns)
+            upper = LatencyHistogram.bucket_upper(idx)
+            assert ns <= upper <= ns + ns / LatencyHistogram.SUB_BUCKETS
+            if idx > 0:
+                assert LatencyHistogram.bucket_upper(idx - 1) < ns
+
+    def test_fixed_memory(self):
+        """ Tests that recording any latency, however large, never grows the histogram. """
+        histogram = LatencyHistogram()
+        size = len(histogram.buckets)
+
+        for ns in [0, 1, 10**9, 2**50]:
+            histogram.record(ns)
+
+        assert len(histogram.buckets) == size
+        assert histogram.max_ns == 2**50
+
+    def test_percentiles(self):
+        """ Tests percentiles, the max and the deadline count over 1000 evenly spaced latencies of 1us to 1ms. """
+        histogram = LatencyHistogram(deadline=0.0005)
+        for i in range(1, 1001):
+            histogram.record(i * 1000)
+
+        summary = histogram.summary()
+        assert summary["count"] == 1000
+        assert summary["max"] == 0.001
+        assert summary["mean"] == pytest.approx(0.0005005)
+        assert 0.0005 <= summary["p50"] <= 0.0005 * (1 + 1.0 / LatencyHistogram.SUB_BUCKETS)
+        assert 0.00099 <= summary["p99"] <= 0.001
+        assert summary["p99.9"] == 0.001
+        assert summary["over_deadline"] == 500
+
+        histogram.reset()
+        assert histogram.summary()["count"] == 0
+        assert sum(histogram.buckets) == 0
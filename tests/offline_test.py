@@ -0,0 +1,71 @@
+"""
+    This file defines unit tests for the offline filtering of recorded scan logs found in offline.py.
+
+    :author - Nick Tripp, 2018
+"""
+
+import pytest
+import numpy as np
+
+from filter import RangeFilter, TemporalMedianFilter
+import offline
+
+
+class TestOffline:
+    """ Correctness Tests for filter_file(), which filters memory-mapped scan logs in chunks. """
+
+    def test_filter_npy(self, tmp_path):
+        """ Tests that filtering a '.npy' log in chunks gives the same results as filtering every scan in turn. """
+        WINDOW = 4
+        SCAN_SIZE = 16
+        rng = np.random.RandomState(7)
+        scans = rng.uniform(0.0, 60.0, size=(100, SCAN_SIZE))
+        np.save(str(tmp_path / "in.npy"), scans)
+
+        range_filter = RangeFilter(minimum=1.0, maximum=50.0)
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_NUMPY)
+        expected = np.array([med_filter.update(range_filter.update(scan)) for scan in scans])
+
+        reports = []
+        summary = offline.filter_file(
+            str(tmp_path / "in.npy"), str(tmp_path / "out.npy"), window=WINDOW, minimum=1.0, maximum=50.0,
+            chunk_size=30, progress=lambda *report: reports.append(report)
+        )
+
+        np.testing.assert_array_equal(np.load(str(tmp_path / "out.npy")), expected)
+        assert summary["scans"] == 100
+        assert [report[0] for report in reports] == [30, 60, 90, 100]
+        assert reports[-1][2] == scans.nbytes
+
+    def test_filter_raw_float32(self, tmp_path):
+        """ Tests filtering a raw float32 log with the command line entry point. """
+        WINDOW = 3
+        SCAN_SIZE = 10
+        rng = np.random.RandomState(8)
+        scans = rng.uniform(0.0, 60.0, size=(25, SCAN_SIZE)).astype(np.float32)
+        scans.tofile(str(tmp_path / "in.raw"))
+
+        expected = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_NUMPY).update_batch(scans)
+
+        assert offline.main([str(tmp_path / "in.raw"), str(tmp_path / "out.raw"), "--scan-size", str(SCAN_SIZE),
+                             "--dtype", "float32", "--window", str(WINDOW), "--chunk-size", "7", "--quiet"]) == 0
+
+        result = np.fromfile(str(tmp_path / "out.raw"), dtype=np.float32).reshape(-1, SCAN_SIZE)
+        np.testing.assert_array_equal(result, expected.astype(np.float32))
+
+    def test_invalid(self, tmp_path):
+        """ Tests filtering with no filters, a raw log with no scan size or a partial scan, and a '.npy' log that isn't 2D. """
+        np.zeros(15).tofile(str(tmp_path / "in.raw"))
+        np.save(str(tmp_path / "in.npy"), np.zeros(15))
+
+        with pytest.raises(ValueError):
+            offline.filter_file(str(tmp_path / "in.raw"), str(tmp_path / "out.raw"), scan_size=5)
+
+        with pytest.raises(ValueError):
+            offline.filter_file(str(tmp_path / "in.raw"), str(tmp_path / "out.raw"), window=3)
+
+        with pytest.raises(ValueError):
+            offline.filter_file(str(tmp_path / "in.raw"), str(tmp_path / "out.raw"), window=3, scan_size=4)
+
+        with pytest.raises(ValueError):
+            offline.filter_file(str(tmp_path / "in.npy"), str(tmp_path / "out.npy"), window=3)
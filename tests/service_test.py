@@ -0,0 +1,113 @@
+"""
+    This file defines unit tests for the asyncio filtering service found in service.py.
+
+    :author - Nick Tripp, 2018
+"""
+
+import asyncio
+import os
+import tempfile
+
+import pytest
+import numpy as np
+
+from filter import TemporalMedianFilter
+from service import FilterService, SensorClient
+
+
+WINDOW = 3
+SCAN_SIZE = 6
+SENSORS = 4
+
+
+def expected_results(scans):
+    """ Filters each sensor's scans with a filter of its own, one scan at a time. """
+    results = []
+    for sensor_scans in scans:
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=TemporalMedianFilter.TYPE_NUMPY)
+        results.append([med_filter.update(scan) for scan in sensor_scans])
+    return np.array(results)
+
+
+class TestFilterService:
+    """ Correctness Tests for FilterService, which filters the scans of many sensors from one asyncio task. """
+
+    def test_sensors_are_independent(self):
+        """ Tests that concurrent sensors each get the same results as a filter of their own. """
+        rng = np.random.RandomState(11)
+        scans = rng.uniform(0.03, 50, size=(SENSORS, 20, SCAN_SIZE))
+
+        async def sensor(service, sensor_id):
+            return [await service.update(sensor_id, scan) for scan in scans[sensor_id]]
+
+        async def main():
+            async with FilterService(WINDOW, SCAN_SIZE, max_pending=4) as service:
+                return await asyncio.gather(*(sensor(service, i) for i in range(SENSORS)))
+
+        np.testing.assert_array_equal(np.array(asyncio.run(main())), expected_results(scans))
+
+    def test_coalescing_and_backpressure(self):
+        """ Tests that a sensor's queued scans are filtered together, in order, and that its queue never holds more than max_pending scans. """
+        MAX_PENDING = 3
+        rng = np.random.RandomState(12)
+        scans = rng.uniform(0.03, 50, size=(1, 10, SCAN_SIZE))
+        ticks = []
+
+        async def main():
+            service = FilterService(WINDOW, SCAN_SIZE, max_pending=MAX_PENDING)
+            tick = service.tick
+
+            def counting_tick():
+                ticks.append(max(state.queue.qsize() for state in service.sensors.values()))
+                return tick()
+
+            service.tick = counting_tick
+            async with service:
+                return await asyncio.gather(*(service.update(0, scan) for scan in scans[0]))
+
+        results = asyncio.run(main())
+
+        np.testing.assert_array_equal(np.array([results]), expected_results(scans))
+        assert max(ticks) == MAX_PENDING
+        assert len(ticks) < len(scans[0])
+
+    def test_unix_socket(self):
+        """ Tests filtering the scans of several sensors over one Unix socket. """
+        rng = np.random.RandomState(13)
+        scans = rng.uniform(0.03, 50, size=(2, 8, SCAN_SIZE))
+
+        async def sensor(path, sensor_id):
+            client = await SensorClient.connect(path, SCAN_SIZE)
+            try:
+                return [await client.update(sensor_id, scan) for scan in scans[sensor_id]]
+            finally:
+                await client.close()
+
+        async def main(path):
+            async with FilterService(WINDOW, SCAN_SIZE) as service:
+                await service.serve_unix(path)
+                return await asyncio.gather(sensor(path, 0), sensor(path, 1))
+
+        with tempfile.TemporaryDirectory() as directory:
+            results = asyncio.run(main(os.path.join(directory, "filter.sock")))
+
+        np.testing.assert_array_equal(np.array(results), expected_results(scans))
+
+    def test_invalid(self):
+        """ Tests invalid specs, updating a service that isn't started, and updating with a scan of the wrong size. """
+        with pytest.raises(ValueError):
+            FilterService(WINDOW, SCAN_SIZE, max_pending=0)
+
+        with pytest.raises(ValueError):
+            FilterService(0, SCAN_SIZE)
+
+        async def main():
+            service = FilterService(WINDOW, SCAN_SIZE)
+            with pytest.raises(RuntimeError):
+                await service.update(0, np.zeros(SCAN_SIZE))
+
+            async with service:
+                with pytest.raises(ValueError):
+                    await service.update(0, np.zeros(SCAN_SIZE + 1))
+
+        asyncio.run(main())
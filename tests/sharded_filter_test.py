@@ -0,0 +1,58 @@
+"""
+    This file defines unit tests for the process-sharded filter defined in sharded_filter.py.
+
+    :author - Nick Tripp, 2018
+"""
+
+import numpy as np
+import pytest
+
+from filter import TemporalMedianFilter
+from sharded_filter import ShardedTemporalMedianFilter
+
+
+class TestShardedTemporalMedianFilter:
+    """ Correctness Tests for ShardedTemporalMedianFilter, a sliding-window-median filter sharded across worker processes. """
+
+    def test_init_invalid(self):
+        """ Tests filter initalization with invalid parameters; no workers should be started. """
+        with pytest.raises(ValueError):
+            ShardedTemporalMedianFilter(0, 10)
+
+        with pytest.raises(ValueError):
+            ShardedTemporalMedianFilter(3, 0)
+
+        with pytest.raises(ValueError):
+            ShardedTemporalMedianFilter(3, 10, workers=0)
+
+        with pytest.raises(ValueError):
+            ShardedTemporalMedianFilter(3, 10, f_type="NotAType")
+
+    @pytest.mark.parametrize("f_type", [TemporalMedianFilter.TYPE_HEAP, TemporalMedianFilter.TYPE_NUMPY])
+    def test_matches_unsharded(self, f_type):
+        """ Tests that sharding the columns across workers gives exactly the same results as a single filter. """
+        WINDOW = 4
+        SCAN_SIZE = 11
+        rng = np.random.RandomState(8)
+        scans = rng.uniform(0.03, 50, size=(30, SCAN_SIZE))
+
+        med_filter = TemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type)
+        expected = med_filter.update_batch(scans)
+
+        with ShardedTemporalMedianFilter(WINDOW, SCAN_SIZE, f_type=f_type, workers=3) as sharded_filter:
+            assert sharded_filter.workers == 3
+            np.testing.assert_array_equal(sharded_filter.update_batch(scans[:10]), expected[:10])
+            for scan, expected_median in zip(scans[10:], expected[10:]):
+                np.testing.assert_array_equal(sharded_filter.update(scan), expected_median)
+
+    def test_closed(self):
+        """ Tests that the workers are capped at scan_size, that close() is idempotent, and that a closed filter cannot be updated. """
+        sharded_filter = ShardedTemporalMedianFilter(3, 2, workers=4)
+        assert sharded_filter.workers == 2
+
+        sharded_filter.close()
+        sharded_filter.close()
+        assert not any(process.is_alive() for process in sharded_filter.processes)
+
+        with pytest.raises(RuntimeError):
+            sharded_filter.update(np.ones(2))